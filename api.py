@@ -1,28 +1,202 @@
-from flask import Flask, send_file, jsonify
+import json
+import os
+import time
+from typing import Callable, Iterator
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    jsonify,
+    request,
+    send_file,
+    stream_with_context,
+)
 from flask_cors import CORS
+from werkzeug.http import is_resource_modified
 import click
+import metrics
 from saver import Saver
+from saver_pool import DEFAULT_POOL_SIZE, SaverPool
 from card_id import CardID
+from crypt_image import SealedImageError
+from image_cache import CachedImage, ImageCache
+from thumbnail_cache import ThumbnailCache, thumbnail_width
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+# How many names to fetch from the database at a time when streaming.
+STREAM_PAGE_SIZE = 1000
+# The most names a JSON listing returns at once; clients page for the rest.
+MAX_PAGE_SIZE = 1000
+# How long browsers may use an image before revalidating it.
+IMAGE_MAX_AGE = 60
+# The metadata fields the API exposes, besides the image's URL.
+METADATA_FIELDS = ("creator", "name", "riddle", "solution")
 
 app = Flask(__name__)
-CORS(app)
-saver: Saver = None
+CORS(app, expose_headers=["ETag", "Last-Modified", "X-Next-Cursor"])
+saver_pool: SaverPool = None
+image_cache = ImageCache()
+thumbnail_cache: ThumbnailCache = None
+
+REQUEST_SECONDS = metrics.histogram(
+    "cardazim_api_request_seconds",
+    "Time to handle an API request, until its response starts.",
+    ["route", "method"],
+)
+RESPONSES = metrics.counter(
+    "cardazim_api_responses_total",
+    "API responses, by route and status.",
+    ["route", "status"],
+)
+
+
+def use_database(
+    database_url: str,
+    thumbnails: ThumbnailCache = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+):
+    """
+    Serve the cards in the database at `database_url`, with up to `pool_size`
+    requests using it at once, and cache their thumbnails in `thumbnails` (by
+    default, in a temporary directory).
+    """
+    # pylint: disable-next=global-statement
+    global saver_pool, thumbnail_cache
+    thumbnail_cache = thumbnails or ThumbnailCache()
+    saver_pool = SaverPool(database_url, pool_size, _setup_saver)
+    image_cache.clear()
+
+
+def _setup_saver(saver: Saver):
+    saver.add_save_listener(image_cache.invalidate_card)
+
+
+def get_saver() -> Saver:
+    """The Saver of the current request, borrowed from the pool until it ends."""
+    if "saver" not in g:
+        g.saver = saver_pool.acquire()
+    return g.saver
+
+
+@app.teardown_appcontext
+def release_saver(_exception: BaseException = None):
+    """Return the request's Saver to the pool."""
+    saver = g.pop("saver", None)
+    if saver is not None:
+        saver_pool.release(saver)
+
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, to time it."""
+    if metrics.enabled():
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    """Record how long the request took, and its status, by route."""
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.labels(route, request.method).observe(
+            time.perf_counter() - start
+        )
+        RESPONSES.labels(route, response.status_code).inc()
+    return response
 
 
 @app.route("/creators/")
 def get_creators():
     """
-    Get a list of all creators in a JSON format.
+    Get a sorted list of creators in a JSON format.
+
+    Pages through them with the `limit` and `cursor` query parameters, where `cursor`
+    is the last creator of the previous page. See `listing_response`.
     """
-    return saver.get_creators()
+    return listing_response(
+        lambda cursor, limit: get_saver().get_creators(cursor, limit)
+    )
 
 
 @app.route("/creators/<creator>/cards/")
 def get_cards(creator: str):
     """
-    Get a list of the names of all the cards a creator has submitted in a JSON format.
+    Get a sorted list of the names of the cards a creator has submitted in a JSON
+    format, paged like `get_creators`.
+    """
+    return listing_response(
+        lambda cursor, limit: get_saver().get_cards(creator, cursor, limit)
+    )
+
+
+def listing_response(get_page: Callable[[str, int], list[str]]) -> Response:
+    """
+    Respond with the names listed by `get_page(cursor, limit)`, for the `cursor` and
+    `limit` query parameters.
+
+    The response is a JSON list of up to `limit` names, and at most `MAX_PAGE_SIZE`,
+    with an `X-Next-Cursor` header if there may be more pages. If `format=ndjson`
+    is given or NDJSON is preferred by the `Accept` header, the names are streamed
+    as NDJSON instead, a page at a time. A `limit` that isn't positive gets a 400.
+
+    Listings carry an `ETag` and `Last-Modified` from the catalogue's version, and
+    conditional requests get a 304 when nothing was saved since. The JSON and NDJSON
+    listings have different ETags, and vary by the `Accept` header.
     """
-    return saver.get_cards(creator)
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit <= 0:
+        abort(400)
+    counter, last_modified = get_saver().get_catalogue_version()
+    ndjson = _wants_ndjson()
+    etag = f"catalogue-{counter}-{'ndjson' if ndjson else 'json'}"
+    if not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        response = Response(status=304)
+    else:
+        cursor = request.args.get("cursor")
+        if ndjson:
+            response = Response(
+                stream_with_context(_stream_ndjson(get_page, cursor, limit)),
+                mimetype=NDJSON_MIMETYPE,
+            )
+        else:
+            limit = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+            names = get_page(cursor, limit)
+            response = jsonify(names)
+            if names and len(names) == limit:
+                response.headers["X-Next-Cursor"] = names[-1]
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.vary.add("Accept")
+    return response
+
+
+def _wants_ndjson() -> bool:
+    """Whether the client asked for an NDJSON listing."""
+    if "format" in request.args:
+        return request.args["format"] == "ndjson"
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def _stream_ndjson(
+    get_page: Callable[[str, int], list[str]], cursor: str, limit: int
+) -> Iterator[str]:
+    """Yield up to `limit` names after `cursor` as NDJSON lines, a page at a time."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = STREAM_PAGE_SIZE
+        if remaining is not None:
+            page_size = min(page_size, remaining)
+            remaining -= page_size
+        names = get_page(cursor, page_size)
+        yield "".join(json.dumps(name) + "\n" for name in names)
+        if len(names) < page_size:
+            return
+        cursor = names[-1]
 
 
 @app.route("/creators/<creator>/cards/<card_name>/")
@@ -32,22 +206,73 @@ def get_card_metadata(creator: str, card_name: str):
 
     `creator`, `name`, `riddle`, `solution`, `image_path`
     """
-    metadata = saver.get_card_metadata(CardID(card_name, creator))
+    metadata = get_saver().get_card_metadata(CardID(card_name, creator))
+    response = {field: metadata[field] for field in METADATA_FIELDS}
     # Image path in HTML and not in file system to keep it RESTful.
-    metadata[
-        "image_path"
-    ] = f"/creators/{metadata['creator']}/cards/{metadata['name']}/image.jpg"
-    return metadata
+    response["image_path"] = (
+        f"/creators/{metadata['creator']}/cards/{metadata['name']}/image.jpg"
+    )
+    return response
 
 
 @app.route("/creators/<creator>/cards/<card_name>/image.jpg")
 def get_card_image(creator: str, card_name: str):
     """
     Get the image of a card via its creator and name.
+
+    The image is a JPEG exported from the stored card on the first request, and
+    its location is cached, so the database is only queried on a miss.
+    Responses carry a strong `ETag`, and conditional and range requests are
+    supported.
+
+    With `w`, a thumbnail at least `w` pixels wide (at most the image's width) is
+    sent instead.
+
+    Cards whose images were compressed before they were encrypted have no pixels
+    until they are solved, and get a 409.
+    """
+    card_id = CardID(card_name, creator)
+    width = request.args.get("w", type=int)
+    if width is not None and width <= 0:
+        abort(400)
+    width = thumbnail_width(width) if width is not None else None
+    try:
+        try:
+            return _send_image(image_cache.get(card_id, _get_image_path), width)
+        except FileNotFoundError:
+            # The cached image may have been moved since, so look it up once more.
+            image_cache.invalidate(card_id)
+            return _send_image(image_cache.get(card_id, _get_image_path), width)
+    except SealedImageError:
+        abort(409)
+
+
+def _get_image_path(card_id: CardID) -> str:
+    return get_saver().export_image(card_id)
+
+
+def _send_image(image: CachedImage, width: int = None) -> Response:
+    path, etag = image.path, image.etag
+    if width is not None:
+        path = thumbnail_cache.get(image.path, width)
+        etag = f"{etag}-w{width}"
+    return send_file(
+        path,
+        mimetype="image/jpeg",
+        etag=etag,
+        last_modified=image.last_modified,
+        max_age=IMAGE_MAX_AGE,
+        conditional=True,
+    )
+
+
+@app.route("/metrics")
+def get_metrics():
+    """
+    The metrics of this process, in the Prometheus text format. With gunicorn,
+    each worker has its own metrics.
     """
-    metadata = saver.get_card_metadata(CardID(card_name, creator))
-    image_path = metadata["image_path"]
-    return send_file(image_path)
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route("/")
@@ -77,15 +302,98 @@ def homepage():
     default="mongodb://127.0.0.1:27017",
     help="A URL for the database to use. Defaults to mongodb://127.0.0.1:27017",
 )
-def run_api_server(host: str, port: int | str, database_url: str):
+@click.option(
+    "--thumbnail-dir",
+    default=None,
+    help="Where to cache thumbnails. Defaults to a temporary directory",
+)
+@click.option(
+    "--thumbnail-cache-size",
+    default=256,
+    help="How many MiB of thumbnails to cache. Defaults to 256",
+)
+@click.option(
+    "--server",
+    type=click.Choice(["development", "waitress", "gunicorn"]),
+    default="development",
+    help="The server to run the API with. waitress and gunicorn are meant for "
+    "production. Defaults to Flask's development server",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    help="How many processes gunicorn runs. Defaults to the number of CPUs",
+)
+@click.option(
+    "--threads",
+    default=DEFAULT_POOL_SIZE,
+    help="How many requests each process handles at once, with waitress and "
+    f"gunicorn. Defaults to {DEFAULT_POOL_SIZE}",
+)
+@click.option(
+    "--metrics/--no-metrics",
+    "record_metrics",
+    default=True,
+    help="Whether to record the metrics served at /metrics. Defaults to recording",
+)
+def run_api_server(
+    host: str,
+    port: int | str,
+    database_url: str,
+    thumbnail_dir: str,
+    thumbnail_cache_size: int,
+    server: str,
+    workers: int,
+    threads: int,
+    record_metrics: bool,
+):
     """
     Run the REST API on `host:port`, using a database as defined by `database_url`.
     """
+    if not record_metrics:
+        metrics.disable()
     click.echo(f"Hosting on {host}:{port} with database {database_url}")
-    # pylint: disable-next=global-statement
-    global saver
-    saver = Saver(database_url)
-    app.run(host, port)
+    use_database(
+        database_url,
+        ThumbnailCache(thumbnail_dir, thumbnail_cache_size * 1024 * 1024),
+        threads,
+    )
+    if server == "waitress":
+        try:
+            import waitress  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise click.ClickException("waitress isn't installed.") from error
+        waitress.serve(app, host=host, port=port, threads=threads)
+    elif server == "gunicorn":
+        run_gunicorn(host, port, workers, threads)
+    else:
+        app.run(host, port, threaded=True)
+
+
+def run_gunicorn(host: str, port: int | str, workers: int, threads: int):
+    """
+    Run the API with gunicorn, in `workers` processes of `threads` threads each.
+    Every worker gets its own pool of Savers once it is forked.
+    """
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from gunicorn.app.base import BaseApplication
+    except ImportError as error:
+        raise click.ClickException("gunicorn isn't installed.") from error
+
+    class Application(BaseApplication):
+        """Runs `app` with the given options, instead of gunicorn's command line."""
+
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+
+        def load(self):
+            return app
+
+    Application().run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+"""
+Author: Eyal Roginski
+Description: A non-blocking Saver, for use from asyncio code.
+
+`AsyncSaver` has the same operations as `Saver`, as coroutines. The file driver
+runs the blocking `FileSaver` in a thread pool, with a bounded number of
+operations at once. The MongoDB driver talks to the database with motor, and only
+encodes and writes images in threads.
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable
+from furl import furl
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
+from blob_store import BLOBS_DIR_NAME, BlobStore
+from card import Card
+from card_id import CardID
+from file_saver import FileSaver
+from mongo_documents import (
+    CARD_INDEX,
+    CATALOGUE_VERSION_ID,
+    DUPLICATE_KEY_ERROR,
+    card_filter,
+    card_metadata,
+    cards_query,
+    creators_pipeline,
+    duplicate_cards_pipeline,
+    export_card_image,
+    load_card,
+    save_card_file,
+)
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class _CardLocks:
+    """
+    Locks by `CardID`, so concurrent saves of different cards overlap, while saves
+    of the same card don't interleave their files.
+    """
+
+    def __init__(self):
+        self._locks: dict[CardID, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._users: dict[CardID, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def hold(self, card_id: CardID) -> AsyncIterator[None]:
+        """Hold the lock of `card_id` for the duration of an `async with` block."""
+        self._users[card_id] += 1
+        try:
+            async with self._locks[card_id]:
+                yield
+        finally:
+            self._users[card_id] -= 1
+            if not self._users[card_id]:
+                del self._users[card_id]
+                del self._locks[card_id]
+
+    @asynccontextmanager
+    async def hold_many(self, card_ids: Iterable[CardID]) -> AsyncIterator[None]:
+        """Hold the locks of several cards, taken in order so saves don't deadlock."""
+        async with AsyncExitStack() as stack:
+            for card_id in sorted(set(card_ids)):
+                await stack.enter_async_context(self.hold(card_id))
+            yield
+
+
+class AsyncFileSaver:
+    """
+    Driver for saving and loading Cards from the file system without blocking, by
+    running a `FileSaver` in up to `max_concurrency` threads.
+    """
+
+    def __init__(self, path: str = ".", max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.saver = FileSaver(path)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="AsyncFileSaver"
+        )
+        self._card_locks = _CardLocks()
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    async def save(self, card: Card):
+        """Save the card, replacing it if it exists."""
+        async with self._card_locks.hold(CardID.from_card(card)):
+            await self._run(self.saver.save, card)
+
+    async def save_many(self, cards: Iterable[Card]):
+        """Save many cards at once, adding them all to the index in a single write."""
+        cards = list(cards)
+        async with self._card_locks.hold_many(map(CardID.from_card, cards)):
+            await self._run(self.saver.save_many, cards)
+
+    async def load(self, card_id: CardID) -> Card:
+        """Load a card by CardID."""
+        return await self._run(self.saver.load, card_id)
+
+    async def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
+        """Like `FileSaver.get_creators`."""
+        return await self._run(self.saver.get_creators, cursor, limit)
+
+    async def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
+        """Like `FileSaver.get_cards`."""
+        return await self._run(self.saver.get_cards, creator, cursor, limit)
+
+    async def get_card_metadata(self, card_id: CardID) -> dict[str, str]:
+        """Like `FileSaver.get_card_metadata`."""
+        return await self._run(self.saver.get_card_metadata, card_id)
+
+    async def get_catalogue_version(self) -> tuple[int, datetime]:
+        """Like `FileSaver.get_catalogue_version`."""
+        return await self._run(self.saver.get_catalogue_version)
+
+    async def export_image(self, card_id: CardID) -> str:
+        """Like `FileSaver.export_image`."""
+        return await self._run(self.saver.export_image, card_id)
+
+    def close(self):
+        """Wait for the running operations, and stop the threads."""
+        self._executor.shutdown()
+
+
+class AsyncMongoSaver:
+    """
+    Driver for saving Cards to a MongoDB database with motor. Card files are
+    written and read in up to `max_concurrency` threads, like `MongoSaver` does.
+    """
+
+    def __init__(
+        self,
+        mongo_path: str,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        image_dir: str | Path = Path("~/cardazim_images"),
+    ):
+        furl_path = furl(mongo_path)
+        self.codec = furl_path.args.get("codec")
+        self.client = AsyncIOMotorClient(furl_path.host, furl_path.port)
+        self.database = self.client.cardazim_db
+        self.collection = self.database.cardazim_collection
+        self.metadata_collection = self.database.cardazim_metadata
+        self.image_dir = Path(image_dir).expanduser().resolve()
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.blobs = BlobStore(self.image_dir / BLOBS_DIR_NAME)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="AsyncMongoSaver"
+        )
+        self._card_locks = _CardLocks()
+        self._has_index = False
+
+    async def _ensure_index(self):
+        """
+        Create the index `MongoSaver` creates, before the first write, keeping only
+        the newest document of cards saved several times before it existed.
+        """
+        if self._has_index:
+            return
+        try:
+            await self.collection.create_index(CARD_INDEX, unique=True)
+        except OperationFailure as error:
+            if error.code != DUPLICATE_KEY_ERROR:
+                raise
+            duplicates = [
+                card_id
+                async for doc in self.collection.aggregate(duplicate_cards_pipeline())
+                for card_id in doc["ids"][1:]
+            ]
+            await self.collection.delete_many({"_id": {"$in": duplicates}})
+            print(f"Deleted {len(duplicates)} stale duplicate card documents")
+            await self.collection.create_index(CARD_INDEX, unique=True)
+        self._has_index = True
+
+    async def _save_card_file(self, card: Card) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            save_card_file,
+            card,
+            self.image_dir,
+            self.blobs,
+            self.codec,
+        )
+
+    async def save(self, card: Card):
+        """Save a card, replacing it if it exists."""
+        await self._ensure_index()
+        card_id = CardID.from_card(card)
+        async with self._card_locks.hold(card_id):
+            metadata = await self._save_card_file(card)
+            await self.collection.replace_one(
+                card_filter(card_id), metadata, upsert=True
+            )
+        await self._bump_catalogue_version()
+
+    async def save_many(self, cards: Iterable[Card]):
+        """Save many cards with a single bulk write, encoding their images at once."""
+        await self._ensure_index()
+        cards = list(cards)
+        async with self._card_locks.hold_many(map(CardID.from_card, cards)):
+            documents = await asyncio.gather(
+                *(self._save_card_file(card) for card in cards)
+            )
+            if not documents:
+                return
+            await self.collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {"creator": doc["creator"], "name": doc["name"]},
+                        doc,
+                        upsert=True,
+                    )
+                    for doc in documents
+                ],
+                ordered=False,
+            )
+        await self._bump_catalogue_version()
+
+    async def load(self, card_id: CardID) -> Card:
+        """Load a card from the database."""
+        doc = await self.collection.find_one(card_filter(card_id))
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, load_card, doc
+        )
+
+    async def export_image(self, card_id: CardID) -> str:
+        """Like `MongoSaver.export_image`."""
+        doc = await self.collection.find_one(card_filter(card_id))
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, export_card_image, doc, self.blobs
+        )
+
+    async def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
+        """Like `MongoSaver.get_creators`."""
+        documents = self.collection.aggregate(creators_pipeline(cursor, limit))
+        return [doc["_id"] async for doc in documents]
+
+    async def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
+        """Like `MongoSaver.get_cards`."""
+        documents = self.collection.find(
+            cards_query(creator, cursor), projection=["name"]
+        ).sort("name", ASCENDING)
+        if limit is not None:
+            documents = documents.limit(limit)
+        return [doc["name"] async for doc in documents]
+
+    async def get_card_metadata(self, card_id: CardID) -> dict[str, str]:
+        """Like `MongoSaver.get_card_metadata`."""
+        return card_metadata(await self.collection.find_one(card_filter(card_id)))
+
+    async def get_catalogue_version(self) -> tuple[int, datetime]:
+        """Like `MongoSaver.get_catalogue_version`."""
+        doc = await self.metadata_collection.find_one({"_id": CATALOGUE_VERSION_ID})
+        if doc is None:
+            return 0, datetime.fromtimestamp(0, timezone.utc)
+        return doc["counter"], doc["last_modified"].replace(tzinfo=timezone.utc)
+
+    async def _bump_catalogue_version(self):
+        await self.metadata_collection.update_one(
+            {"_id": CATALOGUE_VERSION_ID},
+            {
+                "$inc": {"counter": 1},
+                "$set": {"last_modified": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+        )
+
+    def close(self):
+        """Wait for the running image writes, and close the connection."""
+        self._executor.shutdown()
+        self.client.close()
+
+
+ASYNC_SAVER_DRIVERS: dict[str, type] = {"file": AsyncFileSaver}
+if AsyncIOMotorClient is not None:
+    ASYNC_SAVER_DRIVERS["mongodb"] = AsyncMongoSaver
+
+
+class AsyncSaver:
+    """
+    Saver for Cards that doesn't block the event loop, with up to
+    `max_concurrency` blocking operations (such as writing images) at once. Other
+    keyword `options`, such as the `image_dir` of MongoDB, go to the driver.
+    """
+
+    def __init__(
+        self, path: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, **options
+    ):
+        scheme = furl(path).scheme
+        if scheme not in ASYNC_SAVER_DRIVERS:
+            raise RuntimeError(f"No async saver driver for {scheme}:// URLs.")
+        self.driver = ASYNC_SAVER_DRIVERS[scheme](path, max_concurrency, **options)
+        self.save_listeners: list[Callable[[Card], None]] = []
+
+    def add_save_listener(self, listener: Callable[[Card], None]):
+        """Call `listener(card)` after every card saved through this saver."""
+        self.save_listeners.append(listener)
+
+    async def save(self, card: Card):
+        """
+        Save the card using the driver.
+        """
+        await self.driver.save(card)
+        self._notify_saved(card)
+
+    async def save_many(self, cards: Iterable[Card]):
+        """
+        Save many cards at once using the driver, which batches the writes.
+        """
+        cards = list(cards)
+        await self.driver.save_many(cards)
+        for card in cards:
+            self._notify_saved(card)
+
+    def _notify_saved(self, card: Card):
+        """Call the save listeners, which can't fail a save that succeeded."""
+        for listener in self.save_listeners:
+            try:
+                listener(card)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(f"Save listener {listener!r} failed: {error}")
+
+    async def load(self, card_id: CardID) -> Card:
+        """
+        Load a card via `CardID` using the driver.
+        """
+        return await self.driver.load(card_id)
+
+    async def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
+        """
+        Get a sorted list of creators' names, paged like `Saver.get_creators`.
+        """
+        return await self.driver.get_creators(cursor, limit)
+
+    async def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
+        """
+        Get a sorted list of the names of the cards a creator has submitted, paged
+        like `Saver.get_cards`.
+        """
+        return await self.driver.get_cards(creator, cursor, limit)
+
+    async def get_card_metadata(self, card_id: CardID) -> dict:
+        """
+        Get a card's metadata via its ID.
+        """
+        return await self.driver.get_card_metadata(card_id)
+
+    async def get_catalogue_version(self) -> tuple[int, datetime]:
+        """
+        Get a counter that grows whenever a card is saved, and the time of the
+        last save, like `Saver.get_catalogue_version`.
+        """
+        return await self.driver.get_catalogue_version()
+
+    async def export_image(self, card_id: CardID) -> str:
+        """
+        Get the path of a JPEG of the card's image, like `Saver.export_image`.
+        """
+        return await self.driver.export_image(card_id)
+
+    def close(self):
+        """Close the driver, waiting for its running operations."""
+        self.driver.close()
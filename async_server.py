@@ -0,0 +1,221 @@
+"""
+Author: Eyal Roginski
+Description: Cardazim server on top of asyncio, for many concurrent clients.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from connection import (
+    ACK,
+    ACK_NAMES,
+    ACK_MALFORMED,
+    ACK_OK,
+    ACK_REJECTED,
+    FLAG_ACK_REQUESTED,
+    FRAME_HEADER,
+    FRAME_MAGIC,
+    RECV_BUFSIZE,
+    DEFAULT_MAX_FRAME_SIZE,
+    FRAME_RECEIVE_SECONDS,
+    RECEIVED_BYTES,
+    RECEIVED_CARDS,
+    pack_frame_header,
+    unpack_frame_header,
+)
+from card import Card
+from save_queue import QueueFullError, SaveQueue
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+async def read_frame(
+    reader: asyncio.StreamReader,
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    allow_legacy: bool = False,
+) -> tuple[int, bytes]:
+    """
+    The asyncio counterpart of `Connection.receive_frame`: reads a single frame
+    from `reader` and returns `(flags, payload)`. If it is malformed, raises
+    `RuntimeError`, and if the peer closed cleanly before it, raises `EOFError`.
+    """
+    header = await read_frame_header(reader)
+    return await read_frame_payload(reader, header, max_frame_size, allow_legacy)
+
+
+async def read_frame_header(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read the raw header of the next frame. Raises `EOFError` if the peer closed
+    cleanly before it.
+    """
+    try:
+        return await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial:
+            raise EOFError("Connection closed.") from exc
+        raise RuntimeError(
+            f"Connection closed after {len(exc.partial)} of {exc.expected} bytes."
+        ) from exc
+
+
+async def read_frame_payload(
+    reader: asyncio.StreamReader,
+    header: bytes,
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    allow_legacy: bool = False,
+) -> tuple[int, bytes]:
+    """Read the rest of the frame whose raw header is `header`."""
+    if allow_legacy and header[: len(FRAME_MAGIC)] != FRAME_MAGIC:
+        return 0, await _read_legacy(reader, header, max_frame_size)
+    flags, length = unpack_frame_header(header, max_frame_size)
+    try:
+        with FRAME_RECEIVE_SECONDS.time():
+            payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as exc:
+        raise RuntimeError(
+            f"Connection closed after {len(exc.partial)} of {exc.expected} bytes."
+        ) from exc
+    RECEIVED_BYTES.inc(length)
+    return flags, payload
+
+
+async def _read_legacy(
+    reader: asyncio.StreamReader, prefix: bytes, max_frame_size: int
+) -> bytes:
+    """Read an unframed message, which ends when the peer closes the connection."""
+    data = bytearray(prefix)
+    while part := await reader.read(RECV_BUFSIZE):
+        data += part
+        if len(data) > max_frame_size:
+            raise RuntimeError(
+                f"Legacy message exceeds the maximum of {max_frame_size} bytes."
+            )
+    return bytes(data)
+
+
+def describe_peer(writer: asyncio.StreamWriter) -> str:
+    """Describe the connection behind `writer` the same way `Connection` does."""
+    return (
+        f"<Connection from {writer.get_extra_info('sockname')} "
+        f"to {writer.get_extra_info('peername')}>"
+    )
+
+
+class AsyncServer:
+    """
+    Receives cards with asyncio streams instead of a thread per connection.
+
+    At most `max_concurrency` messages are read and deserialized at once. Other
+    connections with a pending message wait without being read from, so their
+    clients are slowed down by TCP flow control rather than having their cards
+    buffered in memory.
+    """
+
+    def __init__(
+        self,
+        allow_legacy: bool = False,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        save_queue: SaveQueue = None,
+    ):
+        self.allow_legacy = allow_legacy
+        self.save_queue = save_queue
+        self.max_frame_size = max_frame_size
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.slots = asyncio.Semaphore(max_concurrency)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """
+        Handle the connection: receives cards from the connection until it is closed,
+        parses them, prints them to the screen and queues them to be saved,
+        acknowledging them like `server.handle_connection` does.
+        """
+        try:
+            sequence = 0
+            while True:
+                try:
+                    flags, status = await self.handle_frame(reader, writer)
+                except (EOFError, OSError):
+                    return
+                except RuntimeError:
+                    print(f"Got malformed message from {describe_peer(writer)}")
+                    return
+                RECEIVED_CARDS.labels(ACK_NAMES[status]).inc()
+
+                if flags & FLAG_ACK_REQUESTED:
+                    writer.write(pack_frame_header(ACK.size))
+                    writer.write(ACK.pack(sequence, status))
+                    try:
+                        await writer.drain()
+                    except OSError:
+                        return
+                sequence += 1
+        finally:
+            writer.close()
+
+    async def handle_frame(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> tuple[int, int]:
+        """
+        Receive and handle a single card frame. Returns its flags and the status
+        to acknowledge it with.
+        """
+        loop = asyncio.get_running_loop()
+        # Idle connections wait for their next header without holding a slot.
+        header = await read_frame_header(reader)
+        async with self.slots:
+            flags, packet = await read_frame_payload(
+                reader, header, self.max_frame_size, self.allow_legacy
+            )
+            try:
+                card = await loop.run_in_executor(
+                    self.executor, Card.deserialize, packet
+                )
+            except RuntimeError:
+                print(f"Got malformed message from {describe_peer(writer)}")
+                return flags, ACK_MALFORMED
+        print(f"Received card '{card.name}' by {card.creator}")
+        if self.save_queue is not None:
+            try:
+                # A blocking queue applies back pressure to this connection only.
+                await loop.run_in_executor(
+                    self.executor, self.save_queue.put, card, packet
+                )
+            except QueueFullError:
+                return flags, ACK_REJECTED
+        return flags, ACK_OK
+
+    async def serve(self, ip: str, port: str | int):
+        """Infinitely listens for cards on `ip:port`."""
+        server = await asyncio.start_server(self.handle_connection, ip, int(port))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """Stop the executor, waiting for running deserializations."""
+        self.executor.shutdown()
+
+
+def run_async_server(
+    ip: str,
+    port: str | int,
+    allow_legacy: bool = False,
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    save_queue: SaveQueue = None,
+):
+    """
+    Infinitely listens for data being sent to the server and prints it
+    to the terminal, using asyncio, and queues the cards in `save_queue` if there is
+    one.
+    """
+
+    async def serve():
+        server = AsyncServer(allow_legacy, max_frame_size, max_concurrency, save_queue)
+        try:
+            await server.serve(ip, port)
+        finally:
+            server.close()
+
+    asyncio.run(serve())
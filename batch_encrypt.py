@@ -0,0 +1,108 @@
+"""
+Author: Eyal Roginski
+Description: Encrypt a directory of images into serialized cards, using every core.
+
+Every image `<name>.<ext>` in the input directory needs a `<name>.json` next to it
+with its `riddle` and `solution`. The card is written to `<creator>_<name>` in the
+output directory.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from card import Card
+from card_codecs import CODECS
+from card_id import CardID
+
+
+def encrypt_image(
+    image_path: Path, creator: str, output_dir: Path, codec: str = None
+) -> Path:
+    """Encrypt the image at `image_path` into a serialized card, and return its path."""
+    with open(image_path.with_suffix(".json"), encoding="utf-8") as details_file:
+        details = json.load(details_file)
+    card = Card.create_from_path(
+        image_path.stem, creator, image_path, details["riddle"], details["solution"]
+    )
+    card.encrypt(codec=codec)
+    card_path = output_dir / CardID.from_card(card).resolve()
+    with open(card_path, "wb") as card_file:
+        card.write_to(card_file)
+    return card_path
+
+
+def find_images(input_dir: Path) -> list[Path]:
+    """Find the images in `input_dir` that have riddle details next to them."""
+    return [
+        path
+        for path in sorted(input_dir.iterdir())
+        if path.is_file()
+        and path.suffix != ".json"
+        and path.with_suffix(".json").is_file()
+    ]
+
+
+def encrypt_directory(
+    input_dir: str | Path,
+    output_dir: str | Path,
+    creator: str,
+    workers: int = None,
+    codec: str = None,
+) -> list[Path]:
+    """
+    Encrypt every image in `input_dir` into a card in `output_dir`, with a pool of
+    `workers` threads (defaults to one per CPU). Decoding, encryption and writing
+    all release the GIL, so the threads run on every core.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    images = find_images(Path(input_dir))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda path: encrypt_image(path, creator, output_dir, codec), images
+            )
+        )
+
+
+def get_args():
+    """Get command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Encrypt a directory of images into serialized cards."
+    )
+    parser.add_argument("input_dir", type=str, help="the directory of images")
+    parser.add_argument("output_dir", type=str, help="where to write the cards")
+    parser.add_argument("creator", type=str, help="the creator of the cards")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="how many images to encrypt at once. Defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        help="compress the images with this codec before encrypting them",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Implementation of the batch encryption CLI."""
+    args = get_args()
+    start = time.perf_counter()
+    card_paths = encrypt_directory(
+        args.input_dir, args.output_dir, args.creator, args.workers, args.codec
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Encrypted {len(card_paths)} cards in {elapsed:.2f}s "
+        f"({len(card_paths) / max(elapsed, 1e-9):.1f} cards/s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Author: Eyal Roginski
+Description: Compare the wire size and end-to-end latency of the card codecs.
+
+Each run encrypts a card (compressing it first with the codec), serializes it,
+sends it over a loopback connection, deserializes it and decrypts it.
+"""
+
+import argparse
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from PIL import Image, ImageDraw
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from card import Card
+from card_codecs import CODECS
+from connection import Connection
+from crypt_image import CryptImage
+
+
+def synthetic_image(width: int, height: int) -> Image.Image:
+    """A gradient with some shapes on it, which compresses roughly like artwork."""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGBA")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, min(width, height) // 2, max(width // 40, 1)):
+        draw.ellipse((i, i, width - i, height - i), outline=(i % 256, 80, 160, 255))
+    return image
+
+
+def run_once(image: Image.Image, codec: str | None) -> tuple[int, float]:
+    """Send one card end to end, and return its wire size and the time it took."""
+    left, right = socket.socketpair()
+    received = []
+    start = time.perf_counter()
+
+    def receive():
+        with Connection(right) as connection:
+            card = Card.deserialize(connection.receive_message())
+            card.solve("solution")
+            received.append(card)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    card = Card("bench", "bench", CryptImage(image.copy()), "riddle", "solution")
+    card.encrypt(codec=codec)
+    packet = card.serialize()
+    with Connection(left) as connection:
+        connection.send_message(packet)
+    receiver.join()
+    return len(packet), time.perf_counter() - start
+
+
+def get_args():
+    """Get command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the card codecs.")
+    parser.add_argument(
+        "--image", type=str, help="an image to use instead of a synthetic one"
+    )
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    """Print the wire size and latency of every available codec."""
+    args = get_args()
+    if args.image is not None:
+        image = Image.open(args.image).convert("RGBA")
+    else:
+        image = synthetic_image(args.width, args.height)
+
+    print(f"{'codec':<8}{'wire size':>14}{'ratio':>8}{'median ms':>12}{'min ms':>10}")
+    raw_size = None
+    for codec in [None] + sorted(CODECS):
+        runs = [run_once(image, codec) for _ in range(args.repeat)]
+        size = runs[0][0]
+        raw_size = raw_size or size
+        latencies = [latency * 1000 for _, latency in runs]
+        print(
+            f"{codec or 'none':<8}{size:>14,}{raw_size / size:>8.2f}"
+            f"{statistics.median(latencies):>12.1f}{min(latencies):>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Author: Eyal Roginski
+Description: Load test the REST API against a local file backend.
+
+Saves some cards to a temporary directory, runs `api.py` on them in a subprocess,
+and has many clients request listings, metadata, images and thumbnails for a
+while. Prints the throughput and latency percentiles. The clients run on the same
+machine as the server, so they compete with it for the CPUs.
+"""
+
+import argparse
+import http.client
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+# pylint: disable=wrong-import-position
+from card import Card
+from crypt_image import CryptImage
+from saver import Saver
+
+
+def create_cards(url: str, creators: int, cards_per_creator: int) -> list[str]:
+    """Save synthetic cards to `url`, and return the paths to request."""
+    paths = ["/creators/"]
+    cards = []
+    for creator_index in range(creators):
+        creator = f"creator{creator_index}"
+        paths.append(f"/creators/{creator}/cards/")
+        for card_index in range(cards_per_creator):
+            name = f"card{card_index}"
+            color = (creator_index * 40 % 256, card_index * 40 % 256, 128, 255)
+            image = CryptImage(Image.new("RGBA", (800, 600), color))
+            cards.append(Card(name, creator, image, "riddle", "solution"))
+            card_path = f"/creators/{creator}/cards/{name}/"
+            paths += [card_path, f"{card_path}image.jpg", f"{card_path}image.jpg?w=256"]
+    Saver(url).save_many(cards)
+    return paths
+
+
+def wait_until_up(port: int, server: subprocess.Popen, timeout: float = 30):
+    """Wait until the API answers on `port`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The API server exited.")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The API server didn't start in time.")
+
+
+def run_client(port: int, paths: list[str], start: int, deadline: float, results: list):
+    """Request `paths` in a loop until `deadline`, recording every latency."""
+    latencies = []
+    errors = 0
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for path in itertools.islice(itertools.cycle(paths), start, None):
+        if time.monotonic() >= deadline:
+            break
+        request_start = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - request_start)
+    connection.close()
+    results.append((latencies, errors))
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """The `percent`th percentile of `values`."""
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def get_args():
+    """Get command line arguments."""
+    parser = argparse.ArgumentParser(description="Load test the REST API.")
+    parser.add_argument(
+        "--server", choices=["development", "waitress", "gunicorn"], default="waitress"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--creators", type=int, default=10)
+    parser.add_argument("--cards-per-creator", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5077)
+    return parser.parse_args()
+
+
+def main():
+    """Run the load test and print its results."""
+    args = get_args()
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"file://{directory}/cards"
+        paths = create_cards(url, args.creators, args.cards_per_creator)
+        # pylint: disable-next=consider-using-with
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                str(ROOT / "api.py"),
+                *("--port", str(args.port), "--database-url", url),
+                *("--thumbnail-dir", f"{directory}/thumbnails"),
+                *("--server", args.server, "--workers", str(args.workers)),
+                *("--threads", str(args.threads)),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(args.port, server)
+            results = []
+            deadline = time.monotonic() + args.duration
+            clients = [
+                threading.Thread(
+                    target=run_client,
+                    args=(args.port, paths, index * 7, deadline, results),
+                )
+                for index in range(args.clients)
+            ]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = sorted(
+        latency for client_latencies, _ in results for latency in client_latencies
+    )
+    errors = sum(client_errors for _, client_errors in results)
+    if len(latencies) < 2:
+        raise RuntimeError("Too few requests succeeded to measure.")
+    print(
+        f"{args.server}: {len(latencies)} requests in {elapsed:.1f}s, "
+        f"{len(latencies) / elapsed:.1f} requests/s, {errors} errors"
+    )
+    print(
+        f"latency p50 {percentile(latencies, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}ms, "
+        f"max {latencies[-1] * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Author: Eyal Roginski
+Description: Benchmark the card pipeline end to end, and compare runs.
+
+Runs every stage a card goes through on synthetic cards of several resolutions:
+serializing and deserializing, encrypting and decrypting, sending over a loopback
+connection, saving and loading with the file saver, and serving through the REST
+API. Each benchmark repeats its operation for a minimum time, and reports the
+median latency, the throughput in MB/s and cards/s, and how much it raised the
+process's peak RSS.
+
+The results can be written as JSON, and compared with the JSON of another run
+(say, of the previous commit) to find regressions:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import queue
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+# pylint: disable=wrong-import-position
+import api
+from bench_codecs import synthetic_image
+from card import Card
+from card_id import CardID
+from connection import Connection
+from crypt_image import CryptImage
+from file_saver import FileSaver
+from thumbnail_cache import ThumbnailCache
+
+DEFAULT_RESOLUTIONS = ["640x480", "1920x1080", "3840x2160"]
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_MIN_ITERATIONS = 3
+DEFAULT_MAX_ITERATIONS = 1000
+# How much slower than the baseline a benchmark may get before it is flagged.
+DEFAULT_THRESHOLD = 0.1
+RESULTS_VERSION = 1
+
+
+class Benchmark(NamedTuple):
+    """
+    An operation to measure. `setup()` runs untimed before every iteration, and
+    returns the arguments of `run`, which returns how many bytes it processed.
+    """
+
+    name: str
+    setup: Callable[[], tuple]
+    run: Callable[..., int]
+
+
+def peak_rss() -> int:
+    """The peak resident set size of this process so far, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(
+    benchmark: Benchmark, min_time: float, min_iterations: int, max_iterations: int
+) -> dict:
+    """Run a benchmark until it took `min_time` seconds, and summarize it."""
+    times = []
+    processed = 0
+    rss_before = peak_rss()
+    while len(times) < max_iterations and (
+        len(times) < min_iterations or sum(times) < min_time
+    ):
+        args = benchmark.setup()
+        start = time.perf_counter()
+        processed = benchmark.run(*args)
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {
+        "name": benchmark.name,
+        "iterations": len(times),
+        "median_s": median,
+        "min_s": min(times),
+        "mean_s": statistics.fmean(times),
+        "bytes": processed,
+        "mb_per_s": processed / median / 1e6,
+        "cards_per_s": 1 / median,
+        "peak_rss_growth": peak_rss() - rss_before,
+    }
+
+
+def make_card(width: int, height: int, name: str = "bench") -> Card:
+    """A non-encrypted card with a synthetic image."""
+    return Card(
+        name, "bench", CryptImage(synthetic_image(width, height)), "riddle", "solution"
+    )
+
+
+def card_benchmarks(width: int, height: int) -> Iterator[Benchmark]:
+    """Serializing, deserializing, encrypting and decrypting a card."""
+    image = synthetic_image(width, height)
+
+    def fresh_card() -> Card:
+        return Card("bench", "bench", CryptImage(image.copy()), "riddle", "solution")
+
+    encrypted = fresh_card()
+    encrypted.encrypt()
+    serialization = encrypted.serialize()
+
+    yield Benchmark(
+        "card.serialize", lambda: (encrypted,), lambda card: len(card.serialize())
+    )
+    yield Benchmark(
+        "card.deserialize",
+        lambda: (serialization,),
+        lambda data: len(Card.deserialize(data).image.pixels) and len(data),
+    )
+
+    def encrypt(card: Card) -> int:
+        card.encrypt()
+        return len(card.image.pixels)
+
+    yield Benchmark("crypt_image.encrypt", lambda: (fresh_card(),), encrypt)
+
+    def decrypt(card: Card) -> int:
+        if not card.image.decrypt("solution"):
+            raise RuntimeError("Decryption failed.")
+        return len(card.image.pixels)
+
+    yield Benchmark(
+        "crypt_image.decrypt", lambda: (Card.deserialize(serialization),), decrypt
+    )
+
+
+def connection_benchmarks(width: int, height: int) -> Iterator[Benchmark]:
+    """Sending an encrypted card over a loopback connection, and receiving it."""
+    card = make_card(width, height)
+    card.encrypt()
+    parts = card.serialized_parts()
+    listener = socket.create_server(("127.0.0.1", 0))
+    sender = Connection.connect("127.0.0.1", listener.getsockname()[1])
+    receiver = Connection(listener.accept()[0])
+    listener.close()
+    sends: queue.Queue = queue.Queue()
+
+    def send_loop():
+        while (item := sends.get()) is not None:
+            sender.send_parts(item)
+
+    thread = threading.Thread(target=send_loop, daemon=True)
+    thread.start()
+
+    def send_and_receive() -> int:
+        sends.put(parts)
+        return len(receiver.receive_message())
+
+    try:
+        yield Benchmark("connection.send_receive", tuple, send_and_receive)
+    finally:
+        sends.put(None)
+        thread.join()
+        sender.close()
+        receiver.close()
+
+
+def saver_benchmarks(width: int, height: int, directory: Path) -> Iterator[Benchmark]:
+    """Saving and loading cards with the file saver."""
+    saver = FileSaver(str(directory / f"saver-{width}x{height}"))
+    image = synthetic_image(width, height)
+    counter = iter(range(sys.maxsize))
+
+    def new_card() -> tuple[Card]:
+        # Saving writes the card's pixels to its card file, and leaves the blob
+        # store alone until a JPEG is exported.
+        index = next(counter)
+        card = Card(f"card{index}", "bench", CryptImage(image.copy()), "riddle")
+        return (card,)
+
+    def save(card: Card) -> int:
+        saver.save(card)
+        return len(card.image.pixels)
+
+    yield Benchmark("file_saver.save", new_card, save)
+
+    saved_id = CardID("card0", "bench")
+    yield Benchmark(
+        "file_saver.load",
+        lambda: (saved_id,),
+        lambda card_id: len(saver.load(card_id).image.pixels),
+    )
+
+
+def api_benchmarks(width: int, height: int, directory: Path) -> Iterator[Benchmark]:
+    """Serving a card's listings, metadata, image and thumbnail through the API."""
+    url = f"file://{directory / f'api-{width}x{height}'}"
+    FileSaver(url.removeprefix("file://")).save(make_card(width, height))
+    api.use_database(url, ThumbnailCache(directory / f"thumbnails-{width}x{height}"))
+    client = api.app.test_client()
+
+    def get(path: str) -> int:
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} returned {response.status_code}.")
+        return len(response.get_data())
+
+    card_path = "/creators/bench/cards/bench/"
+    for name, path in [
+        ("api.creators", "/creators/"),
+        ("api.card_metadata", card_path),
+        ("api.image", f"{card_path}image.jpg"),
+        ("api.thumbnail", f"{card_path}image.jpg?w=256"),
+    ]:
+        yield Benchmark(name, lambda path=path: (path,), get)
+
+
+def run_suite(args: argparse.Namespace) -> list[dict]:
+    """Run the selected benchmarks at every resolution, printing them as they end."""
+    results = []
+    print(
+        f"{'benchmark':<26}{'resolution':>11}{'median ms':>11}{'MB/s':>10}"
+        f"{'cards/s':>10}{'RSS +MiB':>10}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for resolution in args.resolutions:
+            width, height = (int(size) for size in resolution.split("x"))
+            groups = [
+                card_benchmarks(width, height),
+                connection_benchmarks(width, height),
+                saver_benchmarks(width, height, Path(directory)),
+                api_benchmarks(width, height, Path(directory)),
+            ]
+            for group in groups:
+                for benchmark in group:
+                    if args.filter and args.filter not in benchmark.name:
+                        continue
+                    result = measure(
+                        benchmark,
+                        args.min_time,
+                        args.min_iterations,
+                        args.max_iterations,
+                    )
+                    result["resolution"] = resolution
+                    results.append(result)
+                    print(
+                        f"{result['name']:<26}{resolution:>11}"
+                        f"{result['median_s'] * 1000:>11.2f}"
+                        f"{result['mb_per_s']:>10.1f}{result['cards_per_s']:>10.1f}"
+                        f"{result['peak_rss_growth'] / 2**20:>10.1f}"
+                    )
+    return results
+
+
+def git_commit() -> str | None:
+    """The commit of the benchmarked tree, if it is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> bool:
+    """
+    Print how every benchmark changed from the results in `baseline_path`, and
+    return whether any of them got slower by more than `threshold`.
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    before = {
+        (result["name"], result["resolution"]): result for result in baseline["results"]
+    }
+    print(f"\nCompared with {baseline.get('commit') or baseline_path}:")
+    regressed = False
+    for result in results:
+        old = before.get((result["name"], result["resolution"]))
+        if old is None:
+            continue
+        change = result["median_s"] / old["median_s"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{result['name']:<26}{result['resolution']:>11}{change:>+10.1%}{flag}")
+    return regressed
+
+
+def get_args():
+    """Get command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the card pipeline.")
+    parser.add_argument(
+        "--resolutions",
+        type=lambda value: value.split(","),
+        default=DEFAULT_RESOLUTIONS,
+        help="comma separated WIDTHxHEIGHT card sizes",
+    )
+    parser.add_argument(
+        "--filter", type=str, help="only run benchmarks whose name contains this"
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=DEFAULT_MIN_TIME,
+        help="seconds to repeat every benchmark for",
+    )
+    parser.add_argument("--min-iterations", type=int, default=DEFAULT_MIN_ITERATIONS)
+    parser.add_argument("--max-iterations", type=int, default=DEFAULT_MAX_ITERATIONS)
+    parser.add_argument("--output", "-o", type=str, help="write the results as JSON")
+    parser.add_argument(
+        "--compare", type=str, help="the JSON results of a previous run to compare to"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="the fraction a benchmark may slow down before it is a regression",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmarks, and write or compare their results."""
+    args = get_args()
+    results = run_suite(args)
+    report = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "peak_rss": peak_rss(),
+        "results": results,
+    }
+    print(f"\nPeak RSS: {report['peak_rss'] / 2**20:.1f} MiB")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare is not None and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
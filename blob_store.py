@@ -0,0 +1,138 @@
+"""
+Author: Eyal Roginski
+Description: A content-addressed store of card images, shared between cards.
+
+Every distinct image is encoded once, into a blob named after its digest (see
+`CryptImage.digest`). A card's image file is a hard link to its blob rather than a
+copy, so the file system counts the references: a blob's link count is one more
+than the number of cards using it. Saving a card whose image is already stored
+links to the existing blob without encoding anything. Blobs that no card uses
+anymore are garbage collected in batches, since finding a blob by its inode
+means scanning the store.
+
+Hard links keep image paths working as before, and keep the store safe to share
+between processes without any bookkeeping of its own.
+"""
+
+import os
+import uuid
+from pathlib import Path
+from card import Card
+
+BLOBS_DIR_NAME = ".blobs"
+BLOB_SUFFIX = ".jpg"
+# Blobs are spread over subdirectories named after the first bytes of the digest.
+BLOBS_GLOB = f"??/*{BLOB_SUFFIX}"
+# How many blobs may become unused before the store is garbage collected.
+DEFAULT_GC_THRESHOLD = 256
+
+
+class BlobStore:
+    """
+    The image blobs in `directory`, which must be on the same file system as the
+    card images that link to them.
+    """
+
+    def __init__(self, directory: str | Path, gc_threshold: int = DEFAULT_GC_THRESHOLD):
+        self.directory = Path(directory)
+        # Blobs are encoded here, and only then linked into place.
+        self.temporary_dir = self.directory / "tmp"
+        self.temporary_dir.mkdir(parents=True, exist_ok=True)
+        self.gc_threshold = gc_threshold
+        self._unused_blobs = 0
+
+    def blob_path(self, digest: str) -> Path:
+        """Where the blob of the image with `digest` is stored."""
+        return self.directory / digest[:2] / f"{digest}{BLOB_SUFFIX}"
+
+    def references(self, digest: str) -> int:
+        """How many images link to the blob with `digest`."""
+        try:
+            return self.blob_path(digest).stat().st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def link(self, card: Card, image_path: str | Path, mode: str = "RGB") -> str:
+        """
+        Make `image_path` a link to the blob of the card's image, encoding the
+        image in `mode` only if it isn't stored yet, and return its digest.
+
+        The image that `image_path` used to link to loses a reference, and its blob
+        is eventually deleted if that was the last one.
+        """
+        image_path = Path(image_path)
+        digest = card.image.digest()
+        blob_path = self.blob_path(digest)
+        try:
+            previous = image_path.stat()
+        except FileNotFoundError:
+            previous = None
+
+        while True:
+            try:
+                blob = blob_path.stat()
+            except FileNotFoundError:
+                self._write_blob(card, blob_path, mode)
+                continue
+            if previous is not None and _same_file(previous, blob):
+                return digest
+            temporary_path = image_path.with_name(
+                f".{image_path.name}.{uuid.uuid4().hex}.tmp"
+            )
+            try:
+                os.link(blob_path, temporary_path)
+            except FileNotFoundError:
+                # Collected by another process since, so store it again.
+                continue
+            break
+        os.replace(temporary_path, image_path)
+        if previous is not None:
+            self._unlinked(previous)
+        return digest
+
+    def discard(self, image_path: str | Path):
+        """Delete an image, so the blob it linked to loses a reference."""
+        try:
+            previous = os.stat(image_path)
+            os.unlink(image_path)
+        except FileNotFoundError:
+            return
+        self._unlinked(previous)
+
+    def _unlinked(self, previous: os.stat_result):
+        """Count the blob of an image that was unlinked, if it is now unused."""
+        # Linked only from its blob and the unlinked image, so now it's unused.
+        if previous.st_nlink == 2:
+            self._unused_blobs += 1
+            if self._unused_blobs >= self.gc_threshold:
+                self.collect_garbage()
+
+    def _write_blob(self, card: Card, blob_path: Path, mode: str):
+        """Encode a card's image into its blob, unless another process beats us."""
+        blob_path.parent.mkdir(exist_ok=True)
+        temporary_path = self.temporary_dir / f"{uuid.uuid4().hex}{BLOB_SUFFIX}"
+        card.save_image(temporary_path, mode)
+        try:
+            # Unlike a rename, a link never replaces an existing blob.
+            os.link(temporary_path, blob_path)
+        except FileExistsError:
+            pass
+        finally:
+            temporary_path.unlink()
+
+    def collect_garbage(self) -> int:
+        """Delete every blob that no image links to, and return how many there were."""
+        self._unused_blobs = 0
+        deleted = 0
+        for blob_path in self.directory.glob(BLOBS_GLOB):
+            try:
+                if blob_path.stat().st_nlink == 1:
+                    blob_path.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+        return deleted
+
+
+def _same_file(first: os.stat_result, second: os.stat_result) -> bool:
+    return (first.st_dev, first.st_ino) == (second.st_dev, second.st_ino)
@@ -1,5 +1,24 @@
+import os
 import struct
-from crypt_image import CryptImage, BYTES_PER_UINT
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
+from crypt_image import CryptImage, UINT
+import metrics
+
+DESERIALIZE_SECONDS = metrics.histogram(
+    "cardazim_card_deserialize_seconds", "Time to deserialize a card."
+)
+
+
+class CardSummary(NamedTuple):
+    """
+    The fields of a serialized Card that can be read without reading its image.
+    """
+
+    name: str
+    creator: str
+    riddle: str
+    key_hash: bytes | None
 
 
 class Card:
@@ -35,52 +54,94 @@ class Card:
             f"  solution: {self.solution if self.solution else 'unsolved'}"
         )
 
-    def serialize(self) -> bytes:
+    def serialize(self, codec: str = None) -> bytes:
+        """
+        Serialize the Card into bytes, compressing the image with `codec` if given.
+        """
+        return b"".join(self.serialized_parts(codec))
+
+    def serialized_parts(self, codec: str = None) -> list[bytes | memoryview]:
         """
-        Serialize the Card into bytes.
+        Serialize the Card like `serialize`, but as a list of buffers to be written
+        one after the other, without copying the image data.
         """
-        packed_image = self.image.serialize()
-        return struct.pack(
-            f"<I{len(self.name)}s"
-            f"I{len(self.creator)}s"
-            f"I{len(packed_image)}s"
-            f"I{len(self.riddle)}s",
-            len(self.name),
-            self.name.encode(),
-            len(self.creator),
-            self.creator.encode(),
-            len(packed_image),
-            packed_image,
-            len(self.riddle),
-            self.riddle.encode(),
+        image_parts = self.image.serialized_parts(codec)
+        image_len = sum(len(part) for part in image_parts)
+        name = self.name.encode()
+        creator = self.creator.encode()
+        riddle = self.riddle.encode()
+        # Lengths are of the encoded fields, which differ from the number of
+        # characters for non-ASCII text.
+        prefix = b"".join(
+            [
+                UINT.pack(len(name)),
+                name,
+                UINT.pack(len(creator)),
+                creator,
+                UINT.pack(image_len),
+            ]
         )
+        suffix = UINT.pack(len(riddle)) + riddle
+        return [prefix, *image_parts, suffix]
+
+    def write_to(self, stream, codec: str = None):
+        """Write the serialized Card to the binary file-like object `stream`."""
+        for part in self.serialized_parts(codec):
+            stream.write(part)
 
     @classmethod
-    def deserialize(cls, serialization: bytes):
+    def deserialize(cls, serialization: bytes | memoryview):
         """
-        Deserialize the Card from bytes.
+        Deserialize the Card from bytes, or any other buffer.
+        The image data is not copied: the Card's image keeps a view into `serialization`.
+
+        Raises a `RuntimeError` if malformed object received.
         """
-        offset = 0
-        (name_len,) = struct.unpack_from("<I", serialization, offset)
-        offset += BYTES_PER_UINT
-        (name,) = struct.unpack_from(f"{name_len}s", serialization, offset)
-        name = name.decode()
-        offset += name_len
-        (creator_len,) = struct.unpack_from("<I", serialization, offset)
-        offset += BYTES_PER_UINT
-        (creator,) = struct.unpack_from(f"{creator_len}s", serialization, offset)
-        creator = creator.decode()
-        offset += creator_len
-        (image_len,) = struct.unpack_from("<I", serialization, offset)
-        offset += BYTES_PER_UINT
-        image = CryptImage.deserialize(serialization[offset : offset + image_len])
-        offset += image_len
-        (riddle_len,) = struct.unpack_from("<I", serialization, offset)
-        offset += BYTES_PER_UINT
-        (riddle,) = struct.unpack_from(f"{riddle_len}s", serialization, offset)
-        riddle = riddle.decode()
-
-        return Card(name, creator, image, riddle)
+        with DESERIALIZE_SECONDS.time():
+            serialization = memoryview(serialization)
+            offset = 0
+            try:
+                name, offset = _unpack_field(serialization, offset)
+                creator, offset = _unpack_field(serialization, offset)
+                packed_image, offset = _unpack_field(serialization, offset)
+                riddle, offset = _unpack_field(serialization, offset)
+                name = str(name, "utf-8")
+                creator = str(creator, "utf-8")
+                riddle = str(riddle, "utf-8")
+            except (struct.error, UnicodeDecodeError) as exc:
+                raise RuntimeError(
+                    "Card.deserialize received a malformed object serialization."
+                ) from exc
+            image = CryptImage.deserialize(packed_image)
+
+            return Card(name, creator, image, riddle)
+
+    @classmethod
+    def read_summary(cls, stream) -> CardSummary:
+        """
+        Read the summary of a serialized Card from the binary file-like `stream`,
+        seeking past the image data instead of reading it.
+
+        Raises a `RuntimeError` if malformed object received.
+        """
+        try:
+            name = str(_read_field(stream), "utf-8")
+            creator = str(_read_field(stream), "utf-8")
+            (image_len,) = UINT.unpack(stream.read(UINT.size))
+            image_start = stream.tell()
+            key_hash = CryptImage.read_key_hash(stream)
+            stream.seek(image_start + image_len, os.SEEK_SET)
+            riddle = str(_read_field(stream), "utf-8")
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise RuntimeError(
+                "Card.read_summary received a malformed object serialization."
+            ) from exc
+        return CardSummary(name, creator, riddle, key_hash)
+
+    @property
+    def key_hash(self) -> bytes | None:
+        """The key hash of the Card's image, or `None` if it isn't encrypted."""
+        return self.image.key_hash
 
     @property
     def image_path(self) -> str:
@@ -101,15 +162,51 @@ class Card:
             return True
         return False
 
-    def encrypt(self, key=None):
+    def encrypt(self, key=None, codec: str = None):
         """
         Encrypt the card, setting `self.solution` to `None`. If both `key` and `self.solution`
         are `None`, returns and does not encrypt.
+        If `codec` is given, the image is compressed with it before it is encrypted.
         """
         if key is None:
             if self.solution is None:
                 return
             key = self.solution
 
-        self.image.encrypt(key)
+        self.image.encrypt(key, codec)
         self.solution = None
+
+
+def solve_many(
+    cards: Iterable[Card], solutions: Iterable[str | bytes], workers: int = None
+) -> list[bool]:
+    """
+    Try to solve each of `cards` with the matching solution in `solutions`, in
+    parallel like `crypt_image.encrypt_many`. Returns whether each solution is correct.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(Card.solve, cards, solutions))
+
+
+def _read_field(stream) -> bytes:
+    """
+    Read a `<uint length>` `<bytes data>` field from `stream`.
+    Raises `struct.error` if it is truncated.
+    """
+    (length,) = UINT.unpack(stream.read(UINT.size))
+    data = stream.read(length)
+    if len(data) != length:
+        raise struct.error(f"Field of {length} bytes is truncated.")
+    return data
+
+
+def _unpack_field(serialization: memoryview, offset: int) -> tuple[memoryview, int]:
+    """
+    Unpack a `<uint length>` `<bytes data>` field at `offset`, returning a view of
+    the data and the offset after it. Raises `struct.error` if it is truncated.
+    """
+    (length,) = UINT.unpack_from(serialization, offset)
+    offset += UINT.size
+    if offset + length > len(serialization):
+        raise struct.error(f"Field of {length} bytes at offset {offset} is truncated.")
+    return serialization[offset : offset + length], offset + length
@@ -0,0 +1,125 @@
+"""
+Author: Eyal Roginski
+Description: A lazily loaded catalogue of the serialized cards in a directory.
+
+Listing the cards only reads their summaries (name, creator, riddle and key hash),
+never their images. Summaries are kept in an index file in the directory, keyed by
+file name, modification time and size, so only new or changed files are read.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import NamedTuple
+from card import Card, CardSummary
+
+INDEX_FILE_NAME = ".cardazim_index.json"
+INDEX_VERSION = 1
+
+
+class CatalogueEntry(NamedTuple):
+    """A card in the catalogue, without its image."""
+
+    path: Path
+    name: str
+    creator: str
+    riddle: str
+    key_hash: bytes | None
+
+    def load(self) -> Card:
+        """Load the full card."""
+        with open(self.path, "rb") as card_file:
+            return Card.deserialize(card_file.read())
+
+
+class CardCatalogue:
+    """
+    The cards serialized as files in `directory`. If the directory doesn't exist,
+    the catalogue is empty.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.index_path = self.directory / INDEX_FILE_NAME
+
+    def entries(self) -> list[CatalogueEntry]:
+        """
+        List the cards in the directory, reading only the files that changed since
+        the index was last updated. Files that aren't valid cards are skipped.
+        """
+        if not self.directory.is_dir():
+            return []
+
+        index = self._read_index()
+        updated_index = {}
+        entries = []
+        with os.scandir(self.directory) as directory_entries:
+            for directory_entry in directory_entries:
+                if (
+                    directory_entry.name.startswith(".")
+                    or not directory_entry.is_file()
+                ):
+                    continue
+                stat = directory_entry.stat()
+                record = index.get(directory_entry.name)
+                if (
+                    record is None
+                    or record["mtime_ns"] != stat.st_mtime_ns
+                    or record["size"] != stat.st_size
+                ):
+                    record = self._read_record(Path(directory_entry.path), stat)
+                updated_index[directory_entry.name] = record
+                # Invalid files are indexed too, so they aren't read again.
+                if record["invalid"]:
+                    continue
+                entries.append(self._entry(Path(directory_entry.path), record))
+
+        if updated_index != index:
+            self._write_index(updated_index)
+        entries.sort(key=lambda entry: entry.path.name)
+        return entries
+
+    @staticmethod
+    def _read_record(path: Path, stat: os.stat_result) -> dict:
+        """Read the summary of the card at `path` as an index record."""
+        record = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        try:
+            with open(path, "rb") as card_file:
+                summary: CardSummary = Card.read_summary(card_file)
+        except (OSError, RuntimeError):
+            return record | {"invalid": True}
+        return record | {
+            "invalid": False,
+            "name": summary.name,
+            "creator": summary.creator,
+            "riddle": summary.riddle,
+            "key_hash": summary.key_hash.hex() if summary.key_hash else None,
+        }
+
+    @staticmethod
+    def _entry(path: Path, record: dict) -> CatalogueEntry:
+        key_hash = bytes.fromhex(record["key_hash"]) if record["key_hash"] else None
+        return CatalogueEntry(
+            path, record["name"], record["creator"], record["riddle"], key_hash
+        )
+
+    def _read_index(self) -> dict[str, dict]:
+        """Read the index, or an empty one if it is missing or unreadable."""
+        try:
+            with open(self.index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+            return {}
+        return index.get("cards", {})
+
+    def _write_index(self, records: dict[str, dict]):
+        """Atomically replace the index, ignoring failures since it's only a cache."""
+        temporary_path = self.index_path.with_name(f"{INDEX_FILE_NAME}.tmp")
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as index_file:
+                json.dump({"version": INDEX_VERSION, "cards": records}, index_file)
+            os.replace(temporary_path, self.index_path)
+        except OSError:
+            pass
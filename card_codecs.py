@@ -0,0 +1,125 @@
+"""
+Compression codecs for the image data of serialized cards.
+
+zlib and lzma are always available. zstd and lz4 are registered only if the
+`zstandard` and `lz4` packages are installed.
+"""
+
+import lzma
+import zlib
+from typing import Callable, NamedTuple
+
+
+class Codec(NamedTuple):
+    """
+    A compression codec. `decompress(data, size)` returns `size` bytes, and raises
+    `RuntimeError` if `data` doesn't decompress to exactly that many.
+    """
+
+    name: str
+    codec_id: int
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes, int], bytes]
+
+
+def _checked(data: bytes, size: int) -> bytes:
+    """Return `data`, raising `RuntimeError` unless it is exactly `size` bytes."""
+    if len(data) != size:
+        raise RuntimeError(f"Expected {size} decompressed bytes, got {len(data)}.")
+    return data
+
+
+def _zlib_decompress(data: bytes, size: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    try:
+        # A byte more than `size` is enough to tell the data is too long.
+        decompressed = decompressor.decompress(data, size + 1)
+    except zlib.error as exc:
+        raise RuntimeError("Malformed zlib data.") from exc
+    if len(decompressed) > size:
+        raise RuntimeError(f"zlib data decompresses to more than {size} bytes.")
+    if not decompressor.eof:
+        raise RuntimeError("Truncated zlib data.")
+    return _checked(decompressed, size)
+
+
+def _lzma_decompress(data: bytes, size: int) -> bytes:
+    decompressor = lzma.LZMADecompressor()
+    try:
+        decompressed = decompressor.decompress(data, max_length=size + 1)
+    except lzma.LZMAError as exc:
+        raise RuntimeError("Malformed lzma data.") from exc
+    if len(decompressed) > size:
+        raise RuntimeError(f"lzma data decompresses to more than {size} bytes.")
+    if not decompressor.eof:
+        raise RuntimeError("Truncated lzma data.")
+    return _checked(decompressed, size)
+
+
+CODECS: dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """Make `codec` available to serialization by its name and id."""
+    CODECS[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by name. Raises `RuntimeError` if it isn't available."""
+    try:
+        return CODECS[name]
+    except KeyError as exc:
+        raise RuntimeError(f"Unknown compression codec {name!r}.") from exc
+
+
+def get_codec_by_id(codec_id: int) -> Codec:
+    """Get a codec by its id on the wire. Raises `RuntimeError` if it isn't available."""
+    for codec in CODECS.values():
+        if codec.codec_id == codec_id:
+            return codec
+    raise RuntimeError(f"Unknown compression codec id {codec_id}.")
+
+
+register_codec(Codec("raw", 0, memoryview, _checked))
+register_codec(Codec("zlib", 1, zlib.compress, _zlib_decompress))
+register_codec(Codec("lzma", 2, lzma.compress, _lzma_decompress))
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+
+    def _zstd_decompress(data: bytes, size: int) -> bytes:
+        try:
+            decompressed = zstandard.ZstdDecompressor().decompress(
+                data, max_output_size=size
+            )
+        except zstandard.ZstdError as exc:
+            raise RuntimeError("Malformed zstd data.") from exc
+        return _checked(decompressed, size)
+
+    def _zstd_compress(data: bytes) -> bytes:
+        # Compressor objects can't be shared between threads.
+        return zstandard.ZstdCompressor().compress(data)
+
+    register_codec(Codec("zstd", 3, _zstd_compress, _zstd_decompress))
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+
+    def _lz4_decompress(data: bytes, size: int) -> bytes:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        try:
+            # A byte more than `size` is enough to tell the data is too long.
+            decompressed = decompressor.decompress(data, max_length=size + 1)
+        except RuntimeError as exc:
+            raise RuntimeError("Malformed lz4 data.") from exc
+        if not decompressor.eof and len(decompressed) <= size:
+            raise RuntimeError("Truncated lz4 data.")
+        return _checked(decompressed, size)
+
+    register_codec(Codec("lz4", 4, lz4.frame.compress, _lz4_decompress))
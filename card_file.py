@@ -0,0 +1,72 @@
+"""
+Author: Eyal Roginski
+Description: The native on-disk format of saved cards.
+
+A card file is the card's serialization, as sent over the network: its fields, its
+key hash, and its raw (or losslessly compressed) pixels. Unlike a JPEG it keeps
+alpha and every bit of the encrypted pixels, so a stored card can still be solved.
+
+Card files are mapped into memory rather than read, and the loaded card's pixels
+are a copy-on-write view of the mapping, so loading decodes nothing and copies
+nothing until the card is decrypted. JPEGs of the cards are only exported for the
+web, on demand, into a `BlobStore`.
+"""
+
+import mmap
+import os
+import uuid
+from pathlib import Path
+from blob_store import BlobStore, _same_file
+from card import Card
+
+CARD_FILE_SUFFIX = ".card"
+
+
+def write_card_file(card: Card, path: str | Path, codec: str = None):
+    """
+    Write the card to `path`, compressing its pixels with `codec` if given. The
+    file is replaced at once, so readers see either the old card or the new one.
+    """
+    path = Path(path)
+    temporary_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temporary_path, "wb") as card_file:
+            card.write_to(card_file, codec)
+        os.replace(temporary_path, path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+
+
+def read_card_file(path: str | Path, solution: str = None) -> Card:
+    """
+    Load the card stored at `path`, with its `solution` if known. The card's image
+    is a private view of the mapped file, which is only copied where it changes.
+
+    Raises `RuntimeError` if the file isn't a card.
+    """
+    with open(path, "rb") as card_file:
+        try:
+            mapping = mmap.mmap(card_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError as exc:
+            raise RuntimeError(f"{path} is empty.") from exc
+    card = Card.deserialize(mapping)
+    card.solution = solution
+    return card
+
+
+def export_image(
+    card_path: str | Path, image_path: str | Path, blobs: BlobStore, mode: str = "RGB"
+) -> Path:
+    """
+    Make `image_path` a JPEG of the card stored at `card_path`, in `blobs`, unless
+    it already exists, and return it. Saving a card must `discard` its export.
+    """
+    image_path = Path(image_path)
+    if image_path.exists():
+        return image_path
+    while True:
+        source = os.stat(card_path)
+        blobs.link(read_card_file(card_path), image_path, mode)
+        # If the card was saved again meanwhile, the export may be of the old one.
+        if _same_file(source, os.stat(card_path)):
+            return image_path
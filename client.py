@@ -4,8 +4,14 @@ Description: Cardazim client.
 """
 
 import argparse
-from connection import Connection
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable
+from connection import Connection, FLAG_ACK_REQUESTED, ACK_OK
 from card import Card
+from card_codecs import CODECS
+
+DEFAULT_WINDOW = 8
 
 
 def send_card(connection: Connection, card: Card):
@@ -14,32 +20,152 @@ def send_card(connection: Connection, card: Card):
     connection.send_message(packet)
 
 
+def send_cards(
+    connection: Connection, cards: Iterable[Card], window: int = DEFAULT_WINDOW
+) -> list[bool]:
+    """
+    Send all of `cards` over the one `connection`, and return whether the server
+    accepted each of them.
+
+    Up to `window` cards are sent before waiting for the server to acknowledge
+    the first of them, so the connection isn't idle while the server works.
+    """
+    return _send_pipelined(
+        connection,
+        (
+            partial(connection.send_parts, card.serialized_parts(), FLAG_ACK_REQUESTED)
+            for card in cards
+        ),
+        window,
+    )
+
+
+def send_card_files(
+    connection: Connection, paths: Iterable[str | Path], window: int = DEFAULT_WINDOW
+) -> list[bool]:
+    """
+    Like `send_cards`, for cards already serialized to files. The files are sent as
+    they are, straight from the page cache, without loading them.
+    """
+    return _send_pipelined(
+        connection,
+        (partial(_send_card_file, connection, path) for path in paths),
+        window,
+    )
+
+
+def _send_card_file(connection: Connection, path: str | Path):
+    with open(path, "rb") as card_file:
+        connection.send_file(card_file, FLAG_ACK_REQUESTED)
+
+
+def _send_pipelined(
+    connection: Connection, sends: Iterable[Callable[[], None]], window: int
+) -> list[bool]:
+    """
+    Call each of `sends` to send a card, with up to `window` cards awaiting
+    acknowledgement, and return whether the server accepted each of them.
+    """
+    accepted = []
+    sent = 0
+    for send in sends:
+        if sent - len(accepted) >= window:
+            accepted.append(_receive_ack(connection, len(accepted)))
+        send()
+        sent += 1
+    while len(accepted) < sent:
+        accepted.append(_receive_ack(connection, len(accepted)))
+    return accepted
+
+
+def _receive_ack(connection: Connection, sequence: int) -> bool:
+    """
+    Receive the acknowledgement of card number `sequence`, and return whether
+    the server accepted it. Raises `RuntimeError` if acknowledgements are out of order.
+    """
+    acked_sequence, status = connection.receive_ack()
+    if acked_sequence != sequence:
+        raise RuntimeError(
+            f"Expected acknowledgement {sequence}, got {acked_sequence}."
+        )
+    return status == ACK_OK
+
+
+def card_files(directory: str | Path) -> list[Path]:
+    """The files of the serialized cards in `directory`, sorted by name."""
+    return sorted(path for path in Path(directory).iterdir() if path.is_file())
+
+
 def get_args():
     """Get command line arguments."""
     parser = argparse.ArgumentParser(description="Send data to server.")
     parser.add_argument("server_ip", type=str, help="the server's ip")
     parser.add_argument("server_port", type=int, help="the server's port")
-    parser.add_argument("card_name", type=str, help="the card name")
-    parser.add_argument("card_creator", type=str, help="the card creator")
-    parser.add_argument("card_riddle", type=str, help="the card riddle")
-    parser.add_argument("card_solution", type=str, help="the card solution")
-    parser.add_argument("image_path", type=str, help="path to the card image on disk")
-    return parser.parse_args()
+    parser.add_argument("card_name", type=str, nargs="?", help="the card name")
+    parser.add_argument("card_creator", type=str, nargs="?", help="the card creator")
+    parser.add_argument("card_riddle", type=str, nargs="?", help="the card riddle")
+    parser.add_argument("card_solution", type=str, nargs="?", help="the card solution")
+    parser.add_argument(
+        "image_path", type=str, nargs="?", help="path to the card image on disk"
+    )
+    parser.add_argument(
+        "--directory",
+        "-d",
+        type=str,
+        help="upload every serialized card in this directory over one connection, "
+        "instead of a single card",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=DEFAULT_WINDOW,
+        help="how many cards to send before waiting for the server to acknowledge",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        help="compress the card's image with this codec before encrypting it",
+    )
+    args = parser.parse_args()
+    card_args = [
+        "card_name",
+        "card_creator",
+        "card_riddle",
+        "card_solution",
+        "image_path",
+    ]
+    missing = [arg for arg in card_args if getattr(args, arg) is None]
+    if args.directory is None and missing:
+        parser.error(f"missing {', '.join(missing)} (or use --directory)")
+    return args
+
+
+def upload_directory(connection: Connection, directory: str, window: int):
+    """
+    Send every serialized card in `directory` and report the rejected ones. The
+    server validates the cards, and rejects malformed ones.
+    """
+    accepted = send_card_files(connection, card_files(directory), window)
+    rejected = accepted.count(False)
+    print(f"Sent {len(accepted)} cards, {rejected} rejected.")
 
 
 def main():
     """Implementation of CLI and sending data to server."""
     args = get_args()
     with Connection.connect(args.server_ip, args.server_port) as connection:
-        card = Card.create_from_path(
-            args.card_name,
-            args.card_creator,
-            args.image_path,
-            args.card_riddle,
-            args.card_solution,
-        )
-        card.encrypt(card.solution)
-        send_card(connection, card)
+        if args.directory is not None:
+            upload_directory(connection, args.directory, args.window)
+        else:
+            card = Card.create_from_path(
+                args.card_name,
+                args.card_creator,
+                args.image_path,
+                args.card_riddle,
+                args.card_solution,
+            )
+            card.encrypt(card.solution, args.codec)
+            send_card(connection, card)
     print("Done.")
 
 
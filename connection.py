@@ -1,16 +1,76 @@
+import os
 import socket
+import struct
+from typing import BinaryIO
+import metrics
 
 RECV_BUFSIZE = 4096
+# The most buffers to pass to a single `sendmsg` call.
+MAX_IOV = (
+    os.sysconf("SC_IOV_MAX") if "SC_IOV_MAX" in getattr(os, "sysconf_names", {}) else 16
+)
+
+FRAME_MAGIC = b"CRDZ"
+FRAME_VERSION = 1
+# `<4s magic>` `<byte version>` `<byte flags>` `<uint payload length>`
+FRAME_HEADER = struct.Struct("<4sBBI")
+DEFAULT_MAX_FRAME_SIZE = 128 * 1024 * 1024
+
+# Set by the sender when it wants the receiver to acknowledge the frame.
+FLAG_ACK_REQUESTED = 0x01
+# `<uint sequence>` `<byte status>`, sent as the payload of an acknowledgement frame.
+ACK = struct.Struct("<IB")
+ACK_OK = 0
+ACK_MALFORMED = 1
+# The card was valid, but the server is too busy to take it. It may be resent later.
+ACK_REJECTED = 2
+ACK_NAMES = {ACK_OK: "ok", ACK_MALFORMED: "malformed", ACK_REJECTED: "rejected"}
+
+FRAME_RECEIVE_SECONDS = metrics.histogram(
+    "cardazim_frame_receive_seconds",
+    "Time to receive a frame's payload, from the end of its header.",
+)
+RECEIVED_BYTES = metrics.counter(
+    "cardazim_received_bytes_total", "Bytes of frame payloads received."
+)
+RECEIVED_CARDS = metrics.counter(
+    "cardazim_received_cards_total",
+    "Cards received by the server, by how they were acknowledged.",
+    ["status"],
+)
+
+
+def pack_frame_header(length: int, flags: int = 0) -> bytes:
+    """Pack a frame header for a payload of `length` bytes."""
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, length)
+
+
+def unpack_frame_header(header: bytes, max_frame_size: int) -> tuple[int, int]:
+    """
+    Unpack a frame header into `(flags, length)`.
+    Raises `RuntimeError` if the header is malformed or the frame is too large.
+    """
+    magic, version, flags, length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise RuntimeError("Received a message without a frame header.")
+    if version != FRAME_VERSION:
+        raise RuntimeError(f"Unsupported frame version {version}.")
+    if length > max_frame_size:
+        raise RuntimeError(
+            f"Frame of {length} bytes exceeds the maximum of {max_frame_size} bytes."
+        )
+    return flags, length
 
 
 class Connection:
     """Represents a connection that can read/receive formatted data over a socket."""
 
-    def __init__(self, sock=None):
+    def __init__(self, sock=None, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
         if sock is None:
             self.socket = socket.socket()
         else:
             self.socket = sock
+        self.max_frame_size = max_frame_size
 
     @classmethod
     def connect(cls, host: str, port: str | int):
@@ -19,21 +79,112 @@ class Connection:
         connection.socket.connect((host, int(port)))
         return connection
 
-    def send_message(self, data: bytes):
-        """Send data through the socket."""
-        self.socket.sendall(data)
-
-    def receive_message(self) -> bytes:
-        """Receives a message from the socket. If it is malformed, raises `RuntimeError`."""
-        part = self.socket.recv(RECV_BUFSIZE)
-        data = part
-        count = 1
-        # Just using RECV_BUFSIZE left the loop early because of smaller chunks.
-        while len(part) >= RECV_BUFSIZE // 2:
-            count += 1
+    def send_message(self, data: bytes, flags: int = 0):
+        """Send data through the socket as a single frame."""
+        self.send_parts([data], flags)
+
+    def send_parts(self, parts: list[bytes | memoryview], flags: int = 0):
+        """
+        Send the concatenation of `parts` as a single frame, without concatenating
+        them. The frame header and the parts are gathered by a single `sendmsg` call
+        where it is available, and sent one by one otherwise.
+        """
+        header = pack_frame_header(sum(len(part) for part in parts), flags)
+        if not hasattr(self.socket, "sendmsg"):
+            self.socket.sendall(header)
+            for part in parts:
+                self.socket.sendall(part)
+            return
+        buffers = [memoryview(header)]
+        buffers += [memoryview(part).cast("B") for part in parts if len(part)]
+        while buffers:
+            sent = self.socket.sendmsg(buffers[:MAX_IOV])
+            # Skip whatever was sent, which may end in the middle of a buffer.
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+    def send_file(self, file: BinaryIO, flags: int = 0):
+        """
+        Send the rest of an open file as a single frame, with `os.sendfile` where
+        the platform supports it, so its contents never pass through Python.
+        """
+        length = os.fstat(file.fileno()).st_size - file.tell()
+        self.socket.sendall(pack_frame_header(length, flags))
+        self.socket.sendfile(file, count=length)
+
+    def receive_message(self, allow_legacy: bool = False) -> memoryview:
+        """
+        Receives a single frame from the socket, and returns a view of its payload.
+        If it is malformed, raises `RuntimeError`.
+
+        If `allow_legacy` is set, a message without a frame header is treated as an
+        unframed message from an old client, which is read until the peer closes.
+        """
+        try:
+            _, payload = self.receive_frame(allow_legacy)
+        except EOFError as exc:
+            raise RuntimeError("Connection closed before a message was sent.") from exc
+        return payload
+
+    def receive_frame(self, allow_legacy: bool = False) -> tuple[int, memoryview]:
+        """
+        Like `receive_message`, but returns `(flags, payload)`, and raises `EOFError`
+        if the peer closed the connection cleanly before the next frame.
+        """
+        header = self._receive_exactly(FRAME_HEADER.size, allow_eof=True)
+        if allow_legacy and header[: len(FRAME_MAGIC)] != FRAME_MAGIC:
+            return 0, self._receive_legacy(header)
+
+        flags, length = unpack_frame_header(header, self.max_frame_size)
+        with FRAME_RECEIVE_SECONDS.time():
+            payload = self._receive_exactly(length)
+        RECEIVED_BYTES.inc(length)
+        return flags, payload
+
+    def send_ack(self, sequence: int, status: int = ACK_OK):
+        """Acknowledge the frame number `sequence` of this connection."""
+        self.send_message(ACK.pack(sequence, status))
+
+    def receive_ack(self) -> tuple[int, int]:
+        """Receive an acknowledgement as `(sequence, status)`."""
+        try:
+            return ACK.unpack(self.receive_message())
+        except struct.error as exc:
+            raise RuntimeError("Received a malformed acknowledgement.") from exc
+
+    def _receive_exactly(self, length: int, allow_eof: bool = False) -> memoryview:
+        """
+        Receive exactly `length` bytes into a preallocated buffer.
+        Raises `RuntimeError` if the peer closes the connection before that, or
+        `EOFError` if `allow_eof` is set and it closed before sending anything.
+        """
+        buffer = memoryview(bytearray(length))
+        received = 0
+        while received < length:
+            count = self.socket.recv_into(buffer[received:])
+            if count == 0:
+                if allow_eof and received == 0:
+                    raise EOFError("Connection closed.")
+                raise RuntimeError(
+                    f"Connection closed after {received} of {length} bytes."
+                )
+            received += count
+        return buffer
+
+    def _receive_legacy(self, prefix: memoryview) -> memoryview:
+        """Receive an unframed message, which ends when the peer closes the connection."""
+        data = bytearray(prefix)
+        while True:
             part = self.socket.recv(RECV_BUFSIZE)
+            if not part:
+                return memoryview(data)
             data += part
-        return data
+            if len(data) > self.max_frame_size:
+                raise RuntimeError(
+                    f"Legacy message exceeds the maximum of {self.max_frame_size} bytes."
+                )
 
     def close(self):
         """Close the connection."""
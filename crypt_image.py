@@ -1,21 +1,116 @@
 import hashlib
 import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
 from PIL import Image
 from Crypto.Cipher import AES
+from card_codecs import Codec, get_codec, get_codec_by_id
+import metrics
 
 NONCE = b"arazim"
 BYTES_PER_PIXEL = 4
 BYTES_PER_UINT = 4
+# How much data to encrypt or decrypt at a time.
+CHUNK_SIZE = 1024 * 1024
+
+FORMAT_MAGIC = b"CIMG"
+FORMAT_VERSION = 2
+# `<4s magic>` `<byte version>` `<byte codec id>` `<byte flags>`
+FORMAT_HEADER = struct.Struct("<4sBBB")
+# The image data was compressed and then encrypted, so it is only pixels once decrypted.
+FLAG_COMPRESSED_BEFORE_ENCRYPTION = 0x01
+UINT = struct.Struct("<I")
+# `<uint width>` `<uint height>`
+IMAGE_SIZE = struct.Struct("<II")
+# `<uint width>` `<uint height>` `<uint image data length>`
+COMPRESSED_IMAGE_SIZE = struct.Struct("<III")
+
+DECRYPT_SECONDS = metrics.histogram(
+    "cardazim_decrypt_seconds", "Time to decrypt an image with the right key."
+)
+
+
+class SealedImageError(RuntimeError):
+    """
+    Raised when the pixels of a sealed image are needed, since they only exist once
+    it is decrypted.
+    """
 
 
 class CryptImage:
-    """Represents an encrypted RGBA image."""
+    """
+    Represents an encrypted RGBA image.
+
+    The pixels are kept either as a PIL `Image`, or as a raw RGBA buffer (such as
+    a view into a received message) that is only turned into an `Image` once
+    `image` is accessed.
+
+    An image that was compressed before it was encrypted is instead kept as its
+    `sealed` ciphertext, until it is decrypted. It has no pixels until then, so
+    `image`, `pixels` and `save_image` raise `SealedImageError`.
+    """
 
     def __init__(self, image: Image, image_path: str = None):
-        self.image: Image = image
+        self._image: Image = image
+        self._pixels: memoryview = None
+        self.sealed: tuple[Codec, memoryview] = None
+        self.size: tuple[int, int] = image.size if image is not None else (0, 0)
         self.image_path = image_path
         self.key_hash = None
 
+    @classmethod
+    def from_pixels(cls, size: tuple[int, int], pixels: bytes | memoryview):
+        """Create a CryptImage of `size` over the raw RGBA buffer `pixels`, without copying it."""
+        crypt_image = CryptImage(None)
+        crypt_image.size = size
+        crypt_image._pixels = memoryview(pixels)
+        return crypt_image
+
+    @property
+    def image(self) -> Image:
+        """The image as a PIL `Image`, created from the raw pixels on first access."""
+        self._check_not_sealed()
+        if self._image is None:
+            self._image = Image.frombytes("RGBA", self.size, self._pixels)
+            self._pixels = None
+        return self._image
+
+    @image.setter
+    def image(self, image: Image):
+        self._image = image
+        self._pixels = None
+        self.sealed = None
+        self.size = image.size
+
+    @property
+    def pixels(self) -> memoryview:
+        """The raw RGBA pixel data, without creating an `Image` if there isn't one."""
+        self._check_not_sealed()
+        if self._image is not None:
+            return memoryview(self._image.tobytes())
+        return self._pixels
+
+    def _check_not_sealed(self):
+        if self.sealed is not None:
+            raise SealedImageError(
+                "The image was compressed before it was encrypted, so it has no "
+                "pixels until it is decrypted."
+            )
+
+    def digest(self) -> str:
+        """
+        A hex SHA-256 of the image's size and pixels, or of its ciphertext if it is
+        sealed. Images with the same digest look the same when saved.
+        """
+        digest = hashlib.sha256(IMAGE_SIZE.pack(*self.size))
+        if self.sealed is not None:
+            digest.update(b"sealed")
+            digest.update(self.sealed[1])
+        else:
+            digest.update(b"pixels")
+            digest.update(self.pixels)
+        return digest.hexdigest()
+
     @classmethod
     def create_from_path(cls, path: str):
         """Create a non-encrypted CryptImage from a given path."""
@@ -27,19 +122,32 @@ class CryptImage:
         """Save the image to `path`."""
         self.image.convert(mode).save(path)
 
-    def encrypt(self, key: bytes | str):
-        """Encrypt the image data using `key`."""
+    def encrypt(self, key: bytes | str, codec: str = None):
+        """
+        Encrypt the image data using `key`.
+
+        If `codec` is given, the image data is compressed with it before it is
+        encrypted, since encrypted data doesn't compress.
+        """
 
         try:
             key = key.encode()
         except AttributeError:
             pass
 
-        image_data: bytes = self.image.tobytes()
         single_hash_key: bytes = hashlib.sha256(key).digest()
         cipher = AES.new(single_hash_key, AES.MODE_EAX, nonce=NONCE)
-        encrypted_image_data = cipher.encrypt(image_data)
-        self.image.frombytes(encrypted_image_data)
+        if self.sealed is not None:
+            sealed_codec, payload = self.sealed
+            self.sealed = (sealed_codec, crypt_buffer(cipher.encrypt, payload))
+        elif codec is not None:
+            compressor = get_codec(codec)
+            payload = compressor.compress(self.pixels)
+            self.sealed = (compressor, crypt_buffer(cipher.encrypt, payload))
+            self._image = None
+            self._pixels = None
+        else:
+            self._transform_pixels(cipher.encrypt)
         double_hash_key = hashlib.sha256(single_hash_key).digest()
         self.key_hash = double_hash_key
 
@@ -58,34 +166,116 @@ class CryptImage:
         if self.key_hash != double_hash_key:
             return False
 
-        cipher = AES.new(single_hash_key, AES.MODE_EAX, nonce=NONCE)
-        encrypted_image_data = self.image.tobytes()
-        decrypted_image_data = cipher.decrypt(encrypted_image_data)
-        self.image.frombytes(decrypted_image_data)
+        with DECRYPT_SECONDS.time():
+            cipher = AES.new(single_hash_key, AES.MODE_EAX, nonce=NONCE)
+            if self.sealed is not None:
+                codec, payload = self.sealed
+                width, height = self.size
+                pixels = codec.decompress(
+                    crypt_buffer(cipher.decrypt, payload),
+                    width * height * BYTES_PER_PIXEL,
+                )
+                self.sealed = None
+                self._pixels = memoryview(pixels)
+            else:
+                self._transform_pixels(cipher.decrypt)
         self.key_hash = None
         return True
 
-    def serialize(self) -> bytes:
+    def _transform_pixels(self, transform):
+        """
+        Run the pixel data through the cipher method `transform` in chunks.
+
+        Raw pixels are transformed in place when their buffer is writable. An `Image`
+        is streamed a few rows at a time into a new buffer, which replaces it, so
+        there is never more than one extra copy of the pixels in memory.
+        """
+        if self._image is None:
+            self._pixels = crypt_buffer(transform, self._pixels)
+            return
+
+        width, height = self.size
+        row_size = width * BYTES_PER_PIXEL
+        rows_per_chunk = max(CHUNK_SIZE // max(row_size, 1), 1)
+        pixels = memoryview(bytearray(row_size * height))
+        for top in range(0, height, rows_per_chunk):
+            bottom = min(top + rows_per_chunk, height)
+            rows = self._image.crop((0, top, width, bottom)).tobytes()
+            transform(rows, output=pixels[top * row_size : bottom * row_size])
+        self._image = None
+        self._pixels = pixels
+
+    def serialize(self, codec: str = None) -> bytes:
         """
         Serialize the CryptImage into the format:
 
         `<uint key_hash_length>` `<bytes key_hash>` `<uint width>`
         `<uint height>` `<bytes image data>`
 
-        with uints in Little-Endian
+        with uints in Little-Endian. A non-encrypted image has an empty key_hash.
+
+        If `codec` is given, or the image was compressed before it was encrypted,
+        it is serialized into the compressed format instead:
+
+        `<4s "CIMG">` `<byte version>` `<byte codec id>` `<byte flags>`
+        `<uint key_hash_length>` `<bytes key_hash>` `<uint width>` `<uint height>`
+        `<uint image data length>` `<bytes compressed image data>`
+        """
+
+        return b"".join(self.serialized_parts(codec))
+
+    def serialized_parts(self, codec: str = None) -> list[bytes | memoryview]:
+        """
+        Serialize the CryptImage like `serialize`, but as a list of buffers to be
+        written one after the other, so the image data isn't copied into one buffer
+        with the rest of the serialization.
         """
+        width, height = self.size
+        key_hash = self.key_hash or b""
+        if codec is None and self.sealed is None:
+            header = b"".join(
+                [UINT.pack(len(key_hash)), key_hash, IMAGE_SIZE.pack(width, height)]
+            )
+            return [header, self.pixels]
+
+        flags = 0
+        if self.sealed is not None:
+            compressor, image_data = self.sealed
+            flags |= FLAG_COMPRESSED_BEFORE_ENCRYPTION
+        else:
+            compressor = get_codec(codec)
+            image_data = compressor.compress(self.pixels)
 
-        width, height = self.image.size
-        image_data = self.image.tobytes()
-        serialization = struct.pack(
-            f"<I{len(self.key_hash)}sII{len(image_data)}s",
-            len(self.key_hash),
-            self.key_hash,
-            width,
-            height,
-            image_data,
+        header = b"".join(
+            [
+                FORMAT_HEADER.pack(
+                    FORMAT_MAGIC, FORMAT_VERSION, compressor.codec_id, flags
+                ),
+                UINT.pack(len(key_hash)),
+                key_hash,
+                COMPRESSED_IMAGE_SIZE.pack(width, height, len(image_data)),
+            ]
         )
-        return serialization
+        return [header, image_data]
+
+    @classmethod
+    def read_key_hash(cls, stream) -> bytes | None:
+        """
+        Read only the key hash of a serialized CryptImage from the start of the binary
+        file-like `stream`, in either format. Raises a `RuntimeError` if it is truncated.
+        """
+        prefix = stream.read(len(FORMAT_MAGIC))
+        if prefix == FORMAT_MAGIC:
+            stream.read(FORMAT_HEADER.size - len(FORMAT_MAGIC))
+            prefix = stream.read(BYTES_PER_UINT)
+        try:
+            (key_hash_length,) = UINT.unpack(prefix)
+        except struct.error as exc:
+            raise RuntimeError("Truncated CryptImage serialization.") from exc
+        key_hash = stream.read(key_hash_length)
+        if len(key_hash) != key_hash_length:
+            raise RuntimeError("Truncated CryptImage serialization.")
+        return key_hash or None
 
     @classmethod
     def deserialize(cls, serialization: bytes):
@@ -95,29 +285,120 @@ class CryptImage:
         `<uint key_hash_length>` `<bytes key_hash>` `<uint width>`
         `<uint height>` `<bytes image data>`
 
+        or of the compressed format described in `serialize`.
+        Uncompressed image data is not copied: the CryptImage keeps a view into
+        `serialization`, and decrypts it in place if `serialization` is writable.
+
         Raises a `RuntimeError` if malformed object received.
         """
+        serialization = memoryview(serialization)
+        if serialization[: len(FORMAT_MAGIC)] == FORMAT_MAGIC:
+            return cls._deserialize_compressed(serialization)
+
         try:
-            (key_hash_length,) = struct.unpack_from("<I", serialization)
-            (key_hash,) = struct.unpack_from(
-                f"{key_hash_length}s", serialization, BYTES_PER_UINT
-            )
+            key_hash, offset = _unpack_key_hash(serialization, 0)
+            width, height = IMAGE_SIZE.unpack_from(serialization, offset)
+        except struct.error as exc:
+            raise RuntimeError(
+                "CryptImage.deserialize received a malformed object serialization."
+            ) from exc
 
-            width, height = struct.unpack_from(
-                "<II", serialization, BYTES_PER_UINT + key_hash_length
+        image_offset = offset + IMAGE_SIZE.size
+        image_length = width * height * BYTES_PER_PIXEL
+        if len(serialization) < image_offset + image_length:
+            raise RuntimeError(
+                "CryptImage.deserialize received a malformed object serialization."
             )
+        image_data = serialization[image_offset : image_offset + image_length]
 
-            (image_data,) = struct.unpack_from(
-                f"{width * height * BYTES_PER_PIXEL}s",
-                serialization,
-                BYTES_PER_UINT + key_hash_length + 2 * BYTES_PER_UINT,
-            )
+        crypt_image = CryptImage.from_pixels((width, height), image_data)
+        crypt_image.key_hash = key_hash or None
+        return crypt_image
 
-            image = Image.frombytes("RGBA", (width, height), image_data)
+    @classmethod
+    def _deserialize_compressed(cls, serialization: memoryview):
+        """Deserialize a CryptImage of the compressed format described in `serialize`."""
+        try:
+            _, version, codec_id, flags = FORMAT_HEADER.unpack_from(serialization)
+            key_hash, offset = _unpack_key_hash(serialization, FORMAT_HEADER.size)
+            width, height, data_length = COMPRESSED_IMAGE_SIZE.unpack_from(
+                serialization, offset
+            )
+            offset += COMPRESSED_IMAGE_SIZE.size
         except struct.error as exc:
             raise RuntimeError(
                 "CryptImage.deserialize received a malformed object serialization."
             ) from exc
-        crypt_image = CryptImage(image)
-        crypt_image.key_hash = key_hash
+
+        if version != FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported CryptImage format version {version}.")
+        if len(serialization) < offset + data_length:
+            raise RuntimeError(
+                "CryptImage.deserialize received a malformed object serialization."
+            )
+        codec = get_codec_by_id(codec_id)
+        image_data = serialization[offset : offset + data_length]
+
+        if flags & FLAG_COMPRESSED_BEFORE_ENCRYPTION:
+            crypt_image = CryptImage(None)
+            crypt_image.size = (width, height)
+            crypt_image.sealed = (codec, image_data)
+        else:
+            pixels = codec.decompress(image_data, width * height * BYTES_PER_PIXEL)
+            crypt_image = CryptImage.from_pixels((width, height), pixels)
+        crypt_image.key_hash = key_hash or None
         return crypt_image
+
+
+def _unpack_key_hash(serialization: memoryview, offset: int) -> tuple[bytes, int]:
+    """
+    Unpack the `<uint key_hash_length>` `<bytes key_hash>` at `offset`, returning
+    the key hash and the offset after it. Raises `struct.error` if it is truncated.
+    """
+    (key_hash_length,) = UINT.unpack_from(serialization, offset)
+    offset += UINT.size
+    if offset + key_hash_length > len(serialization):
+        raise struct.error("Truncated key hash.")
+    return bytes(serialization[offset : offset + key_hash_length]), (
+        offset + key_hash_length
+    )
+
+
+def crypt_buffer(transform, buffer: bytes | memoryview) -> memoryview:
+    """
+    Run `buffer` through the cipher method `transform` in chunks of `CHUNK_SIZE`.
+    Writable buffers are transformed in place, and others are transformed into a
+    new buffer. Returns a view of the result.
+    """
+    source = memoryview(buffer)
+    destination = source if not source.readonly else memoryview(bytearray(len(source)))
+    for offset in range(0, len(source), CHUNK_SIZE):
+        chunk = slice(offset, offset + CHUNK_SIZE)
+        transform(source[chunk], output=destination[chunk])
+    return destination
+
+
+def encrypt_many(
+    items: Iterable, keys: Iterable[bytes | str], workers: int = None, codec: str = None
+):
+    """
+    Encrypt each of `items` (CryptImages or Cards) with the matching key in `keys`,
+    using a pool of `workers` threads (defaults to one per CPU).
+
+    The images are encrypted in place in the threads' shared memory, and the cipher
+    releases the GIL, so this scales with the number of cores.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Consume the results, so exceptions from the workers are raised here.
+        list(executor.map(lambda item, key: item.encrypt(key, codec), items, keys))
+
+
+def decrypt_many(
+    images: Iterable[CryptImage], keys: Iterable[bytes | str], workers: int = None
+) -> list[bool]:
+    """
+    Decrypt each of `images` with the matching key in `keys` in parallel, like
+    `encrypt_many`. Returns whether each decryption was successful.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(CryptImage.decrypt, images, keys))
@@ -0,0 +1,170 @@
+"""
+Author: Eyal Roginski
+Description: Solve cards by testing a list of candidate solutions against them.
+
+A card's `key_hash` is `sha256(sha256(solution))`, so a candidate can be checked
+against every card at once by hashing it once and looking the hash up, without
+decrypting anything. Only a matching card is decrypted.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple
+from card import Card
+
+DEFAULT_CHUNK_SIZE = 10000
+
+_target_hashes: frozenset[bytes] = frozenset()
+
+
+class SolveProgress(NamedTuple):
+    """Progress of a dictionary attack, as reported to its progress callback."""
+
+    tested: int
+    solved: int
+    total: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        """Candidates tested per second."""
+        return self.tested / self.elapsed if self.elapsed else 0.0
+
+
+def key_hash(candidate: bytes) -> bytes:
+    """The `key_hash` a card encrypted with `candidate` would have."""
+    return hashlib.sha256(hashlib.sha256(candidate).digest()).digest()
+
+
+def _set_target_hashes(target_hashes: frozenset[bytes]):
+    """Process pool initializer, so the targets are sent to each worker only once."""
+    # pylint: disable-next=global-statement
+    global _target_hashes
+    _target_hashes = target_hashes
+
+
+def _match_chunk(candidates: list[bytes]) -> tuple[int, list[tuple[bytes, bytes]]]:
+    """
+    Hash every candidate, and return how many were tested along with the
+    `(key_hash, candidate)` pairs that match a target.
+
+    hashlib has no batched SHA-256, so candidates are hashed one at a time, and
+    chunks are spread across processes instead. `key_hash` is inlined, which is
+    about 20% faster than calling it, and faster than hashing a chunk in passes.
+    """
+    sha256 = hashlib.sha256
+    matches = []
+    for candidate in candidates:
+        candidate_hash = sha256(sha256(candidate).digest()).digest()
+        if candidate_hash in _target_hashes:
+            matches.append((candidate_hash, candidate))
+    return len(candidates), matches
+
+
+def read_wordlist(path: str | Path) -> Iterator[bytes]:
+    """Lazily read the candidates in a wordlist file, one per line."""
+    with open(path, "rb") as wordlist:
+        for line in wordlist:
+            yield line.rstrip(b"\r\n")
+
+
+def _chunks(candidates: Iterable[bytes | str], size: int) -> Iterator[list[bytes]]:
+    """Split `candidates` into lists of up to `size` encoded candidates."""
+    candidates = iter(candidates)
+    while chunk := list(islice(candidates, size)):
+        yield [
+            candidate.encode() if isinstance(candidate, str) else candidate
+            for candidate in chunk
+        ]
+
+
+class DictionarySolver:
+    """
+    Tests candidate solutions against many cards at once, across a pool of
+    `workers` processes (defaults to one per CPU).
+
+    `cards` can also be lightweight stand-ins that only have a `key_hash`, such as
+    `CardSummary`s, in which case `load` turns one into a full Card once a
+    candidate matches it.
+    """
+
+    def __init__(
+        self,
+        cards: Iterable,
+        workers: int = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        load: Callable[[object], Card] = None,
+    ):
+        self.cards_by_hash: dict[bytes, list] = {}
+        for card in cards:
+            if card.key_hash is not None:
+                self.cards_by_hash.setdefault(card.key_hash, []).append(card)
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.load = load
+
+    def solve(
+        self,
+        candidates: Iterable[bytes | str],
+        progress: Callable[[SolveProgress], None] = None,
+    ) -> dict[Card, str]:
+        """
+        Test `candidates` (such as `read_wordlist(path)`) against the cards, and
+        return the cards that were solved along with their solutions. Stops early
+        once every card is solved. `progress` is called after every chunk.
+        """
+        solutions: dict[Card, str] = {}
+        solved_hashes: set[bytes] = set()
+        total = sum(len(cards) for cards in self.cards_by_hash.values())
+        tested = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_set_target_hashes,
+            initargs=(frozenset(self.cards_by_hash),),
+        ) as executor:
+            chunks = _chunks(candidates, self.chunk_size)
+            pending: list[Future] = []
+            # Keep a couple of chunks per worker in flight, so candidate generators
+            # are consumed lazily instead of being read into memory at once.
+            max_pending = 2 * self.workers
+            while len(solutions) < total:
+                for chunk in islice(chunks, max_pending - len(pending)):
+                    pending.append(executor.submit(_match_chunk, chunk))
+                if not pending:
+                    break
+
+                count, matches = pending.pop(0).result()
+                tested += count
+                for candidate_hash, candidate in matches:
+                    if candidate_hash not in solved_hashes:
+                        solved_hashes.add(candidate_hash)
+                        self._solve_matches(candidate_hash, candidate, solutions)
+                if progress is not None:
+                    progress(
+                        SolveProgress(
+                            tested,
+                            len(solutions),
+                            total,
+                            time.perf_counter() - start,
+                        )
+                    )
+            for future in pending:
+                future.cancel()
+        return solutions
+
+    def _solve_matches(
+        self, candidate_hash: bytes, candidate: bytes, solutions: dict[Card, str]
+    ):
+        """Decrypt the cards whose key hash is `candidate_hash`."""
+        solution = candidate.decode(errors="surrogateescape")
+        for card in self.cards_by_hash.get(candidate_hash, []):
+            if self.load is not None:
+                card = self.load(card)
+            if card.solve(candidate):
+                card.solution = solution
+                solutions[card] = solution
@@ -1,32 +1,82 @@
+from bisect import bisect_right, insort
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Iterable
 from os import mkdir
 import json
+import os
+import threading
 from furl import furl
+from blob_store import BLOBS_DIR_NAME, BlobStore
 from card import Card
+from card_file import CARD_FILE_SUFFIX, export_image, read_card_file, write_card_file
 from card_id import CardID
 
+INDEX_FILE_NAME = "index.jsonl"
+CARD_FILE_NAME = f"card{CARD_FILE_SUFFIX}"
+IMAGE_FILE_NAME = "image.jpg"
+
 
 class FileSaver:
     """
     Driver for saving and loading Cards from the file system.
+
+    Every saved card's metadata is also appended to an index file next to the card
+    directories, so listing creators and cards doesn't walk the directory tree.
+
+    Cards are stored in their native format (see `card_file`), with their pixels
+    compressed by the URL's `codec` argument if given. Their JPEGs are exported on
+    demand, and link to a `BlobStore` next to them, so identical images are stored
+    once.
     """
 
     def __init__(self, path: str = "."):
-        self.path = Path(furl(path).path)
+        self.path = Path(str(furl(path).path))
+        self.codec = furl(path).args.get("codec")
         if not self.path.exists():
             mkdir(self.path)
         elif not self.path.is_dir():
             raise TypeError(f"{self.path} isn't a directory.")
 
+        self.index_path = self.path / INDEX_FILE_NAME
+        self.blobs = BlobStore(self.path / BLOBS_DIR_NAME)
+        # creator -> card name -> metadata, as in `get_card_metadata`.
+        self.catalogue: dict[str, dict[str, dict]] = {}
+        # Sorted creator names, and each creator's sorted card names, for paging.
+        self._creators: list[str] = []
+        self._card_names: dict[str, list[str]] = {}
+        self._index_offset = 0
+        # Refreshing the in-memory catalogue isn't atomic, so threads take turns.
+        self._index_lock = threading.Lock()
+        if not self.index_path.exists():
+            self._rebuild_index()
+        self._refresh_index()
+
     def save(self, card: Card):
         """
         Saves the `card` including its metadata to a new directory under `dir_path`.
         Overrides existing data.
         """
+        self._append_to_index(self._save_card_files(card))
+
+    def save_many(self, cards: Iterable[Card]):
+        """
+        Save many cards like `save`, adding them all to the index in a single write.
+        """
+        self._append_to_index(*[self._save_card_files(card) for card in cards])
+
+    def _save_card_files(self, card: Card) -> dict:
+        """Save the card's directory, and return its index entry."""
         card_dir = self.path / f"{CardID.from_card(card).resolve()}"
         if not card_dir.exists():
             mkdir(card_dir)
 
+        card_path = card_dir / CARD_FILE_NAME
+        write_card_file(card, card_path, self.codec)
+        image_path = card_dir / IMAGE_FILE_NAME
+        # The JPEG of the previous card is stale, and is exported again on demand.
+        self.blobs.discard(image_path)
+
         with open(
             card_dir / "metadata.json", mode="w", encoding="utf-8"
         ) as metadata_file:
@@ -41,14 +91,19 @@ class FileSaver:
                 metadata_file,
             )
 
-        image_path = card_dir / "image.jpg"
-        image_path.unlink(missing_ok=True)
-        card.save_image(image_path, "RGB")
+        return {
+            "creator": card.creator,
+            "name": card.name,
+            "riddle": card.riddle,
+            "solution": card.solution,
+            "image_path": str(image_path),
+            "card_path": str(card_path),
+        }
 
     def load(self, card_id: CardID):
         """
-        Load a card by CardID.
-        Overwrites `<image_dir>/<card_id>.jpg`
+        Load a card by CardID, mapping its card file without decoding anything.
+        Cards saved as only a JPEG, before there were card files, are decoded.
         """
         card_dir = self.path / f"{card_id.resolve()}"
         if not card_dir.is_dir():
@@ -57,10 +112,128 @@ class FileSaver:
         with open(card_dir / "metadata.json", encoding="utf-8") as metadata_file:
             metadata = json.load(metadata_file)
 
+        if (card_dir / CARD_FILE_NAME).exists():
+            return read_card_file(card_dir / CARD_FILE_NAME, metadata["card.solution"])
         return Card.create_from_path(
             metadata["card.name"],
             metadata["card.creator"],
-            card_dir / "image.jpg",
+            card_dir / IMAGE_FILE_NAME,
             metadata["card.riddle"],
             metadata["card.solution"],
         )
+
+    def export_image(self, card_id: CardID) -> str:
+        """
+        Get the path of a JPEG of the card's image, exporting it if it wasn't yet.
+        """
+        card_dir = self.path / f"{card_id.resolve()}"
+        if not (card_dir / CARD_FILE_NAME).exists():
+            return str(card_dir / IMAGE_FILE_NAME)
+        return str(
+            export_image(
+                card_dir / CARD_FILE_NAME, card_dir / IMAGE_FILE_NAME, self.blobs
+            )
+        )
+
+    def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
+        """
+        Get a sorted list of creators' names: up to `limit` of them, starting after
+        `cursor`.
+        """
+        self._refresh_index()
+        return _page(self._creators, cursor, limit)
+
+    def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
+        """
+        Get a sorted list of the names of the cards a creator has submitted: up to
+        `limit` of them, starting after `cursor`.
+        """
+        self._refresh_index()
+        return _page(self._card_names.get(creator, []), cursor, limit)
+
+    def get_card_metadata(self, card_id: CardID) -> dict[str, str]:
+        """
+        Get a card's metadata via its ID, like `Saver.get_card_metadata`.
+        """
+        self._refresh_index()
+        return dict(self.catalogue[card_id.creator][card_id.name])
+
+    def get_catalogue_version(self) -> tuple[int, datetime]:
+        """
+        Get a counter that grows whenever a card is saved, and the time of the
+        last save.
+        """
+        self._refresh_index()
+        try:
+            mtime = self.index_path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = 0
+        # The index is append-only, so its length only grows.
+        return self._index_offset, datetime.fromtimestamp(mtime, timezone.utc)
+
+    def _append_to_index(self, *entries: dict):
+        """Append cards' metadata to the index. Later entries override earlier ones."""
+        if not entries:
+            return
+        lines = "".join(json.dumps(metadata) + "\n" for metadata in entries)
+        # A single O_APPEND write, so concurrent savers don't interleave lines.
+        descriptor = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(descriptor, lines.encode())
+        finally:
+            os.close(descriptor)
+
+    def _refresh_index(self):
+        """Apply the index entries that were appended since it was last read."""
+        with self._index_lock:
+            try:
+                with open(self.index_path, "rb") as index_file:
+                    index_file.seek(self._index_offset)
+                    new_entries = index_file.read()
+            except FileNotFoundError:
+                return
+
+            # Leave a partially written last line for the next refresh.
+            complete_length = new_entries.rfind(b"\n") + 1
+            for line in new_entries[:complete_length].splitlines():
+                metadata = json.loads(line)
+                self._add_to_catalogue(metadata)
+            self._index_offset += complete_length
+
+    def _add_to_catalogue(self, metadata: dict):
+        """Add or replace a card's metadata in the in-memory catalogue."""
+        creator, name = metadata["creator"], metadata["name"]
+        if creator not in self.catalogue:
+            self.catalogue[creator] = {}
+            self._card_names[creator] = []
+            insort(self._creators, creator)
+        if name not in self.catalogue[creator]:
+            insort(self._card_names[creator], name)
+        self.catalogue[creator][name] = metadata
+
+    def _rebuild_index(self):
+        """Create the index from the card directories that were saved without one."""
+        self.index_path.touch()
+        for metadata_path in sorted(self.path.glob("*/metadata.json")):
+            with open(metadata_path, encoding="utf-8") as metadata_file:
+                metadata = json.load(metadata_file)
+            entry = {
+                "creator": metadata["card.creator"],
+                "name": metadata["card.name"],
+                "riddle": metadata["card.riddle"],
+                "solution": metadata["card.solution"],
+                "image_path": str(metadata_path.parent / IMAGE_FILE_NAME),
+            }
+            card_path = metadata_path.parent / CARD_FILE_NAME
+            if card_path.exists():
+                entry["card_path"] = str(card_path)
+            self._append_to_index(entry)
+
+
+def _page(items: list[str], cursor: str = None, limit: int = None) -> list[str]:
+    """Up to `limit` of the sorted `items`, starting after `cursor`."""
+    start = bisect_right(items, cursor) if cursor is not None else 0
+    end = start + limit if limit is not None else len(items)
+    return items[start:end]
@@ -0,0 +1,101 @@
+"""
+Author: Eyal Roginski
+Description: An in-process cache of where card images are stored.
+
+Serving an image needs the card's metadata only for its `image_path`, so the path
+is cached by `CardID`. Entries expire after a TTL, so images saved by other
+processes are picked up eventually, and are invalidated right away when a card is
+saved through a `Saver` the cache listens to. The image is stat'ed again on every
+hit, so its `ETag` always matches the file that is served.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+from card import Card
+from card_id import CardID
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 30.0
+
+
+class CachedImage(NamedTuple):
+    """Where a card's image is stored, and what it looked like when it was stat'ed."""
+
+    path: str
+    size: int
+    last_modified: datetime
+    etag: str
+    expires: float
+
+
+class ImageCache:
+    """
+    An LRU cache of up to `max_entries` image locations, each kept for up to `ttl`
+    seconds. Safe to use from several threads.
+    """
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[CardID, CachedImage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, card_id: CardID, get_path: Callable[[CardID], str]) -> CachedImage:
+        """
+        Get the image of `card_id`, calling `get_path(card_id)` to find it on a miss.
+        Raises `OSError` if the image is missing.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(card_id)
+            if cached is not None and cached.expires <= now:
+                cached = None
+            if cached is not None:
+                self._entries.move_to_end(card_id)
+        if cached is not None:
+            fresh = _stat_image(cached.path, cached.expires)
+            if fresh == cached:
+                return cached
+            cached = fresh
+        else:
+            cached = _stat_image(get_path(card_id), now + self.ttl)
+        with self._lock:
+            self._entries[card_id] = cached
+            self._entries.move_to_end(card_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, card_id: CardID):
+        """Forget the image of `card_id`."""
+        with self._lock:
+            self._entries.pop(card_id, None)
+
+    def invalidate_card(self, card: Card):
+        """Forget the image of `card`, as a `Saver` save listener."""
+        self.invalidate(CardID.from_card(card))
+
+    def clear(self):
+        """Forget every image."""
+        with self._lock:
+            self._entries.clear()
+
+
+def _stat_image(path: str, expires: float) -> CachedImage:
+    """Describe the image at `path`. Raises `OSError` if it is missing."""
+    stat = os.stat(path)
+    return CachedImage(
+        path,
+        stat.st_size,
+        datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        # The image is rewritten whenever its card is saved, so the inode and
+        # modification time identify its content.
+        f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}",
+        expires,
+    )
@@ -0,0 +1,232 @@
+"""
+Author: Eyal Roginski
+Description: A crash-safe journal of received cards.
+
+The server appends every received card to the journal, and only acknowledges it
+once the journal is synced to disk. Once a card is saved, it is marked done in the
+journal. Cards that weren't marked done when the server stopped are replayed when
+it starts again.
+
+The journal is a directory of append-only segment files. Each segment starts with
+a `SEGMENT_HEADER`, followed by records of a `RECORD_HEADER` and a serialized card.
+A segment is rotated once it grows past a size, and deleted once all of its cards
+are done.
+
+Syncing to disk takes milliseconds, so appends use group commit: while one thread
+syncs, the others keep appending, and the next sync covers all of them at once.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+SEGMENT_MAGIC = b"CJNL"
+SEGMENT_VERSION = 1
+# `<4s magic>` `<byte version>`
+SEGMENT_HEADER = struct.Struct("<4sB")
+# `<uint payload length>` `<uint payload crc32>`
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".journal"
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class RecordID(NamedTuple):
+    """Where a record is in the journal."""
+
+    segment: int
+    offset: int
+
+
+def _sync(descriptor: int):
+    """Sync a file's data to disk, skipping metadata like its access time."""
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(descriptor)
+    else:
+        os.fsync(descriptor)
+
+
+def _write_all(descriptor: int, data: bytes | memoryview):
+    view = memoryview(data).cast("B")
+    while view:
+        view = view[os.write(descriptor, view) :]
+
+
+class Journal:
+    """
+    The journal in `directory`, with segments of about `segment_size` bytes.
+
+    Segments left by a previous run are sealed: `replay` reads their records, and
+    new records are appended to a new segment.
+    """
+
+    def __init__(self, directory: str | Path, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self._sealed_segments = sorted(
+            int(path.stem) for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+        )
+        # Records that aren't done yet, by segment.
+        self._pending: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        # Appends are numbered, and every append up to `_synced_count` is on disk.
+        self._written_count = 0
+        self._synced_count = 0
+        self._syncing = False
+        self._segment = None
+        self._descriptor = None
+        self._size = 0
+        self._open_segment(
+            self._sealed_segments[-1] + 1 if self._sealed_segments else 0
+        )
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:012}{SEGMENT_SUFFIX}"
+
+    def _open_segment(self, segment: int):
+        """Start appending to a new segment. Must hold the lock, if there are users."""
+        self._segment = segment
+        self._descriptor = os.open(
+            self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644
+        )
+        self._pending[segment] = 0
+        _write_all(
+            self._descriptor, SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION)
+        )
+        self._size = SEGMENT_HEADER.size
+        # Make the new file's directory entry durable too.
+        directory_descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+    def _rotate(self):
+        """Seal the current segment and start a new one. Must hold the lock."""
+        _sync(self._descriptor)
+        os.close(self._descriptor)
+        self._synced_count = self._written_count
+        self._synced.notify_all()
+        sealed = self._segment
+        self._open_segment(sealed + 1)
+        if not self._pending[sealed]:
+            self._delete_segment(sealed)
+
+    def append(self, payload: bytes | memoryview) -> RecordID:
+        """
+        Append a record, and return once it is synced to disk, along with its ID to
+        mark it done with.
+        """
+        header = RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+        with self._lock:
+            if self._size > SEGMENT_HEADER.size and (
+                self._size + len(header) + len(payload) > self.segment_size
+            ):
+                # Don't close the segment while it is being synced.
+                while self._syncing:
+                    self._synced.wait()
+                self._rotate()
+            record_id = RecordID(self._segment, self._size)
+            _write_all(self._descriptor, header)
+            _write_all(self._descriptor, payload)
+            self._size += len(header) + len(payload)
+            self._pending[self._segment] += 1
+            self._written_count += 1
+            ticket = self._written_count
+            self._wait_until_synced(ticket)
+        return record_id
+
+    def _wait_until_synced(self, ticket: int):
+        """
+        Wait until append number `ticket` is on disk, syncing it if no other thread
+        is syncing. Must hold the lock.
+        """
+        while self._synced_count < ticket:
+            if self._syncing:
+                self._synced.wait()
+                continue
+            # Sync everything written so far, letting others append meanwhile.
+            self._syncing = True
+            target = self._written_count
+            descriptor = self._descriptor
+            self._lock.release()
+            try:
+                _sync(descriptor)
+            finally:
+                self._lock.acquire()
+                self._syncing = False
+            self._synced_count = max(self._synced_count, target)
+            self._synced.notify_all()
+
+    def mark_done(self, record_id: RecordID):
+        """Mark a record as done, deleting its segment if it was the last one."""
+        with self._lock:
+            self._pending[record_id.segment] -= 1
+            if (
+                not self._pending[record_id.segment]
+                and record_id.segment != self._segment
+            ):
+                self._delete_segment(record_id.segment)
+
+    def _delete_segment(self, segment: int):
+        """Delete a sealed segment. Must hold the lock."""
+        del self._pending[segment]
+        self._segment_path(segment).unlink(missing_ok=True)
+
+    def replay(self) -> Iterator[tuple[RecordID, memoryview]]:
+        """
+        Iterate over the records of the segments left by a previous run, which
+        weren't marked done. Each of them must be marked done eventually, or it is
+        replayed again on the next run.
+
+        A record that was cut short by a crash ends its segment.
+        """
+        for segment in self._sealed_segments:
+            with open(self._segment_path(segment), "rb") as segment_file:
+                data = memoryview(segment_file.read())
+            records = list(_read_records(segment, data))
+            with self._lock:
+                self._pending[segment] = len(records)
+                if not records:
+                    self._delete_segment(segment)
+            yield from records
+        self._sealed_segments = []
+
+    def close(self):
+        """Sync and close the current segment."""
+        with self._lock:
+            while self._syncing:
+                self._synced.wait()
+            _sync(self._descriptor)
+            os.close(self._descriptor)
+            if not self._pending[self._segment]:
+                self._delete_segment(self._segment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_records(
+    segment: int, data: memoryview
+) -> Iterator[tuple[RecordID, memoryview]]:
+    """Read the intact records of a segment."""
+    if bytes(data[: SEGMENT_HEADER.size]) != SEGMENT_HEADER.pack(
+        SEGMENT_MAGIC, SEGMENT_VERSION
+    ):
+        return
+    offset = SEGMENT_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start : start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        yield RecordID(segment, offset), payload
+        offset = start + length
@@ -1,14 +1,21 @@
 import socket
-from connection import Connection
+from connection import Connection, DEFAULT_MAX_FRAME_SIZE
 
 
 class Listener:
     """Represents a listener on a port."""
 
-    def __init__(self, port: str | int, host: str, backlog: int = 1000) -> None:
+    def __init__(
+        self,
+        port: str | int,
+        host: str,
+        backlog: int = 1000,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    ) -> None:
         self.socket = socket.socket()
         self.socket.bind((host, int(port)))
         self.backlog = backlog
+        self.max_frame_size = max_frame_size
 
     def start(self):
         """Start listening for connections."""
@@ -21,7 +28,7 @@ class Listener:
     def accept(self) -> Connection:
         """Accept a connection."""
         connection, _ = self.socket.accept()
-        return Connection(connection)
+        return Connection(connection, self.max_frame_size)
 
     def __repr__(self) -> str:
         host, port = self.socket.getsockname()
@@ -0,0 +1,396 @@
+"""
+Author: Eyal Roginski
+Description: Lightweight counters, gauges and latency histograms.
+
+Metrics are registered once, at import time, in the process-wide `REGISTRY`, and
+updated from any thread. `exposition()` renders them in the Prometheus text
+format, which the API serves at `/metrics`, and the TCP server on its stats port.
+
+`disable()` turns every update into a no-op that only checks a flag, for when
+even a lock per update is too much.
+"""
+
+import abc
+import bisect
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, TextIO
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# In seconds, from half a millisecond to ten seconds.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+_enabled = True
+
+
+def enable():
+    """Start recording metrics."""
+    # pylint: disable-next=global-statement
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording metrics. Their values so far are kept."""
+    # pylint: disable-next=global-statement
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    """Whether metrics are being recorded."""
+    return _enabled
+
+
+class _NullTimer:
+    """What `Histogram.time` returns while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Observes how long a `with` block took in a histogram."""
+
+    def __init__(self, histogram: "Histogram"):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _Metric(abc.ABC):
+    """
+    A metric, or with `label_names`, a family of metrics with one child for every
+    combination of label values.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        # The `(name, value)` labels of a child.
+        self.label_pairs: tuple = ()
+        self._lock = threading.Lock()
+        self._children: dict[tuple, _Metric] = {}
+
+    def labels(self, *values: str):
+        """The child of this family with the given label values."""
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}.")
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child(values))
+        return child
+
+    def _new_child(self, values: tuple) -> "_Metric":
+        child = self._new_series()
+        child.label_pairs = tuple(zip(self.label_names, values))
+        return child
+
+    def _new_series(self) -> "_Metric":
+        return type(self)(self.name, self.documentation)
+
+    def series(self) -> list["_Metric"]:
+        """This metric, or the children of this family."""
+        if self.label_names:
+            return list(self._children.values())
+        return [self]
+
+    def series_name(self) -> str:
+        """The name of this series with its labels."""
+        return self.name + self._label_text()
+
+    def _label_text(self, extra: dict[str, str] = None) -> str:
+        pairs = dict(self.label_pairs)
+        pairs.update(extra or {})
+        if not pairs:
+            return ""
+        return (
+            "{"
+            + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs.items())
+            + "}"
+        )
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        """The lines of this metric in the exposition format, without comments."""
+
+    def exposition(self) -> str:
+        """This metric and its children in the exposition format."""
+        documentation = self.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines = [
+            f"# HELP {self.name} {documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for series in self.series():
+            lines += series.samples()
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """A value that only goes up, like the number of cards received."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        """Add `amount` to the counter."""
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.series_name()} {_format(self.value)}"]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, like the length of a queue."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.value = 0.0
+        self._function: Callable[[], float] = None
+
+    def set(self, value: float):
+        """Set the gauge to `value`."""
+        if _enabled:
+            self.value = value
+
+    def inc(self, amount: float = 1):
+        """Add `amount` to the gauge."""
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        """Subtract `amount` from the gauge."""
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the gauge's value from `function()` whenever it is exported."""
+        self._function = function
+
+    def samples(self) -> list[str]:
+        value = self._function() if self._function is not None else self.value
+        return [f"{self.series_name()} {_format(value)}"]
+
+
+class Histogram(_Metric):
+    """A distribution of values, like latencies, counted into buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # The last count is of the values above every bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_series(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        """Count `value` into its bucket."""
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer | _NullTimer:
+        """Observe how long a `with` block takes, in seconds."""
+        if not _enabled:
+            return _NULL_TIMER
+        return _Timer(self)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = self._label_text({"le": _format(bound)})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text()} {_format(total)}")
+        lines.append(f"{self.name}_count{self._label_text()} {count}")
+        return lines
+
+
+class Registry:
+    """A set of metrics, by name."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Add `metric`, or return the metric already registered under its name, so
+        a module can be imported more than once.
+        """
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if type(existing) is not type(metric):
+            raise ValueError(f"{metric.name} is already a {existing.kind}.")
+        return existing
+
+    def exposition(self) -> str:
+        """Every metric, in the Prometheus text format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "".join(metric.exposition() for metric in metrics)
+
+    def summary(self) -> list[str]:
+        """A line per series, with the count and mean of histograms, for logs."""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            for series in metric.series():
+                name = series.series_name()
+                if isinstance(series, Histogram):
+                    if series.count:
+                        mean = series.sum / series.count * 1000
+                        lines.append(f"{name} count={series.count} mean={mean:.2f}ms")
+                else:
+                    lines.append(f"{name} {series.samples()[0].rsplit(' ', 1)[1]}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, label_names: tuple = ()) -> Counter:
+    """Register a counter in `REGISTRY`."""
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+    """Register a gauge in `REGISTRY`."""
+    return REGISTRY.register(Gauge(name, documentation, label_names))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    label_names: tuple = (),
+    buckets: tuple = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Register a histogram in `REGISTRY`."""
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+
+def exposition() -> str:
+    """Every metric in `REGISTRY`, in the Prometheus text format."""
+    return REGISTRY.exposition()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the metrics at `/metrics`."""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve the metrics over HTTP at `http://host:port/metrics`, in a thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
+
+
+def dump_periodically(
+    interval: float, stream: TextIO = None, lock: threading.Lock = None
+) -> threading.Event:
+    """
+    Print the summary of the metrics to `stream` every `interval` seconds, in a
+    thread, holding `lock` while printing. Set the returned event to stop.
+    """
+    stop = threading.Event()
+    lock = lock or threading.Lock()
+
+    def dump():
+        while not stop.wait(interval):
+            lines = REGISTRY.summary()
+            with lock:
+                print("\n".join(["Metrics:", *lines]), file=stream or sys.stdout)
+
+    threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+    return stop
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
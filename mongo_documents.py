@@ -0,0 +1,115 @@
+"""
+Author: Eyal Roginski
+Description: The MongoDB documents of cards, shared by the Mongo savers.
+
+`MongoSaver` and `AsyncMongoSaver` store the same documents, and only differ in
+how they talk to the database, so the queries, aggregations and card files of
+both are built here.
+"""
+
+from pathlib import Path
+from pymongo import ASCENDING, DESCENDING
+from blob_store import BlobStore
+from card import Card
+from card_file import CARD_FILE_SUFFIX, export_image, read_card_file, write_card_file
+from card_id import CardID
+
+CATALOGUE_VERSION_ID = "catalogue_version"
+# Also serves queries on `creator` alone, as its prefix.
+CARD_INDEX = [("creator", ASCENDING), ("name", ASCENDING)]
+DUPLICATE_KEY_ERROR = 11000
+
+
+def save_card_file(
+    card: Card, image_dir: Path, blobs: BlobStore, codec: str = None
+) -> dict:
+    """
+    Write the card's file in `image_dir`, discard the stale JPEG of the card it
+    replaces, and return its metadata document.
+    """
+    card_path = image_dir / f"{CardID.from_card(card).resolve()}{CARD_FILE_SUFFIX}"
+    write_card_file(card, card_path, codec)
+    image_path = card_path.with_suffix(".jpg")
+    blobs.discard(image_path)
+    return {
+        "name": card.name,
+        "creator": card.creator,
+        "riddle": card.riddle,
+        "solution": card.solution,
+        "image_path": str(image_path),
+        "card_path": str(card_path),
+    }
+
+
+def load_card(doc: dict) -> Card:
+    """Load the card of a document, decoding its JPEG if it has no card file."""
+    if "card_path" in doc:
+        return read_card_file(doc["card_path"], doc["solution"])
+    return Card.create_from_path(
+        doc["name"], doc["creator"], doc["image_path"], doc["riddle"], doc["solution"]
+    )
+
+
+def export_card_image(doc: dict, blobs: BlobStore) -> str:
+    """The path of a JPEG of the card of a document, exporting it if needed."""
+    if "card_path" not in doc:
+        return doc["image_path"]
+    return str(export_image(doc["card_path"], doc["image_path"], blobs))
+
+
+def card_metadata(doc: dict) -> dict[str, str]:
+    """The metadata of a card, as in `get_card_metadata`, from its document."""
+    metadata = {
+        key: doc[key] for key in ("creator", "name", "riddle", "solution", "image_path")
+    }
+    # Cards saved before card files don't have one, and only cards saved while
+    # JPEGs were linked on save have a hash.
+    for key in ("card_path", "image_hash"):
+        if key in doc:
+            metadata[key] = doc[key]
+    return metadata
+
+
+def duplicate_cards_pipeline() -> list[dict]:
+    """
+    An aggregation of the cards with several documents, with the `ids` of their
+    documents, newest first.
+    """
+    return [
+        {"$sort": {"_id": DESCENDING}},
+        {
+            "$group": {
+                "_id": {"creator": "$creator", "name": "$name"},
+                "ids": {"$push": "$_id"},
+            }
+        },
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+
+
+def creators_pipeline(cursor: str = None, limit: int = None) -> list[dict]:
+    """An aggregation of the creators after `cursor`, as documents with `_id`s."""
+    pipeline = []
+    if cursor is not None:
+        pipeline.append({"$match": {"creator": {"$gt": cursor}}})
+    pipeline += [
+        {"$sort": {"creator": ASCENDING}},
+        {"$group": {"_id": "$creator"}},
+        {"$sort": {"_id": ASCENDING}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    return pipeline
+
+
+def cards_query(creator: str, cursor: str = None) -> dict:
+    """A query for the cards of `creator` after the card named `cursor`."""
+    query = {"creator": creator}
+    if cursor is not None:
+        query["name"] = {"$gt": cursor}
+    return query
+
+
+def card_filter(card_id: CardID) -> dict[str, str]:
+    """A query for the document of the card with ID `card_id`."""
+    return {"creator": card_id.creator, "name": card_id.name}
@@ -1,8 +1,25 @@
+from datetime import datetime, timezone
 from pathlib import Path
-from pymongo import MongoClient
+from typing import Iterable
+from pymongo import MongoClient, ASCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
 from furl import furl
+from blob_store import BLOBS_DIR_NAME, BlobStore
 from card import Card
 from card_id import CardID
+from mongo_documents import (
+    CARD_INDEX,
+    CATALOGUE_VERSION_ID,
+    DUPLICATE_KEY_ERROR,
+    card_filter,
+    card_metadata,
+    cards_query,
+    creators_pipeline,
+    duplicate_cards_pipeline,
+    export_card_image,
+    load_card,
+    save_card_file,
+)
 from os import makedirs
 
 
@@ -10,6 +27,12 @@ class MongoSaver:
     """
     Driver for saving Cards to a MongoDB database. You need to run a MongoDB database
     before using this.
+
+    Cards are keyed by their `CardID`: saving a card again replaces it. They are
+    stored in `image_dir` in their native format (see `card_file`), with their
+    pixels compressed by the URL's `codec` argument if given. Their JPEGs are
+    exported on demand, and link to a `BlobStore` in `image_dir`, so identical
+    images are stored once.
     """
 
     def __init__(
@@ -18,72 +41,128 @@ class MongoSaver:
         furl_path = furl(mongo_path)
         host = furl_path.host
         port = furl_path.port
+        self.codec = furl_path.args.get("codec")
 
         self.client = MongoClient(host, port)
         self.client.server_info()  # Check if the server really exists.
         self.database = self.client.cardazim_db
         self.collection = self.database.cardazim_collection
+        self.metadata_collection = self.database.cardazim_metadata
+        self._create_index()
         self.image_dir = Path(image_dir).expanduser().resolve()
         if not self.image_dir.exists():
             makedirs(self.image_dir)
+        self.blobs = BlobStore(self.image_dir / BLOBS_DIR_NAME)
+
+    def _create_index(self):
+        """
+        Create the unique index of cards by `CardID`. Collections from before it
+        may have several documents of a card, of which only the newest is kept.
+        """
+        try:
+            self.collection.create_index(CARD_INDEX, unique=True)
+        except OperationFailure as error:
+            if error.code != DUPLICATE_KEY_ERROR:
+                raise
+            duplicates = [
+                card_id
+                for doc in self.collection.aggregate(duplicate_cards_pipeline())
+                for card_id in doc["ids"][1:]
+            ]
+            self.collection.delete_many({"_id": {"$in": duplicates}})
+            print(f"Deleted {len(duplicates)} stale duplicate card documents")
+            self.collection.create_index(CARD_INDEX, unique=True)
 
     def save(self, card: Card):
         """
-        Save a card to the database. Overwrites `<image_dir>/<card_id>.jpg`
+        Save a card to the database. Overwrites `<image_dir>/<card_id>.card`
+        """
+        metadata = self._save_card_file(card)
+        self.collection.replace_one(
+            card_filter(CardID.from_card(card)), metadata, upsert=True
+        )
+        self._bump_catalogue_version()
+
+    def save_many(self, cards: Iterable[Card]):
+        """
+        Save many cards to the database with a single bulk write.
+        Overwrites `<image_dir>/<card_id>.card` for each of them.
+        """
+        requests = [
+            ReplaceOne(
+                card_filter(CardID.from_card(card)),
+                self._save_card_file(card),
+                upsert=True,
+            )
+            for card in cards
+        ]
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+            self._bump_catalogue_version()
+
+    def get_catalogue_version(self) -> tuple[int, datetime]:
+        """
+        Get a counter that grows whenever a card is saved, and the time of the
+        last save.
         """
-        image_path = self.image_dir / f"{CardID.from_card(card).resolve()}.jpg"
+        doc = self.metadata_collection.find_one({"_id": CATALOGUE_VERSION_ID})
+        if doc is None:
+            return 0, datetime.fromtimestamp(0, timezone.utc)
+        return doc["counter"], doc["last_modified"].replace(tzinfo=timezone.utc)
 
-        metadata = {
-            "name": card.name,
-            "creator": card.creator,
-            "riddle": card.riddle,
-            "solution": card.solution,
-            "image_path": str(image_path),
-        }
-        self.collection.insert_one(metadata)
-        image_path.unlink(missing_ok=True)
-        card.save_image(str(image_path), "RGB")
+    def _bump_catalogue_version(self):
+        """Record that the catalogue changed."""
+        self.metadata_collection.update_one(
+            {"_id": CATALOGUE_VERSION_ID},
+            {
+                "$inc": {"counter": 1},
+                "$set": {"last_modified": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+        )
+
+    def _save_card_file(self, card: Card) -> dict:
+        """Save the card's file, and return its metadata document."""
+        return save_card_file(card, self.image_dir, self.blobs, self.codec)
 
     def load(self, card_id: CardID) -> Card:
         """
         Load a card from the database.
         """
-        metadata: dict = self.collection.find_one(
-            {"name": card_id.name, "creator": card_id.creator}
-        )
+        return load_card(self.collection.find_one(card_filter(card_id)))
 
-        return Card.create_from_path(
-            metadata["name"],
-            metadata["creator"],
-            metadata["image_path"],
-            metadata["riddle"],
-            metadata["solution"],
+    def export_image(self, card_id: CardID) -> str:
+        """
+        Get the path of a JPEG of the card's image, exporting it if it wasn't yet.
+        """
+        return export_card_image(
+            self.collection.find_one(card_filter(card_id)), self.blobs
         )
 
-    def get_creators(self) -> list[str]:
+    def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
         """
-        Get a list of all creators' names.
+        Get a sorted list of creators' names: up to `limit` of them, starting after
+        `cursor`. The distinct creators are found by the database, using the index.
         """
-        return [doc["creator"] for doc in self.collection.find(projection=["creator"])]
+        pipeline = creators_pipeline(cursor, limit)
+        return [doc["_id"] for doc in self.collection.aggregate(pipeline)]
 
-    def get_cards(self, creator: str) -> list[str]:
+    def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
         """
-        Get a list of the names of all the cards a creator has submitted.
+        Get a sorted list of the names of the cards a creator has submitted: up to
+        `limit` of them, starting after `cursor`.
         """
-        return [
-            doc["name"]
-            for doc in self.collection.find({"creator": creator}, projection=["name"])
-        ]
+        documents = self.collection.find(
+            cards_query(creator, cursor), projection=["name"]
+        ).sort("name", ASCENDING)
+        if limit is not None:
+            documents = documents.limit(limit)
+        return [doc["name"] for doc in documents]
 
     def get_card_metadata(self, card_id: CardID) -> dict[str, str]:
         """
-        Get a card's metadata via its ID.
+        Get a card's metadata via its ID, like `Saver.get_card_metadata`.
         """
-        doc = self.collection.find_one(
-            {"name": card_id.name, "creator": card_id.creator}
-        )
-
-        return {
-            key: doc[key]
-            for key in ("creator", "name", "riddle", "solution", "image_path")
-        }
+        return card_metadata(self.collection.find_one(card_filter(card_id)))
@@ -0,0 +1,453 @@
+"""
+Author: Eyal Roginski
+Description: A single-file archive of many cards, with an index by CardID.
+
+A card per file costs an inode and a directory entry per card, and listing them
+scans the directory. A pack keeps every card in one append-only file instead:
+a `PACK_HEADER`, followed by records of a `RECORD_HEADER`, the card's metadata as
+JSON, and the card's serialization. Saving a card again appends a new record
+that supersedes the old one, and removing a card appends a tombstone.
+
+Which record is the current one of each card is kept in memory, and in a sidecar
+index file written every so often, so opening a pack only reads the records
+appended since. Cards are read through a read-only `mmap` of the pack, without
+copying them. `compact` rewrites the pack without superseded records.
+
+Several processes may use a pack at once: appends and compaction, which replaces
+the file, take a lock file, while reads take no lock. A record cut short by a
+crash can only be the last one in the pack, and is truncated away by the next
+writer. A pack with a corrupt record that is followed by others isn't
+truncated, but refused.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, NamedTuple
+from card import Card
+from card_id import CardID
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PACK_MAGIC = b"CPAK"
+PACK_VERSION = 1
+# `<4s magic>` `<byte version>` `<ulonglong records before this file's first record>`
+PACK_HEADER = struct.Struct("<4sBQ")
+# `<byte flags>` `<uint metadata length>` `<uint card length>`
+RECORD_FIELDS = struct.Struct("<BII")
+# The fields, and a `<uint crc32>` of them, the metadata and the card, so that
+# neither a torn record nor zeros pass for one.
+RECORD_HEADER = struct.Struct("<BIII")
+UINT_CHECKSUM = struct.Struct("<I")
+# The record is a tombstone: the card was removed, and has no serialization.
+FLAG_REMOVED = 0x01
+
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+INDEX_VERSION = 1
+# How many records may be appended before the sidecar index is written again.
+DEFAULT_INDEX_INTERVAL = 1024
+
+
+class PackEntry(NamedTuple):
+    """Where the current record of a card is in the pack."""
+
+    offset: int
+    length: int
+
+
+def _write_all(descriptor: int, data: bytes | memoryview):
+    view = memoryview(data).cast("B")
+    while view:
+        view = view[os.write(descriptor, view) :]
+
+
+def _read_record(mapping: mmap.mmap, entry: PackEntry) -> tuple[dict, memoryview]:
+    """The metadata and the card serialization of the record at `entry`."""
+    _, metadata_length, _, _ = RECORD_HEADER.unpack_from(mapping, entry.offset)
+    start = entry.offset + RECORD_HEADER.size
+    view = memoryview(mapping)[start : entry.offset + entry.length]
+    return json.loads(bytes(view[:metadata_length])), view[metadata_length:]
+
+
+class PackFile:
+    """
+    The pack at `path`, created if it doesn't exist. The sidecar index is written
+    after every `index_interval` appends, and when the pack is closed.
+    """
+
+    def __init__(self, path: str | Path, index_interval: int = DEFAULT_INDEX_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path.with_name(self.path.name + INDEX_SUFFIX)
+        self.index_interval = index_interval
+        self.entries: dict[CardID, PackEntry] = {}
+        # How many records were ever appended, including ones compacted away.
+        self.version = 0
+        # How many records were appended before the first record in the file.
+        self.base = 0
+        self._lock = threading.RLock()
+        self._lock_descriptor = os.open(
+            self.path.with_name(self.path.name + LOCK_SUFFIX), os.O_RDWR | os.O_CREAT
+        )
+        self._descriptor = None
+        self._identity = None
+        self._mapping = None
+        self._records = 0
+        self._scanned = 0
+        self._unindexed = 0
+        with self._file_lock():
+            self._open(locked=True)
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the lock of the processes writing the pack."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_descriptor, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_descriptor, fcntl.LOCK_UN)
+
+    def _open(self, locked: bool = False):
+        """
+        Open the pack and read its index. If the file lock is held (`locked`), no
+        record is being appended, so one that was cut short by a crash is
+        truncated away.
+        """
+        self._descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND)
+        stat = os.fstat(self._descriptor)
+        if stat.st_size == 0:
+            _write_all(self._descriptor, PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0))
+            stat = os.fstat(self._descriptor)
+        self._identity = (stat.st_dev, stat.st_ino)
+        header = os.pread(self._descriptor, PACK_HEADER.size, 0)
+        try:
+            magic, version, self.base = PACK_HEADER.unpack(header)
+        except struct.error as exc:
+            raise RuntimeError(f"{self.path} isn't a card pack.") from exc
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise RuntimeError(f"{self.path} isn't a version {PACK_VERSION} pack.")
+
+        self.entries = {}
+        self._records = 0
+        self._scanned = PACK_HEADER.size
+        self._mapping = None
+        self._read_index(stat.st_size)
+        self._scan(stat.st_size)
+        if locked:
+            self._truncate_torn_tail(stat.st_size)
+        self._map(self._scanned)
+
+    def _truncate_torn_tail(self, size: int):
+        """
+        Truncate the pack to the intact records scanned out of its `size` bytes,
+        if what follows them is a single record that was cut short. Must hold the
+        file lock, so it isn't a record being appended.
+
+        Raises `RuntimeError` if a corrupt record is followed by more data, which
+        would be lost.
+        """
+        if self._scanned >= size:
+            return
+        if size - self._scanned >= RECORD_HEADER.size:
+            _, metadata_length, card_length, _ = RECORD_HEADER.unpack_from(
+                self._mapping, self._scanned
+            )
+            end = self._scanned + RECORD_HEADER.size + metadata_length + card_length
+            # A crash may also leave the end of the file zeroed.
+            if end < size and self._mapping[end:size].strip(b"\0"):
+                raise RuntimeError(
+                    f"{self.path} has a corrupt record at offset {self._scanned}, "
+                    "followed by more records."
+                )
+        os.ftruncate(self._descriptor, self._scanned)
+        # The mapping is past the end of the file now.
+        self._mapping = None
+        self._map(self._scanned)
+
+    def _reopen_if_replaced(self, locked: bool = False) -> bool:
+        """Reopen the pack if it was compacted by another process since."""
+        stat = os.stat(self.path)
+        if (stat.st_dev, stat.st_ino) == self._identity:
+            return False
+        self._close_file()
+        self._open(locked)
+        return True
+
+    def refresh(self):
+        """Apply the records that other processes appended since the last refresh."""
+        with self._lock:
+            if not self._reopen_if_replaced():
+                self._scan(os.fstat(self._descriptor).st_size)
+
+    def _map(self, size: int):
+        """Map at least `size` bytes of the pack."""
+        if self._mapping is None or len(self._mapping) < size:
+            # Cards that were read keep views of the old mapping alive.
+            self._mapping = mmap.mmap(self._descriptor, 0, access=mmap.ACCESS_READ)
+
+    def _scan(self, size: int):
+        """Apply the intact records between the scanned part of the pack and `size`."""
+        if size <= self._scanned:
+            return
+        self._map(size)
+        view = memoryview(self._mapping)
+        offset = self._scanned
+        while offset + RECORD_HEADER.size <= size:
+            flags, metadata_length, card_length, checksum = RECORD_HEADER.unpack_from(
+                view, offset
+            )
+            start = offset + RECORD_HEADER.size
+            end = start + metadata_length + card_length
+            fields = view[offset : offset + RECORD_FIELDS.size]
+            if (
+                end > size
+                or zlib.crc32(view[start:end], zlib.crc32(fields)) != checksum
+            ):
+                # Still being written by another process, or cut short by a crash.
+                break
+            metadata = json.loads(bytes(view[start : start + metadata_length]))
+            card_id = CardID(metadata["name"], metadata["creator"])
+            if flags & FLAG_REMOVED:
+                self.entries.pop(card_id, None)
+            else:
+                self.entries[card_id] = PackEntry(offset, end - offset)
+            self._records += 1
+            offset = end
+        view.release()
+        self._scanned = offset
+        self.version = self.base + self._records
+
+    def append(self, card: Card, codec: str = None):
+        """Append a card, superseding the card with the same `CardID`, if any."""
+        self.append_many([card], codec)
+
+    def append_many(self, cards: list[Card], codec: str = None):
+        """Append many cards, under a single lock."""
+        records = []
+        for card in cards:
+            metadata = {
+                "creator": card.creator,
+                "name": card.name,
+                "riddle": card.riddle,
+                "solution": card.solution,
+            }
+            records.append((0, metadata, card.serialized_parts(codec)))
+        self._append_records(records)
+
+    def remove(self, card_id: CardID):
+        """Remove a card, by appending a tombstone for it."""
+        metadata = {"creator": card_id.creator, "name": card_id.name}
+        self._append_records([(FLAG_REMOVED, metadata, [])])
+
+    def _append_records(self, records: list[tuple[int, dict, list]]):
+        """
+        Append records, all of them or none.
+
+        Raises `RuntimeError` if they can't be read back from the pack.
+        """
+        with self._lock:
+            with self._file_lock():
+                if not self._reopen_if_replaced(locked=True):
+                    size = os.fstat(self._descriptor).st_size
+                    self._scan(size)
+                    self._truncate_torn_tail(size)
+                start = self._scanned
+                end = start
+                try:
+                    for flags, metadata, card_parts in records:
+                        end += self._write_record(flags, metadata, card_parts)
+                except OSError:
+                    # Don't leave a torn record for the next records to follow.
+                    os.ftruncate(self._descriptor, start)
+                    raise
+                self._scan(os.fstat(self._descriptor).st_size)
+            if self._scanned < end:
+                raise RuntimeError(
+                    f"The records appended to {self.path} at offset {start} are "
+                    "corrupt."
+                )
+            self._unindexed += len(records)
+            if self._unindexed >= self.index_interval:
+                self.write_index()
+
+    def _write_record(self, flags: int, metadata: dict, card_parts: list) -> int:
+        """
+        Append a record with a single write, and return its length. Raises
+        `OSError` if it was only partly written.
+        """
+        metadata = json.dumps(metadata).encode()
+        card_length = sum(len(part) for part in card_parts)
+        fields = RECORD_FIELDS.pack(flags, len(metadata), card_length)
+        checksum = zlib.crc32(metadata, zlib.crc32(fields))
+        for part in card_parts:
+            checksum = zlib.crc32(part, checksum)
+        header = fields + UINT_CHECKSUM.pack(checksum)
+        buffers = [header, metadata, *card_parts]
+        length = len(header) + len(metadata) + card_length
+        if os.writev(self._descriptor, buffers) != length:
+            raise OSError(f"Short write of a {length} byte record to {self.path}.")
+        return length
+
+    def read(self, card_id: CardID) -> tuple[dict, memoryview]:
+        """
+        Get a card's metadata, and a view of its serialization in the mapped pack.
+        Raises `KeyError` if there is no such card.
+        """
+        with self._lock:
+            self.refresh()
+            return _read_record(self._mapping, self.entries[card_id])
+
+    def load(self, card_id: CardID) -> Card:
+        """Load a card, with its solution. Its image is a view of the mapped pack."""
+        metadata, serialization = self.read(card_id)
+        card = Card.deserialize(serialization)
+        card.solution = metadata["solution"]
+        return card
+
+    def records(self) -> Iterator[tuple[CardID, dict, memoryview]]:
+        """
+        Iterate over the cards as `(card_id, metadata, serialization)`, in the
+        order they are stored, reading the pack sequentially.
+        """
+        with self._lock:
+            self.refresh()
+            entries = sorted(self.entries.items(), key=lambda item: item[1].offset)
+            mapping = self._mapping
+        if entries and hasattr(mapping, "madvise"):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        for card_id, entry in entries:
+            metadata, serialization = _read_record(mapping, entry)
+            yield card_id, metadata, serialization
+
+    def __iter__(self) -> Iterator[Card]:
+        """Iterate over the cards, with their solutions, in the order they are stored."""
+        for _, metadata, serialization in self.records():
+            card = Card.deserialize(serialization)
+            card.solution = metadata["solution"]
+            yield card
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, card_id: CardID) -> bool:
+        self.refresh()
+        return card_id in self.entries
+
+    def compact(self) -> int:
+        """
+        Rewrite the pack with only the current record of every card, and return
+        how many bytes that freed. Cards read before keep the old pack mapped.
+        """
+        with self._lock, self._file_lock():
+            if not self._reopen_if_replaced(locked=True):
+                size = os.fstat(self._descriptor).st_size
+                self._scan(size)
+                self._truncate_torn_tail(size)
+            old_size = self._scanned
+            entries = sorted(self.entries.values())
+            temporary_path = self.path.with_name(
+                f".{self.path.name}.{uuid.uuid4().hex}.tmp"
+            )
+            descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            try:
+                # Keep the version, so it still only grows.
+                base = self.version - len(entries)
+                _write_all(descriptor, PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, base))
+                for entry in entries:
+                    _write_all(
+                        descriptor,
+                        memoryview(self._mapping)[
+                            entry.offset : entry.offset + entry.length
+                        ],
+                    )
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+            os.replace(temporary_path, self.path)
+            self._close_file()
+            self._open(locked=True)
+            self.write_index()
+            return old_size - self._scanned
+
+    def write_index(self):
+        """Write the sidecar index, so the next open doesn't scan the whole pack."""
+        with self._lock:
+            index = {
+                "version": INDEX_VERSION,
+                "identity": list(self._identity),
+                "scanned": self._scanned,
+                "records": self._records,
+                "cards": [
+                    [card_id.creator, card_id.name, entry.offset, entry.length]
+                    for card_id, entry in self.entries.items()
+                ],
+            }
+            temporary_path = self.index_path.with_name(
+                f".{self.index_path.name}.{uuid.uuid4().hex}.tmp"
+            )
+            try:
+                with open(temporary_path, "w", encoding="utf-8") as index_file:
+                    json.dump(index, index_file)
+                os.replace(temporary_path, self.index_path)
+            except OSError:
+                # It's only a cache of the pack.
+                temporary_path.unlink(missing_ok=True)
+            self._unindexed = 0
+
+    def _read_index(self, size: int):
+        """Start from the sidecar index, if it is of this pack."""
+        try:
+            with open(self.index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if (
+            not isinstance(index, dict)
+            or index.get("version") != INDEX_VERSION
+            or index.get("identity") != list(self._identity)
+            or not PACK_HEADER.size <= index.get("scanned", -1) <= size
+        ):
+            return
+        self.entries = {
+            CardID(name, creator): PackEntry(offset, length)
+            for creator, name, offset, length in index["cards"]
+        }
+        self._records = index["records"]
+        self._scanned = index["scanned"]
+        self.version = self.base + self._records
+
+    def _close_file(self):
+        try:
+            self._mapping.close()
+        except (AttributeError, BufferError):
+            # Cards that were read still use it, so it's unmapped once they're gone.
+            pass
+        self._mapping = None
+        os.close(self._descriptor)
+
+    def close(self):
+        """Write the sidecar index, and close the pack."""
+        with self._lock:
+            self.write_index()
+            self._close_file()
+            os.close(self._lock_descriptor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,154 @@
+"""
+Author: Eyal Roginski
+Description: A Saver driver that keeps every card in a single pack file.
+
+`pack:///path/to/cards.pack` stores the cards in a `PackFile`, rather than in a
+directory per card like `file://` does, for collections of many cards. The
+catalogue is the pack's index, so listing cards reads nothing from disk.
+
+JPEGs of the cards are exported on demand next to the pack, into a `BlobStore`.
+An export is named after the record it was made from, so exports of superseded
+records are never served, even when another process saved the card.
+"""
+
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+from furl import furl
+from blob_store import BLOBS_DIR_NAME, BlobStore
+from card import Card
+from card_id import CardID
+from file_saver import _page
+from pack_file import PackEntry, PackFile
+
+IMAGES_DIR_SUFFIX = ".images"
+
+
+class PackSaver:
+    """
+    Driver for saving and loading Cards in a pack file, with their pixels
+    compressed by the URL's `codec` argument if given.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(str(furl(path).path))
+        self.codec = furl(path).args.get("codec")
+        self.pack = PackFile(self.path)
+        self.images_dir = self.path.with_name(self.path.name + IMAGES_DIR_SUFFIX)
+        self.blobs = BlobStore(self.images_dir / BLOBS_DIR_NAME)
+        # Sorted creator names, and each creator's sorted card names, for paging,
+        # as of `_listed_version` of the pack.
+        self._creators: list[str] = []
+        self._card_names: dict[str, list[str]] = {}
+        self._listed_version = None
+        self._lock = threading.Lock()
+
+    def save(self, card: Card):
+        """Save the card, replacing it if it exists."""
+        self.save_many([card])
+
+    def save_many(self, cards: Iterable[Card]):
+        """Save many cards like `save`, appending them to the pack at once."""
+        cards = list(cards)
+        self.pack.refresh()
+        # The JPEGs of the previous cards are stale, and are exported again on demand.
+        stale_exports = [
+            self._export_path(card_id, self.pack.entries[card_id])
+            for card_id in map(CardID.from_card, cards)
+            if card_id in self.pack.entries
+        ]
+        self.pack.append_many(cards, self.codec)
+        for image_path in stale_exports:
+            self.blobs.discard(image_path)
+
+    def load(self, card_id: CardID) -> Card:
+        """Load a card by CardID. Its image is a view of the mapped pack."""
+        return self.pack.load(card_id)
+
+    def export_image(self, card_id: CardID) -> str:
+        """
+        Get the path of a JPEG of the card's image, exporting it if it wasn't yet.
+        """
+        image_path = self._image_path(card_id)
+        if not image_path.exists():
+            self.blobs.link(self.pack.load(card_id), image_path)
+        return str(image_path)
+
+    def _image_path(self, card_id: CardID) -> Path:
+        """The export of the card's current record in the pack."""
+        self.pack.refresh()
+        return self._export_path(card_id, self.pack.entries[card_id])
+
+    def _export_path(self, card_id: CardID, entry: PackEntry) -> Path:
+        """The export of a card's record, named after where it is in the pack."""
+        return self.images_dir / (
+            f"{card_id.resolve()}.{self.pack.base:x}-{entry.offset:x}.jpg"
+        )
+
+    def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
+        """
+        Get a sorted list of creators' names: up to `limit` of them, starting after
+        `cursor`.
+        """
+        self._refresh_listing()
+        return _page(self._creators, cursor, limit)
+
+    def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
+        """
+        Get a sorted list of the names of the cards a creator has submitted: up to
+        `limit` of them, starting after `cursor`.
+        """
+        self._refresh_listing()
+        return _page(self._card_names.get(creator, []), cursor, limit)
+
+    def get_card_metadata(self, card_id: CardID) -> dict[str, str]:
+        """
+        Get a card's metadata via its ID, like `Saver.get_card_metadata`.
+        """
+        metadata, _ = self.pack.read(card_id)
+        metadata["image_path"] = str(self._image_path(card_id))
+        return metadata
+
+    def get_catalogue_version(self) -> tuple[int, datetime]:
+        """
+        Get a counter that grows whenever a card is saved, and the time of the
+        last save.
+        """
+        self.pack.refresh()
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = 0
+        return self.pack.version, datetime.fromtimestamp(mtime, timezone.utc)
+
+    def compact(self) -> int:
+        """
+        Drop the superseded cards from the pack, and return how many bytes that
+        freed. Every export is of a record that moved, so they're all discarded.
+        """
+        freed = self.pack.compact()
+        for image_path in self.images_dir.glob("*.jpg"):
+            self.blobs.discard(image_path)
+        return freed
+
+    def _refresh_listing(self):
+        """Sort the creators and card names again if cards were saved since."""
+        with self._lock:
+            self.pack.refresh()
+            if self._listed_version == self.pack.version:
+                return
+            card_names: dict[str, list[str]] = {}
+            for card_id in list(self.pack.entries):
+                card_names.setdefault(card_id.creator, []).append(card_id.name)
+            for names in card_names.values():
+                names.sort()
+            self._card_names = card_names
+            self._creators = sorted(card_names)
+            self._listed_version = self.pack.version
+
+    def close(self):
+        """Write the pack's index, and close it."""
+        self.pack.close()
@@ -0,0 +1,340 @@
+"""
+Author: Eyal Roginski
+Description: A write-behind queue of cards to save.
+
+Encoding a card's image and writing it to the database is much slower than
+receiving it, so the server hands received cards to a `SaveQueue` and moves on. A
+pool of workers, each with its own Saver, saves the queued cards in batches, and
+retries batches that fail.
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import Callable
+from card import Card
+from card_id import CardID
+from journal import Journal
+import metrics
+from saver import Saver
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+# How often idle workers look for spilled cards.
+SPILL_POLL_INTERVAL = 1.0
+
+# What `put` does when the queue is full.
+POLICY_BLOCK = "block"
+POLICY_REJECT = "reject"
+POLICY_SPILL = "spill"
+POLICIES = (POLICY_BLOCK, POLICY_REJECT, POLICY_SPILL)
+
+SPILL_SUFFIX = ".card"
+
+PUT_SECONDS = metrics.histogram(
+    "cardazim_save_queue_put_seconds",
+    "Time to queue a card to be saved, including journaling it and waiting for room.",
+)
+SPILLED_CARDS = metrics.counter(
+    "cardazim_spilled_cards_total", "Cards spilled to disk to be saved later."
+)
+QUEUE_SIZE = metrics.gauge(
+    "cardazim_save_queue_size", "Cards waiting in memory to be saved."
+)
+FAILED_CARDS = metrics.counter(
+    "cardazim_failed_cards_total", "Cards that couldn't be saved, even with retries."
+)
+
+_STOP = object()
+
+
+class QueueFullError(RuntimeError):
+    """Raised by `SaveQueue.put` when the queue is full and its policy is reject."""
+
+
+class SaveQueue:
+    """
+    Saves cards to the Saver at `saver_url` in the background.
+
+    Up to `max_size` cards wait in memory. When the queue is full, `put` blocks
+    until there is room, raises `QueueFullError`, or writes the card to `spill_dir`,
+    depending on `policy`. Spilled cards are saved once the queue has room again,
+    even by a queue created after a restart.
+
+    `workers` threads save up to `batch_size` cards at a time with
+    `Saver.save_many`. A batch that fails is retried up to `retries` times, waiting
+    longer each time from `retry_delay` seconds. Cards that still can't be saved
+    are spilled if there is a `spill_dir`, and reported to `on_error` otherwise.
+
+    With a `journal`, cards are written to it before they are queued, and marked
+    done there once they are saved or spilled, so cards that were queued when the
+    process died are saved by `replay_journal` on the next run.
+    """
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        saver_url: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        policy: str = POLICY_BLOCK,
+        spill_dir: str | Path = None,
+        retries: int = DEFAULT_RETRIES,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        on_error: Callable[[list[Card], Exception], None] = None,
+        journal: Journal = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue full policy {policy!r}.")
+        if policy == POLICY_SPILL and spill_dir is None:
+            raise ValueError("The spill policy needs a spill directory.")
+        self.saver_url = saver_url
+        self.batch_size = batch_size
+        self.policy = policy
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self._spilled = 0
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self._spilled = len(list(self.spill_dir.glob(f"*{SPILL_SUFFIX}")))
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_error = on_error
+        self.journal = journal
+        self.saved = 0
+        self.failed = 0
+        self._counts_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        # Spilled cards being saved, whose files are deleted once they are.
+        self._unspilling: set[Path] = set()
+        self._queue: queue.Queue = queue.Queue(max_size)
+        # Create the savers now, so a bad URL fails here rather than in a worker.
+        self._savers = [Saver(saver_url) for _ in range(workers)]
+        self._workers = [
+            threading.Thread(target=self._work, args=[saver], name=f"SaveQueue-{i}")
+            for i, saver in enumerate(self._savers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def add_save_listener(self, listener: Callable[[Card], None]):
+        """Call `listener(card)` after every card the workers save, from them."""
+        for saver in self._savers:
+            saver.add_save_listener(listener)
+
+    def put(self, card: Card, serialization: bytes | memoryview = None):
+        """
+        Queue a card to be saved, handling a full queue according to the policy.
+
+        With a journal, the card's `serialization` is journaled first, so once this
+        returns, the card survives a crash. A card that is rejected is marked done
+        in the journal right away.
+        """
+        with PUT_SECONDS.time():
+            on_saved = None
+            if self.journal is not None:
+                if serialization is None:
+                    serialization = card.serialize()
+                record_id = self.journal.append(serialization)
+                on_saved = partial(self.journal.mark_done, record_id)
+            try:
+                self._put_entry((card, on_saved))
+            except QueueFullError:
+                if on_saved is not None:
+                    on_saved()
+                raise
+
+    def replay_journal(self):
+        """Queue the cards left in the journal by a previous run."""
+        for record_id, serialization in self.journal.replay():
+            on_saved = partial(self.journal.mark_done, record_id)
+            try:
+                card = Card.deserialize(serialization)
+            except RuntimeError:
+                print(f"Dropping malformed journaled card {record_id}")
+                on_saved()
+                continue
+            # Wait for room even if new cards are rejected, to not lose these.
+            self._queue.put((card, on_saved))
+
+    def _put_entry(self, entry: tuple[Card, Callable]):
+        if self.policy == POLICY_BLOCK:
+            self._queue.put(entry)
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            if self.policy == POLICY_REJECT:
+                raise QueueFullError("The save queue is full.") from None
+            self._spill_entries([entry])
+
+    def qsize(self) -> int:
+        """How many cards are waiting in memory."""
+        return self._queue.qsize()
+
+    def join(self):
+        """Wait until every queued card was handled."""
+        self._queue.join()
+
+    def close(self):
+        """Save every queued card, and stop the workers."""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _work(self, saver: Saver):
+        """Save batches of queued cards until stopped."""
+        poll_interval = SPILL_POLL_INTERVAL if self.spill_dir is not None else None
+        while True:
+            try:
+                item = self._queue.get(timeout=poll_interval)
+            except queue.Empty:
+                self._save_batch(saver, self._unspill())
+                continue
+            batch = []
+            stopping = False
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._save_batch(saver, batch)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    self._queue.task_done()
+            if stopping:
+                return
+            # Catch up on spilled cards while the queue has room for new ones.
+            if self._queue.qsize() < self._queue.maxsize // 2:
+                self._save_batch(saver, self._unspill())
+
+    def _save_batch(self, saver: Saver, batch: list[tuple[Card, Callable]]):
+        """Save a batch of `(card, on_saved)` entries, retrying if it fails."""
+        if not batch:
+            return
+        cards = [card for card, _ in batch]
+        for attempt in range(self.retries + 1):
+            try:
+                saver.save_many(cards)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay * 2**attempt)
+                    continue
+                self._give_up(batch, error)
+                return
+            with self._counts_lock:
+                self.saved += len(batch)
+            _notify_saved(batch)
+            return
+
+    def _give_up(self, batch: list[tuple[Card, Callable]], error: Exception):
+        """Spill the cards of a batch that couldn't be saved, or report them."""
+        if self.spill_dir is not None:
+            self._spill_entries(batch)
+            return
+        with self._counts_lock:
+            self.failed += len(batch)
+        FAILED_CARDS.inc(len(batch))
+        if self.on_error is not None:
+            self.on_error([card for card, _ in batch], error)
+
+    def _spill_entries(self, entries: list[tuple[Card, Callable]]):
+        """
+        Spill cards, and only once they are on disk, mark them done in the
+        journal (or delete the spill files they were read from).
+        """
+        for card, _ in entries:
+            self._spill(card)
+        _fsync_directory(self.spill_dir)
+        with self._spill_lock:
+            self._spilled += len(entries)
+        SPILLED_CARDS.inc(len(entries))
+        _notify_saved(entries)
+
+    def _spill(self, card: Card):
+        """
+        Write a card to the spill directory, to be saved later. The directory must
+        be synced for its file to survive a crash.
+        """
+        name = f"{time.time_ns():020}-{uuid.uuid4().hex}{SPILL_SUFFIX}"
+        temporary_path = self.spill_dir / f".{name}.tmp"
+        with open(temporary_path, "wb") as spill_file:
+            card.write_to(spill_file)
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+        os.replace(temporary_path, self.spill_dir / name)
+
+    def _unspill(self) -> list[tuple[Card, Callable]]:
+        """
+        Take up to a batch of spilled cards, oldest first, as queue entries. Their
+        files are only deleted once they are saved, or spilled again.
+        """
+        entries = []
+        with self._spill_lock:
+            if not self._spilled:
+                return []
+            paths = [
+                path
+                for path in sorted(self.spill_dir.glob(f"*{SPILL_SUFFIX}"))
+                if path not in self._unspilling
+            ]
+            self._spilled = max(len(paths) - self.batch_size, 0)
+            for path in paths[: self.batch_size]:
+                try:
+                    with open(path, "rb") as spill_file:
+                        card = Card.deserialize(spill_file.read())
+                except RuntimeError:
+                    print(f"Dropping malformed spilled card {path.name}")
+                    path.unlink()
+                    continue
+                self._unspilling.add(path)
+                entries.append((card, partial(self._unspilled, path)))
+        return entries
+
+    def _unspilled(self, path: Path):
+        """Delete the file of a spilled card that was saved."""
+        path.unlink(missing_ok=True)
+        with self._spill_lock:
+            self._unspilling.discard(path)
+
+
+def _notify_saved(entries: list[tuple[Card, Callable]]):
+    for _, on_saved in entries:
+        if on_saved is not None:
+            on_saved()
+
+
+def _fsync_directory(directory: Path):
+    """Make the files renamed into `directory` survive a crash."""
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def describe_failure(cards: list[Card], error: Exception):
+    """An `on_error` callback that prints the cards that couldn't be saved."""
+    names = ", ".join(CardID.from_card(card).resolve() for card in cards)
+    print(f"Failed to save {names}: {error}")
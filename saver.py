@@ -1,10 +1,25 @@
+from datetime import datetime
+from typing import Callable, Iterable
 from furl import furl
 from card import Card
 from file_saver import FileSaver
 from mongo_saver import MongoSaver
+from pack_saver import PackSaver
 from card_id import CardID
+import metrics
 
-SAVER_DRIVERS: dict[str, type] = {"file": FileSaver, "mongodb": MongoSaver}
+SAVER_DRIVERS: dict[str, type] = {
+    "file": FileSaver,
+    "mongodb": MongoSaver,
+    "pack": PackSaver,
+}
+
+SAVE_SECONDS = metrics.histogram(
+    "cardazim_save_seconds",
+    "Time to save a card with `save`, or a batch of them with `save_many`.",
+    ["operation"],
+)
+SAVED_CARDS = metrics.counter("cardazim_saved_cards_total", "Cards saved.")
 
 
 class Saver:
@@ -13,12 +28,42 @@ class Saver:
     def __init__(self, path: str):
         furl_path = furl(path)
         self.driver = SAVER_DRIVERS[furl_path.scheme](path)
+        self.save_listeners: list[Callable[[Card], None]] = []
+
+    def add_save_listener(self, listener: Callable[[Card], None]):
+        """
+        Call `listener(card)` after every card saved through this saver, such as to
+        invalidate caches of the card.
+        """
+        self.save_listeners.append(listener)
 
     def save(self, card: Card):
         """
         Save the card using the driver.
         """
-        self.driver.save(card)
+        with SAVE_SECONDS.labels("save").time():
+            self.driver.save(card)
+        SAVED_CARDS.inc()
+        self._notify_saved(card)
+
+    def save_many(self, cards: Iterable[Card]):
+        """
+        Save many cards at once using the driver, which batches the writes.
+        """
+        cards = list(cards)
+        with SAVE_SECONDS.labels("save_many").time():
+            self.driver.save_many(cards)
+        SAVED_CARDS.inc(len(cards))
+        for card in cards:
+            self._notify_saved(card)
+
+    def _notify_saved(self, card: Card):
+        """Call the save listeners, which can't fail a save that succeeded."""
+        for listener in self.save_listeners:
+            try:
+                listener(card)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(f"Save listener {listener!r} failed: {error}")
 
     def load(self, card_id: CardID) -> Card:
         """
@@ -26,20 +71,43 @@ class Saver:
         """
         return self.driver.load(card_id)
 
-    def get_creators(self) -> list[str]:
+    def get_creators(self, cursor: str = None, limit: int = None) -> list[str]:
         """
-        Get a list of all creators' names.
+        Get a sorted list of creators' names: up to `limit` of them, starting after
+        `cursor`. Pass the last name of a page as the `cursor` to get the next page.
         """
-        return self.driver.get_creators()
+        return self.driver.get_creators(cursor, limit)
 
-    def get_cards(self, creator: str) -> list[str]:
+    def get_cards(
+        self, creator: str, cursor: str = None, limit: int = None
+    ) -> list[str]:
         """
-        Get a list of the names of all the cards a creator has submitted.
+        Get a sorted list of the names of the cards a creator has submitted: up to
+        `limit` of them, starting after `cursor`.
         """
-        return self.driver.get_cards(creator)
+        return self.driver.get_cards(creator, cursor, limit)
 
     def get_card_metadata(self, card_id: CardID) -> dict:
         """
         Get a card's metadata via its ID.
+
+        `image_path` is where `export_image` puts the card's JPEG, and only exists
+        once it was called. Cards are no longer linked to a JPEG when they are
+        saved, so only cards saved before that have an `image_hash`.
         """
         return self.driver.get_card_metadata(card_id)
+
+    def get_catalogue_version(self) -> tuple[int, datetime]:
+        """
+        Get a counter that grows whenever a card is saved, and the time of the
+        last save, for caching listings.
+        """
+        return self.driver.get_catalogue_version()
+
+    def export_image(self, card_id: CardID) -> str:
+        """
+        Get the path of a JPEG of the card's image, for the web. Cards are stored
+        in their native format, so the JPEG is exported on the first request, and
+        again after the card is saved.
+        """
+        return self.driver.export_image(card_id)
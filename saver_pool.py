@@ -0,0 +1,78 @@
+"""
+Author: Eyal Roginski
+Description: A pool of Savers, for serving many requests at once.
+
+A Saver isn't safe to share between threads, and its database connection can't be
+shared between processes, so every thread of a server process borrows its own
+Saver from the process's pool.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from saver import Saver
+
+DEFAULT_POOL_SIZE = 8
+
+
+class SaverPool:
+    """
+    Up to `size` Savers for `url`, made as they are needed. `setup` is called with
+    every new Saver, such as to add save listeners to it.
+
+    The pool belongs to the process that uses it: a process forked from it (such as
+    a server worker) starts with an empty pool of its own.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int = DEFAULT_POOL_SIZE,
+        setup: Callable[[Saver], None] = None,
+    ):
+        self.url = url
+        self.size = size
+        self.setup = setup
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle: list[Saver] = []
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(self.size)
+
+    def acquire(self) -> Saver:
+        """Borrow a Saver, waiting while all of them are in use."""
+        if self._pid != os.getpid():
+            self._reset()
+        self._available.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            saver = Saver(self.url)
+            if self.setup is not None:
+                self.setup(saver)
+        except BaseException:
+            self._available.release()
+            raise
+        return saver
+
+    def release(self, saver: Saver):
+        """Return a borrowed Saver to the pool."""
+        if self._pid != os.getpid():
+            # Borrowed before a fork, so it belongs to the parent's pool.
+            return
+        with self._lock:
+            self._idle.append(saver)
+        self._available.release()
+
+    @contextmanager
+    def saver(self) -> Iterator[Saver]:
+        """Borrow a Saver for the duration of a `with` block."""
+        saver = self.acquire()
+        try:
+            yield saver
+        finally:
+            self.release(saver)
@@ -5,18 +5,53 @@ Description: Cardazim server.
 
 import argparse
 import threading
-from connection import Connection
+import metrics
+from connection import (
+    ACK_NAMES,
+    RECEIVED_CARDS,
+    Connection,
+    DEFAULT_MAX_FRAME_SIZE,
+    FLAG_ACK_REQUESTED,
+    ACK_OK,
+    ACK_MALFORMED,
+    ACK_REJECTED,
+)
 from listener import Listener
+from journal import DEFAULT_SEGMENT_SIZE, Journal
 from card import Card
+from async_server import run_async_server, DEFAULT_MAX_CONCURRENCY
+from save_queue import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_WORKERS,
+    POLICIES,
+    POLICY_BLOCK,
+    QUEUE_SIZE,
+    QueueFullError,
+    SaveQueue,
+    describe_failure,
+)
+from thumbnail_cache import (
+    DEFAULT_MAX_BYTES,
+    ThumbnailCache,
+    ThumbnailPregenerator,
+)
 
 
-RECV_BUFSIZE = 4096
-
-
-def handle_connection(connection: Connection, printing_lock: threading.Lock):
+def handle_connection(
+    connection: Connection,
+    printing_lock: threading.Lock,
+    allow_legacy: bool = False,
+    save_queue: SaveQueue = None,
+):
     """
-    Handle the connection: receives data from the connection, parses it,
-    and prints the message to the screen.
+    Handle the connection: receives cards from the connection until it is closed,
+    parses them, and prints them to the screen. Cards that were sent with
+    `FLAG_ACK_REQUESTED` are acknowledged in the order they were received.
+
+    If there is a `save_queue`, the cards are also queued to be saved (and, if it
+    has a journal, journaled before they are acknowledged), and cards that it
+    rejects are acknowledged with `ACK_REJECTED`.
 
     ### Parameters
 
@@ -27,29 +62,66 @@ def handle_connection(connection: Connection, printing_lock: threading.Lock):
     :param address: the address from which the connection came.
 
     :param printing_lock: a threading.Lock to prevent simultaneous printing.
+
+    :param allow_legacy: whether to accept unframed messages from old clients.
+
+    :param save_queue: where to queue the received cards to be saved, if at all.
     """
     with connection:
-        try:
-            packet = connection.receive_message()
-            card = Card.deserialize(packet)
-        except RuntimeError:
-            print(f"Got malformed message from {connection}")
-            return
-        with printing_lock:
-            print(f"Received card '{card.name}' by {card.creator}")
+        sequence = 0
+        while True:
+            try:
+                flags, packet = connection.receive_frame(allow_legacy)
+            except (EOFError, OSError):
+                return
+            except RuntimeError:
+                with printing_lock:
+                    print(f"Got malformed message from {connection}")
+                return
+
+            try:
+                card = Card.deserialize(packet)
+            except RuntimeError:
+                status = ACK_MALFORMED
+                with printing_lock:
+                    print(f"Got malformed message from {connection}")
+            else:
+                status = ACK_OK
+                with printing_lock:
+                    print(f"Received card '{card.name}' by {card.creator}")
+                if save_queue is not None:
+                    try:
+                        save_queue.put(card, packet)
+                    except QueueFullError:
+                        status = ACK_REJECTED
 
+            RECEIVED_CARDS.labels(ACK_NAMES[status]).inc()
+            if flags & FLAG_ACK_REQUESTED:
+                try:
+                    connection.send_ack(sequence, status)
+                except OSError:
+                    return
+            sequence += 1
 
-def run_server(ip: str, port: str | int):
+
+def run_server(
+    ip: str,
+    port: str | int,
+    allow_legacy: bool = False,
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    save_queue: SaveQueue = None,
+):
     """
     Infinitely listens for data being sent to the server and prints it
-    to the terminal.
+    to the terminal, queueing the cards in `save_queue` if there is one.
     """
     printing_lock = threading.Lock()
-    with Listener(port, ip) as listener:
+    with Listener(port, ip, max_frame_size=max_frame_size) as listener:
         while True:
             connection = listener.accept()
             handle_thread = threading.Thread(
-                target=handle_connection, args=[connection, printing_lock]
+                target=handle_connection,
+                args=[connection, printing_lock, allow_legacy, save_queue],
             )
             handle_thread.start()
 
@@ -61,7 +133,117 @@ def get_args():
     parser = argparse.ArgumentParser(description="Receive data from clients.")
     parser.add_argument("ip", type=str, help="the ip to listen on")
     parser.add_argument("port", type=int, help="the port to listen on")
-    return parser.parse_args()
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="also accept unframed messages from old clients",
+    )
+    parser.add_argument(
+        "--max-frame-size",
+        type=int,
+        default=DEFAULT_MAX_FRAME_SIZE,
+        help="the largest message to accept, in bytes",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="serve with a thread per connection, or with asyncio",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="the most cards to receive at once with the asyncio engine",
+    )
+    parser.add_argument(
+        "--saver-url",
+        type=str,
+        help="also save the received cards to this database, such as "
+        "file:///var/lib/cardazim/cards",
+    )
+    parser.add_argument(
+        "--save-workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="how many threads save cards to the database",
+    )
+    parser.add_argument(
+        "--save-queue-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help="the most received cards to keep in memory while they wait to be saved",
+    )
+    parser.add_argument(
+        "--save-batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="the most cards to save to the database at once",
+    )
+    parser.add_argument(
+        "--queue-full",
+        choices=POLICIES,
+        default=POLICY_BLOCK,
+        help="when the save queue is full, wait for room, reject new cards, "
+        "or spill them to --spill-dir",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="where to keep cards that don't fit in the save queue, or can't be saved",
+    )
+    parser.add_argument(
+        "--journal-dir",
+        type=str,
+        help="journal the received cards here before acknowledging them, so they "
+        "are saved even if the server crashes. Needs --saver-url",
+    )
+    parser.add_argument(
+        "--journal-segment-size",
+        type=int,
+        default=DEFAULT_SEGMENT_SIZE,
+        help="the size of the journal files, in bytes",
+    )
+    parser.add_argument(
+        "--pregenerate-thumbnails",
+        action="store_true",
+        help="generate the thumbnails of saved cards in the background, for an API "
+        "with the same --thumbnail-dir. Needs --saver-url",
+    )
+    parser.add_argument(
+        "--thumbnail-dir",
+        type=str,
+        help="where the API caches thumbnails. Defaults to its temporary directory",
+    )
+    parser.add_argument(
+        "--thumbnail-cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        help="how many MiB of thumbnails the API caches",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        help="serve Prometheus metrics at http://<ip>:<stats-port>/metrics",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        help="print a summary of the metrics every this many seconds",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="don't record metrics, for the least overhead",
+    )
+    args = parser.parse_args()
+    if args.no_metrics and (args.stats_port or args.stats_interval):
+        parser.error("--stats-port and --stats-interval need metrics")
+    if args.journal_dir is not None and args.saver_url is None:
+        parser.error("--journal-dir needs --saver-url")
+    if args.pregenerate_thumbnails and args.saver_url is None:
+        parser.error("--pregenerate-thumbnails needs --saver-url")
+    return args
 
 
 def main():
@@ -69,10 +251,59 @@ def main():
     Implementation of the server CLI.
     """
     args = get_args()
+    if args.no_metrics:
+        metrics.disable()
+    if args.stats_port is not None:
+        metrics.serve_metrics(args.ip, args.stats_port)
+    if args.stats_interval is not None:
+        metrics.dump_periodically(args.stats_interval)
+    save_queue = None
+    journal = None
+    pregenerator = None
+    if args.journal_dir is not None:
+        journal = Journal(args.journal_dir, args.journal_segment_size)
+    if args.saver_url is not None:
+        save_queue = SaveQueue(
+            args.saver_url,
+            args.save_queue_size,
+            args.save_workers,
+            args.save_batch_size,
+            args.queue_full,
+            args.spill_dir,
+            on_error=describe_failure,
+            journal=journal,
+        )
+        QUEUE_SIZE.set_function(save_queue.qsize)
+    if args.pregenerate_thumbnails:
+        pregenerator = ThumbnailPregenerator(
+            ThumbnailCache(args.thumbnail_dir, args.thumbnail_cache_size * 2**20),
+            args.saver_url,
+        )
+        save_queue.add_save_listener(pregenerator.submit)
     try:
-        run_server(args.ip, args.port)
+        if journal is not None:
+            save_queue.replay_journal()
+        if args.engine == "asyncio":
+            run_async_server(
+                args.ip,
+                args.port,
+                args.legacy,
+                args.max_frame_size,
+                args.max_concurrency,
+                save_queue,
+            )
+        else:
+            run_server(args.ip, args.port, args.legacy, args.max_frame_size, save_queue)
     except KeyboardInterrupt:
         print()
+    finally:
+        if save_queue is not None:
+            print("Saving the queued cards...")
+            save_queue.close()
+        if pregenerator is not None:
+            pregenerator.close()
+        if journal is not None:
+            journal.close()
 
 
 if __name__ == "__main__":
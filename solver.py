@@ -28,6 +28,8 @@ from pathlib import Path
 import npyscreen
 from card import Card
 from saver import Saver
+from card_catalogue import CardCatalogue, CatalogueEntry
+from dictionary_solver import DictionarySolver, SolveProgress, read_wordlist
 
 # add your imports here!
 
@@ -35,37 +37,53 @@ from saver import Saver
 CARD_STR = "Card {card.name} by {card.creator}"
 
 
+def handle_correct_solution(
+    card: Card,
+    solution: str,
+    solved_cards_dir: Path | str = "./solved_cards",
+    unsolved_card_dir: Path | str = "./unsolved_cards",
+):
+    """
+    Handle a correct solution.
+    (move card to solved card directory etc.)
+    """
+    unsolved_card_dir = Path(unsolved_card_dir)
+    # Remove the card file if it's named <card.name>
+    # The other option is to delete it in get_cards, and I think
+    # that's a bit extreme.
+    (unsolved_card_dir / card.name).unlink(missing_ok=True)
+
+    solved_cards_dir = Path(solved_cards_dir)
+
+    saver = Saver(f"file://{solved_cards_dir.resolve()}")
+    saver.save(card)
+
+
+class AutoSolveButton(npyscreen.ButtonPress):
+    def whenPressed(self):
+        self.parent.parentApp.setNextForm("AutoSolve")
+        self.parent.editing = False
+
+
 class ChooseCardsForm(npyscreen.ActionForm):
     def get_cards(
         self, unsolved_card_dir: str | Path = "./unsolved_cards"
-    ) -> list[Card]:
+    ) -> list[CatalogueEntry]:
         """
-        returns list of unsolved cards.
-        replace this method with your own code
-        (read files from memory etc.)
+        returns list of unsolved cards, without their images.
+        Use `entry.load()` to load the full card.
         If `unsolved_card_dir` is invalid, returns an empty list.
         """
         try:
             unsolved_card_dir = Path(unsolved_card_dir)
         except TypeError:
             return []
-        if not unsolved_card_dir.is_dir():
-            return []
-
-        cards = []
 
-        for card_file_path in unsolved_card_dir.iterdir():
-            if not card_file_path.is_file():
-                continue
-
-            with open(card_file_path, "rb") as card_file:
-                packed_card = card_file.read()
-                cards.append(Card.deserialize(packed_card))
-
-        return cards
+        return CardCatalogue(unsolved_card_dir).entries()
 
     def create(self):
         self.cards = self.get_cards()
+        self.parentApp.cards = self.cards
         self.cards_strs = [CARD_STR.format(card=card) for card in self.cards]
         self.add(
             npyscreen.FixedText,
@@ -86,11 +104,13 @@ class ChooseCardsForm(npyscreen.ActionForm):
             values=self.cards_strs,
             exit_right=True,
             labelColor="DEFAULT",
+            max_height=-2,
         )
+        self.add(AutoSolveButton, name="Auto-solve all cards with a wordlist")
 
     def on_ok(self):
         if self.card.value:
-            self.parentApp.card = self.cards[self.card.value[0]]
+            self.parentApp.card = self.cards[self.card.value[0]].load()
             self.parentApp.setNextForm("SolveCard")
         else:
             self.parentApp.setNextForm("MAIN")
@@ -106,27 +126,8 @@ class SolveCardForm(npyscreen.Form):
         """
         return card.solve(solution)
 
-    def handle_correct_solution(
-        self,
-        card: Card,
-        solution: str,
-        solved_cards_dir: Path | str = "./solved_cards",
-        unsolved_card_dir: Path | str = "./unsolved_cards",
-    ):
-        """
-        Handle a correct solution.
-        (move card to solved card directory etc.)
-        """
-        unsolved_card_dir = Path(unsolved_card_dir)
-        # Remove the card file if it's named <card.name>
-        # The other option is to delete it in get_cards, and I think
-        # that's a bit extreme.
-        (unsolved_card_dir / card.name).unlink(missing_ok=True)
-
-        solved_cards_dir = Path(solved_cards_dir)
-
-        saver = Saver()
-        saver.save(card, solved_cards_dir)
+    def handle_correct_solution(self, card: Card, solution: str):
+        handle_correct_solution(card, solution)
 
     def solve(self, card, solution):
         if self.check_solution(card, solution):
@@ -191,14 +192,57 @@ class WrongSolutionForm(npyscreen.ActionForm):
         self.parentApp.setNextForm("MAIN")
 
 
+class AutoSolveForm(npyscreen.ActionForm):
+    def create(self):
+        self.add(
+            npyscreen.FixedText,
+            value="Try every line of a wordlist as the solution of every card.",
+            editable=False,
+        )
+        self.nextrely += 1
+        self.wordlist = self.add(npyscreen.TitleFilename, name="Wordlist:")
+        self.nextrely += 1
+        self.status = self.add(npyscreen.FixedText, value="", editable=False)
+
+    def show_progress(self, progress: SolveProgress):
+        self.status.value = (
+            f"Tested {progress.tested:,} candidates "
+            f"({progress.throughput:,.0f}/s), "
+            f"solved {progress.solved}/{progress.total} cards"
+        )
+        self.status.display()
+
+    def on_ok(self):
+        if not self.wordlist.value or not Path(self.wordlist.value).is_file():
+            npyscreen.notify_confirm("Please pick a wordlist file.", title="Oops")
+            self.parentApp.setNextForm("AutoSolve")
+            return
+
+        solver = DictionarySolver(self.parentApp.cards, load=CatalogueEntry.load)
+        solutions = solver.solve(read_wordlist(self.wordlist.value), self.show_progress)
+        for card, solution in solutions.items():
+            handle_correct_solution(card, solution)
+        npyscreen.notify_confirm(
+            f"{self.status.value}\n\n"
+            + "\n".join(CARD_STR.format(card=card) for card in solutions),
+            title="Auto-solve done",
+        )
+        self.parentApp.setNextForm("MAIN")
+
+    def on_cancel(self):
+        self.parentApp.setNextForm("MAIN")
+
+
 class InteractiveCLI(npyscreen.NPSAppManaged):
     card = None
+    cards = []
 
     def onStart(self):
         self.addFormClass("MAIN", ChooseCardsForm, name="Cards Solver")
         self.addFormClass("SolveCard", SolveCardForm, name="Cards Solver")
         self.addFormClass("WrongSolution", WrongSolutionForm, name="Cards Solver")
         self.addFormClass("RightSolution", RightSolutionForm, name="Cards Solver")
+        self.addFormClass("AutoSolve", AutoSolveForm, name="Cards Solver")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+import api
+from card import Card
+from crypt_image import CryptImage
+from thumbnail_cache import ThumbnailCache
+
+
+def make_card(name: str, creator: str) -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, "riddle", "solution")
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "saver_pool", None)
+    monkeypatch.setattr(api, "thumbnail_cache", None)
+    api.use_database(
+        f"file://{tmp_path / 'cards'}", ThumbnailCache(tmp_path / "thumbnails")
+    )
+    with api.saver_pool.saver() as saver:
+        for creator in ["alice", "bob", "carol"]:
+            for name in ["first", "second"]:
+                saver.save(make_card(name, creator))
+    return api.app.test_client()
+
+
+def test_get_creators(client):
+    assert client.get("/creators/").json == ["alice", "bob", "carol"]
+    assert client.get("/creators/?limit=1&cursor=alice").json == ["bob"]
+
+
+def test_get_cards(client):
+    assert client.get("/creators/bob/cards/").json == ["first", "second"]
+    assert client.get("/creators/bob/cards/?cursor=first").json == ["second"]
+
+
+def test_get_card_metadata(client):
+    metadata = client.get("/creators/bob/cards/first/").json
+    assert set(metadata) == {"creator", "name", "riddle", "solution", "image_path"}
+    assert metadata["riddle"] == "riddle"
+    assert metadata["image_path"] == "/creators/bob/cards/first/image.jpg"
+    assert client.get(metadata["image_path"]).mimetype == "image/jpeg"
+
+
+def test_listing_ndjson(client, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_PAGE_SIZE", 2)
+    response = client.get("/creators/?format=ndjson")
+    assert response.mimetype == api.NDJSON_MIMETYPE
+    assert response.get_data(as_text=True) == '"alice"\n"bob"\n"carol"\n'
+    response = client.get("/creators/?limit=1", headers={"Accept": api.NDJSON_MIMETYPE})
+    assert response.get_data(as_text=True) == '"alice"\n'
+
+
+def test_listing_next_cursor(client):
+    assert client.get("/creators/?limit=2").headers["X-Next-Cursor"] == "bob"
+    assert "X-Next-Cursor" not in client.get("/creators/?limit=5").headers
+
+
+def test_listing_limit(client, monkeypatch):
+    assert client.get("/creators/?limit=0").status_code == 400
+    assert client.get("/creators/?limit=-1").status_code == 400
+    monkeypatch.setattr(api, "MAX_PAGE_SIZE", 2)
+    for path in ["/creators/?limit=5", "/creators/"]:
+        response = client.get(path)
+        assert response.json == ["alice", "bob"]
+        assert response.headers["X-Next-Cursor"] == "bob"
+
+
+def test_listing_conditional(client):
+    etag = client.get("/creators/").headers["ETag"]
+    assert client.get("/creators/", headers={"If-None-Match": etag}).status_code == 304
+
+    with api.saver_pool.saver() as saver:
+        saver.save(make_card("first", "dave"))
+    response = client.get("/creators/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json[-1] == "dave"
+
+
+def test_listing_etag_per_representation(client):
+    response = client.get("/creators/")
+    assert "Accept" in response.vary
+    headers = {"Accept": api.NDJSON_MIMETYPE, "If-None-Match": response.headers["ETag"]}
+    response = client.get("/creators/", headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == api.NDJSON_MIMETYPE
+
+
+def test_image_caching(client):
+    response = client.get("/creators/bob/cards/first/image.jpg")
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert "max-age" in response.headers["Cache-Control"]
+    headers = {"If-None-Match": etag}
+    assert client.get(response.request.path, headers=headers).status_code == 304
+
+    response = client.get(response.request.path, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert len(response.data) == 10
+
+
+def test_image_cache_invalidated_on_save(client, monkeypatch):
+    path = "/creators/bob/cards/first/image.jpg"
+    etag = client.get(path).headers["ETag"]
+    lookups = []
+    with api.saver_pool.saver() as saver:
+        export_image = saver.export_image
+        monkeypatch.setattr(
+            saver,
+            "export_image",
+            lambda card_id: lookups.append(card_id) or export_image(card_id),
+        )
+    assert client.get(path).headers["ETag"] == etag
+    assert not lookups
+
+    card = make_card("first", "bob")
+    card.image = CryptImage(Image.new("RGBA", (8, 8), (200, 0, 0, 255)))
+    with api.saver_pool.saver() as saver:
+        saver.save(card)
+    lookups.clear()
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(lookups) == 1
+
+
+def test_image_thumbnail(client):
+    path = "/creators/bob/cards/first/image.jpg"
+    response = client.get(f"{path}?w=100")
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["ETag"] != client.get(path).headers["ETag"]
+    assert client.get(f"{path}?w=0").status_code == 400
+
+
+def test_sealed_image(client):
+    card = make_card("sealed", "bob")
+    card.encrypt(codec="zlib")
+    with api.saver_pool.saver() as saver:
+        saver.save(card)
+    assert client.get("/creators/bob/cards/sealed/image.jpg").status_code == 409
+
+
+def test_metrics(client):
+    client.get("/creators/")
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    assert 'cardazim_api_responses_total{route="/creators/",status="200"}' in text
+    assert "cardazim_saved_cards_total" in text
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+import async_saver
+from async_saver import AsyncSaver
+from card import Card
+from card_id import CardID
+from crypt_image import CryptImage
+
+
+def make_card(name: str, creator: str, riddle: str = "riddle") -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, riddle, "solution")
+
+
+async def exercise(saver: AsyncSaver):
+    await saver.save(make_card("first", "bob"))
+    await saver.save_many([make_card("second", "bob"), make_card("first", "alice")])
+    await saver.save(make_card("first", "bob", "new riddle"))
+    assert await saver.get_creators() == ["alice", "bob"]
+    assert await saver.get_creators("alice") == ["bob"]
+    assert await saver.get_cards("bob", limit=1) == ["first"]
+    metadata = await saver.get_card_metadata(CardID("first", "bob"))
+    assert metadata["riddle"] == "new riddle"
+    card = await saver.load(CardID("second", "bob"))
+    assert card.riddle == "riddle"
+    counter, _ = await saver.get_catalogue_version()
+    assert counter > 0
+
+
+def test_file_saver(tmp_path):
+    saver = AsyncSaver(f"file://{tmp_path}")
+    asyncio.run(exercise(saver))
+    saver.close()
+
+
+def test_mongo_saver(tmp_path, monkeypatch):
+    pytest.importorskip("motor")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setattr(
+        async_saver, "AsyncIOMotorClient", mongomock_motor.AsyncMongoMockClient
+    )
+    saver = AsyncSaver("mongodb://127.0.0.1:27017", image_dir=tmp_path)
+    assert saver.driver.blobs.directory == tmp_path / ".blobs"
+    asyncio.run(exercise(saver))
+    saver.close()
+
+
+def test_concurrent_saves_overlap(tmp_path):
+    saver = AsyncSaver(f"file://{tmp_path}", max_concurrency=4)
+    save_card_files = saver.driver.saver._save_card_files
+    running = []
+    overlapped = threading.Event()
+    lock = threading.Lock()
+
+    def slow_save_card_files(card):
+        with lock:
+            running.append(card)
+            if len(running) > 1:
+                overlapped.set()
+        time.sleep(0.05)
+        with lock:
+            running.remove(card)
+        return save_card_files(card)
+
+    saver.driver.saver._save_card_files = slow_save_card_files
+
+    async def save_all():
+        await asyncio.gather(
+            *(saver.save(make_card(f"card{i}", "bob")) for i in range(4))
+        )
+
+    asyncio.run(save_all())
+    saver.close()
+    assert overlapped.is_set()
+    assert len(saver.driver.saver.get_cards("bob")) == 4
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from async_server import read_frame
+from connection import pack_frame_header
+
+
+def read_from(data: bytes, **kwargs) -> bytes:
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        _, payload = await read_frame(reader, **kwargs)
+        return payload
+
+    return asyncio.run(read())
+
+
+def test_read_framed_message():
+    assert read_from(pack_frame_header(6) + b"abcdef") == b"abcdef"
+
+
+def test_read_truncated_message():
+    with pytest.raises(RuntimeError):
+        read_from(pack_frame_header(6) + b"abc")
+
+
+def test_read_legacy_message():
+    assert read_from(b"unframed legacy message", allow_legacy=True) == (
+        b"unframed legacy message"
+    )
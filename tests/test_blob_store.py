@@ -0,0 +1,62 @@
+import os
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from blob_store import BlobStore
+from card import Card
+from crypt_image import CryptImage
+from saver import Saver
+from card_id import CardID
+
+
+def make_card(name: str, color=(10, 20, 30, 255)) -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), color))
+    return Card(name, "creator", image, "riddle", "solution")
+
+
+def test_identical_images_shared(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    first = store.link(make_card("first"), tmp_path / "first.jpg")
+    second = store.link(make_card("second"), tmp_path / "second.jpg")
+    assert first == second
+    assert store.references(first) == 2
+    assert (tmp_path / "first.jpg").stat().st_ino == (
+        tmp_path / "second.jpg"
+    ).stat().st_ino
+
+
+def test_unchanged_image_not_encoded(tmp_path, monkeypatch):
+    store = BlobStore(tmp_path / "blobs")
+    store.link(make_card("first"), tmp_path / "first.jpg")
+    encoded = []
+    monkeypatch.setattr(Card, "save_image", lambda *args: encoded.append(args))
+    store.link(make_card("first"), tmp_path / "first.jpg")
+    store.link(make_card("second"), tmp_path / "second.jpg")
+    assert not encoded
+
+
+def test_garbage_collection(tmp_path):
+    store = BlobStore(tmp_path / "blobs", gc_threshold=2)
+    old = store.link(make_card("first"), tmp_path / "first.jpg")
+    store.link(make_card("first", (1, 1, 1, 255)), tmp_path / "first.jpg")
+    assert store.references(old) == 0
+    assert store.blob_path(old).exists()
+    assert store.collect_garbage() == 1
+    assert not store.blob_path(old).exists()
+
+    store.link(make_card("second"), tmp_path / "second.jpg")
+    store.link(make_card("second", (2, 2, 2, 255)), tmp_path / "second.jpg")
+    store.link(make_card("second", (3, 3, 3, 255)), tmp_path / "second.jpg")
+    assert len(list(store.directory.glob("??/*.jpg"))) == 2
+
+
+def test_file_saver_dedup(tmp_path):
+    saver = Saver(f"file://{tmp_path}")
+    saver.save_many([make_card("first"), make_card("second")])
+    first = saver.export_image(CardID("first", "creator"))
+    second = saver.export_image(CardID("second", "creator"))
+    assert os.stat(first).st_ino == os.stat(second).st_ino
+    digest = make_card("first").image.digest()
+    assert saver.driver.blobs.references(digest) == 2
+    assert saver.load(CardID("second", "creator")).image.size == (8, 8)
@@ -0,0 +1,119 @@
+import io
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card, solve_many
+from card_codecs import get_codec
+from crypt_image import CryptImage, SealedImageError, encrypt_many
+
+
+@pytest.fixture
+def image():
+    image = Image.new("RGBA", (16, 8))
+    image.putpixel((3, 2), (1, 2, 3, 4))
+    return image
+
+
+@pytest.fixture
+def encrypted_card(image):
+    card = Card("name", "creator", CryptImage(image.copy()), "riddle", "solution")
+    card.encrypt()
+    return card
+
+
+def test_serialization_roundtrip(encrypted_card, image):
+    card = Card.deserialize(encrypted_card.serialize())
+    assert (card.name, card.creator, card.riddle) == ("name", "creator", "riddle")
+    assert not card.solve("wrong")
+    assert card.solve("solution")
+    assert card.image.image.tobytes() == image.tobytes()
+
+
+def test_non_ascii_roundtrip(image):
+    card = Card("שם", "יוצר", CryptImage(image), "חידה?", "פתרון")
+    card.encrypt()
+    card = Card.deserialize(card.serialize())
+    assert (card.name, card.creator, card.riddle) == ("שם", "יוצר", "חידה?")
+    assert card.solve("פתרון")
+
+
+def test_deserialize_without_copy(encrypted_card):
+    serialization = bytearray(encrypted_card.serialize())
+    card = Card.deserialize(memoryview(serialization))
+    assert card.image.pixels.obj is serialization
+
+
+def test_deserialize_malformed(encrypted_card):
+    with pytest.raises(RuntimeError):
+        Card.deserialize(b"garbage!")
+    with pytest.raises(RuntimeError):
+        Card.deserialize(encrypted_card.serialize()[:-10])
+
+
+@pytest.mark.parametrize("codec", ["raw", "zlib", "lzma"])
+def test_compressed_serialization(image, codec):
+    card = Card("name", "creator", CryptImage(image.copy()), "riddle", "solution")
+    serialization = card.serialize(codec)
+    assert Card.deserialize(serialization).image.pixels == image.tobytes()
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_decompress_bounded(codec):
+    codec = get_codec(codec)
+    assert codec.decompress(codec.compress(b""), 0) == b""
+    for data, size in [(b"a" * 10**6, 0), (b"a" * 10**6, 10), (b"a" * 10, 11)]:
+        with pytest.raises(RuntimeError):
+            codec.decompress(codec.compress(data), size)
+    with pytest.raises(RuntimeError):
+        codec.decompress(codec.compress(b"")[:-1], 0)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_compress_before_encryption(image, codec):
+    card = Card("name", "creator", CryptImage(image.copy()), "riddle", "solution")
+    card.encrypt(codec=codec)
+    serialization = card.serialize()
+    assert len(serialization) < len(image.tobytes())
+
+    card = Card.deserialize(serialization)
+    assert not card.solve("wrong")
+    assert card.solve("solution")
+    assert card.image.image.tobytes() == image.tobytes()
+
+
+def test_decrypt_in_place(encrypted_card, image, monkeypatch):
+    monkeypatch.setattr("crypt_image.CHUNK_SIZE", 100)
+    serialization = bytearray(encrypted_card.serialize())
+    card = Card.deserialize(serialization)
+    assert card.solve("solution")
+    assert card.image.pixels.obj is serialization
+    assert card.image.pixels == image.tobytes()
+
+
+def test_write_to(encrypted_card):
+    stream = io.BytesIO()
+    encrypted_card.write_to(stream)
+    assert stream.getvalue() == encrypted_card.serialize()
+
+
+def test_encrypt_and_solve_many(image):
+    cards = [
+        Card(f"name{i}", "creator", CryptImage(image.copy()), "riddle")
+        for i in range(4)
+    ]
+    encrypt_many(cards, [f"key{i}" for i in range(4)], workers=2)
+    solutions = ["key0", "wrong", "key2", "key3"]
+    assert solve_many(cards, solutions, workers=2) == [True, False, True, True]
+    assert cards[0].image.image.tobytes() == image.tobytes()
+
+
+def test_sealed_image_has_no_pixels():
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    card = Card("name", "creator", image, "riddle", "solution")
+    card.encrypt(codec="zlib")
+    with pytest.raises(SealedImageError):
+        _ = card.image.pixels
+    assert card.image.decrypt("solution")
+    assert card.image.pixels.tobytes() == bytes([10, 20, 30, 255]) * 64
@@ -0,0 +1,55 @@
+import os
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card
+from card_catalogue import CardCatalogue, INDEX_FILE_NAME
+from crypt_image import CryptImage
+
+
+def write_card(path, name: str, codec: str = None) -> Card:
+    card = Card(name, "creator", CryptImage(Image.new("RGBA", (8, 8))), "riddle")
+    card.encrypt("solution", codec)
+    with open(path, "wb") as card_file:
+        card.write_to(card_file)
+    return card
+
+
+@pytest.fixture
+def card_dir(tmp_path):
+    write_card(tmp_path / "first", "first")
+    write_card(tmp_path / "second", "second", codec="zlib")
+    (tmp_path / "garbage").write_bytes(b"not a card")
+    return tmp_path
+
+
+def test_entries(card_dir):
+    entries = CardCatalogue(card_dir).entries()
+    assert [(entry.name, entry.creator) for entry in entries] == [
+        ("first", "creator"),
+        ("second", "creator"),
+    ]
+    assert entries[0].riddle == "riddle"
+    assert entries[1].key_hash is not None
+    assert entries[1].load().solve("solution")
+    assert (card_dir / INDEX_FILE_NAME).is_file()
+
+
+def test_entries_use_index(card_dir, monkeypatch):
+    CardCatalogue(card_dir).entries()
+
+    def fail(_):
+        raise AssertionError("read an unchanged card")
+
+    monkeypatch.setattr(Card, "read_summary", fail)
+    assert len(CardCatalogue(card_dir).entries()) == 2
+
+
+def test_entries_reread_changed_card(card_dir):
+    CardCatalogue(card_dir).entries()
+    write_card(card_dir / "first", "renamed")
+    os.utime(card_dir / "first", ns=(0, 0))
+    names = [entry.name for entry in CardCatalogue(card_dir).entries()]
+    assert names == ["renamed", "second"]
@@ -1,10 +1,14 @@
 import sys
+import socket
+import threading
 import pytest
+from PIL import Image
 
 # pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
 
 sys.path.append("/home/roginski/arazim/cardazim/")
 import client
+import server
 from connection import Connection
 from card import Card
 from crypt_image import CryptImage
@@ -31,3 +35,40 @@ def mock_card(monkeypatch):
 def test_send_message(mock_connection, mock_card):
     client.send_card(Connection, Card)
     assert sent_data[0] == b"abcdef"
+
+
+def test_send_cards_session():
+    left, right = socket.socketpair()
+    handler = threading.Thread(
+        target=server.handle_connection, args=[Connection(right), threading.Lock()]
+    )
+    handler.start()
+
+    cards = []
+    for i in range(5):
+        card = Card(f"card{i}", "creator", CryptImage(Image.new("RGBA", (4, 4))), "?")
+        card.encrypt("solution")
+        cards.append(card)
+
+    with Connection(left) as connection:
+        assert client.send_cards(connection, cards, window=2) == [True] * 5
+    handler.join()
+
+
+def test_send_card_files(tmp_path):
+    left, right = socket.socketpair()
+    handler = threading.Thread(
+        target=server.handle_connection, args=[Connection(right), threading.Lock()]
+    )
+    handler.start()
+
+    for i in range(3):
+        card = Card(f"card{i}", "creator", CryptImage(Image.new("RGBA", (4, 4))), "?")
+        card.encrypt("solution")
+        (tmp_path / f"card{i}").write_bytes(card.serialize())
+    (tmp_path / "malformed").write_bytes(b"not a card")
+
+    with Connection(left) as connection:
+        accepted = client.send_card_files(connection, client.card_files(tmp_path))
+    assert accepted == [True, True, True, False]
+    handler.join()
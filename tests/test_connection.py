@@ -0,0 +1,72 @@
+import socket
+import threading
+import pytest
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from connection import Connection
+
+
+@pytest.fixture
+def connection_pair():
+    left, right = socket.socketpair()
+    with Connection(left) as sender, Connection(right) as receiver:
+        yield sender, receiver
+
+
+def test_framed_roundtrip(connection_pair):
+    sender, receiver = connection_pair
+    sender.send_message(b"abcdef")
+    sender.send_message(b"ghi")
+    assert receiver.receive_message() == b"abcdef"
+    assert receiver.receive_message() == b"ghi"
+
+
+def test_frame_too_large(connection_pair):
+    sender, receiver = connection_pair
+    receiver.max_frame_size = 4
+    sender.send_message(b"abcdef")
+    with pytest.raises(RuntimeError):
+        receiver.receive_message()
+
+
+def test_truncated_frame(connection_pair):
+    sender, receiver = connection_pair
+    sender.socket.sendall(b"CRDZ\x01\x00\x10\x00\x00\x00abc")
+    sender.socket.shutdown(socket.SHUT_WR)
+    with pytest.raises(RuntimeError):
+        receiver.receive_message()
+
+
+def test_legacy_message(connection_pair):
+    sender, receiver = connection_pair
+    sender.socket.sendall(b"unframed legacy message")
+    sender.socket.shutdown(socket.SHUT_WR)
+    with pytest.raises(RuntimeError):
+        receiver.receive_message()
+
+
+def test_legacy_message_allowed(connection_pair):
+    sender, receiver = connection_pair
+    sender.socket.sendall(b"unframed legacy message")
+    sender.socket.shutdown(socket.SHUT_WR)
+    assert receiver.receive_message(allow_legacy=True) == b"unframed legacy message"
+
+
+def test_send_parts_partial_sends(connection_pair):
+    sender, receiver = connection_pair
+    # Larger than the socket buffers, so `sendmsg` sends it in several calls.
+    parts = [b"head", bytes(range(256)) * 16384, b"", memoryview(b"tail")]
+    thread = threading.Thread(target=sender.send_parts, args=[parts])
+    thread.start()
+    assert receiver.receive_message() == b"".join(parts)
+    thread.join()
+
+
+def test_send_file(connection_pair, tmp_path):
+    sender, receiver = connection_pair
+    path = tmp_path / "message"
+    path.write_bytes(b"file contents")
+    with open(path, "rb") as file:
+        sender.send_file(file)
+    assert receiver.receive_message() == b"file contents"
@@ -0,0 +1,37 @@
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card
+from crypt_image import CryptImage
+from dictionary_solver import DictionarySolver
+
+
+def test_dictionary_solver():
+    image = Image.new("RGBA", (4, 4), (1, 2, 3, 4))
+    cards = []
+    for i, solution in enumerate(["apple", "banana", "apple", "unguessable"]):
+        card = Card(f"card{i}", "creator", CryptImage(image.copy()), "riddle")
+        card.encrypt(solution)
+        cards.append(card)
+
+    progress = []
+    solver = DictionarySolver(cards, workers=2, chunk_size=2)
+    words = ["cherry", "apple", b"banana", "date", "elderberry"]
+    solutions = solver.solve(iter(words), progress.append)
+
+    assert solutions == {cards[0]: "apple", cards[1]: "banana", cards[2]: "apple"}
+    assert cards[0].image.image.tobytes() == image.tobytes()
+    assert cards[3].solution is None
+    assert progress[-1].tested == len(words)
+    assert progress[-1].solved == 3
+
+
+def test_solve_again():
+    image = Image.new("RGBA", (4, 4), (1, 2, 3, 4))
+    card = Card("card", "creator", CryptImage(image), "riddle")
+    card.encrypt("apple")
+    solver = DictionarySolver([card], workers=1)
+    assert solver.solve(["apple"]) == {card: "apple"}
+    card.encrypt("apple")
+    assert solver.solve(["apple"]) == {card: "apple"}
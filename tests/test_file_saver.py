@@ -0,0 +1,88 @@
+import mmap
+from pathlib import Path
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card
+from card_id import CardID
+from crypt_image import CryptImage
+from file_saver import FileSaver, INDEX_FILE_NAME
+
+
+def make_card(name: str, creator: str, riddle: str = "riddle") -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, riddle, "solution")
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = FileSaver(str(tmp_path))
+    saver.save(make_card("first", "alice"))
+    saver.save(make_card("second", "alice"))
+    saver.save(make_card("third", "bob"))
+    return saver
+
+
+def test_listing(saver):
+    assert sorted(saver.get_creators()) == ["alice", "bob"]
+    assert sorted(saver.get_cards("alice")) == ["first", "second"]
+    assert saver.get_cards("nobody") == []
+
+
+def test_card_metadata(saver):
+    saver.save(make_card("first", "alice", "new riddle"))
+    metadata = saver.get_card_metadata(CardID("first", "alice"))
+    assert metadata["riddle"] == "new riddle"
+    assert metadata["solution"] == "solution"
+    assert not Path(metadata["image_path"]).exists()
+    with Image.open(saver.export_image(CardID("first", "alice"))) as image:
+        assert image.size == (8, 8)
+
+
+def test_index_shared_between_savers(saver, tmp_path):
+    other_saver = FileSaver(str(tmp_path))
+    other_saver.save(make_card("fourth", "carol"))
+    assert sorted(saver.get_creators()) == ["alice", "bob", "carol"]
+
+
+def test_index_rebuilt(saver, tmp_path):
+    (tmp_path / INDEX_FILE_NAME).unlink()
+    assert sorted(FileSaver(str(tmp_path)).get_cards("alice")) == ["first", "second"]
+
+
+def test_save_many(saver):
+    saver.save_many([make_card("first", "alice", "new riddle"), make_card("x", "dan")])
+    assert sorted(saver.get_creators()) == ["alice", "bob", "dan"]
+    assert saver.get_card_metadata(CardID("first", "alice"))["riddle"] == "new riddle"
+
+
+def test_paging(saver):
+    saver.save(make_card("fourth", "alice"))
+    assert saver.get_creators(limit=1) == ["alice"]
+    assert saver.get_creators(cursor="alice") == ["bob"]
+    assert saver.get_cards("alice", limit=2) == ["first", "fourth"]
+    assert saver.get_cards("alice", cursor="fourth", limit=2) == ["second"]
+
+
+def test_encrypted_card_stays_decryptable(saver):
+    image = Image.new("RGBA", (8, 8), (10, 20, 30, 40))
+    card = Card("secret", "alice", CryptImage(image.copy()), "riddle", "solution")
+    card.encrypt()
+    saver.save(card)
+    loaded = saver.load(CardID("secret", "alice"))
+    assert isinstance(loaded.image.pixels.obj, mmap.mmap)
+    assert loaded.solve("solution")
+    assert loaded.image.image.tobytes() == image.tobytes()
+
+
+def test_export_replaced_on_save(saver):
+    card_id = CardID("first", "alice")
+    with Image.open(saver.export_image(card_id)) as image:
+        assert image.getpixel((0, 0)) == (10, 20, 30)
+    card = make_card("first", "alice")
+    card.image = CryptImage(Image.new("RGBA", (8, 8), (200, 0, 0, 255)))
+    saver.save(card)
+    with Image.open(saver.export_image(card_id)) as image:
+        assert image.getpixel((0, 0))[0] > 150
@@ -0,0 +1,27 @@
+import os
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card_id import CardID
+from image_cache import ImageCache
+
+
+def test_rewritten_image_gets_new_etag(tmp_path):
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"old")
+    lookups = []
+    cache = ImageCache()
+
+    def get_path(card_id):
+        lookups.append(card_id)
+        return str(path)
+
+    etag = cache.get(CardID("first", "alice"), get_path).etag
+    assert cache.get(CardID("first", "alice"), get_path).etag == etag
+
+    # Replaced by another process, within the TTL.
+    (tmp_path / "new.jpg").write_bytes(b"newer")
+    os.replace(tmp_path / "new.jpg", path)
+    cached = cache.get(CardID("first", "alice"), get_path)
+    assert cached.etag != etag and cached.size == 5
+    assert len(lookups) == 1
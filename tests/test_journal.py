@@ -0,0 +1,89 @@
+import threading
+import time
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+import journal as journal_module
+from card import Card
+from crypt_image import CryptImage
+from journal import Journal
+from saver import Saver
+from save_queue import SaveQueue
+
+
+def replayed(directory) -> list[bytes]:
+    with Journal(directory) as journal:
+        records = [bytes(payload) for _, payload in journal.replay()]
+    return records
+
+
+def test_replay_unfinished(tmp_path):
+    with Journal(tmp_path) as journal:
+        first = journal.append(b"first")
+        journal.append(b"second")
+        journal.mark_done(first)
+    assert replayed(tmp_path) == [b"first", b"second"]
+
+
+def test_done_segments_deleted(tmp_path):
+    with Journal(tmp_path, segment_size=32) as journal:
+        records = [journal.append(f"record {i}".encode()) for i in range(5)]
+        assert len(list(tmp_path.iterdir())) > 1
+        for record_id in records:
+            journal.mark_done(record_id)
+    assert not list(tmp_path.iterdir())
+
+
+def test_replay_marks_done(tmp_path):
+    with Journal(tmp_path) as journal:
+        journal.append(b"record")
+    with Journal(tmp_path) as journal:
+        for record_id, _ in journal.replay():
+            journal.mark_done(record_id)
+    assert replayed(tmp_path) == []
+
+
+def test_torn_record(tmp_path):
+    with Journal(tmp_path) as journal:
+        journal.append(b"intact")
+        journal.append(b"torn record")
+    (segment,) = tmp_path.iterdir()
+    segment.write_bytes(segment.read_bytes()[:-3])
+    assert replayed(tmp_path) == [b"intact"]
+
+
+def test_group_commit(tmp_path, monkeypatch):
+    syncs = []
+    sync = journal_module._sync
+
+    def slow_sync(descriptor):
+        syncs.append(descriptor)
+        time.sleep(0.01)
+        sync(descriptor)
+
+    monkeypatch.setattr(journal_module, "_sync", slow_sync)
+    with Journal(tmp_path) as journal:
+        threads = [
+            threading.Thread(target=journal.append, args=[b"record"]) for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(syncs) < 20
+    assert len(replayed(tmp_path)) == 20
+
+
+def test_save_queue_replays_journal(tmp_path):
+    card = Card("name", "creator", CryptImage(Image.new("RGBA", (8, 8))), "r", "s")
+    with Journal(tmp_path / "journal") as journal:
+        journal.append(card.serialize())
+
+    url = f"file://{tmp_path / 'cards'}"
+    with Journal(tmp_path / "journal") as journal:
+        with SaveQueue(url, journal=journal) as queue:
+            queue.replay_journal()
+            queue.put(card)
+    assert Saver(url).get_cards("creator") == ["name"]
+    assert not list((tmp_path / "journal").iterdir())
@@ -0,0 +1,74 @@
+import urllib.request
+import pytest
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    yield registry
+    metrics.enable()
+
+
+def test_counter_and_gauge(registry):
+    cards = metrics.counter("cards_total", "Cards.", ["status"])
+    cards.labels("ok").inc()
+    cards.labels("ok").inc(2)
+    cards.labels("rejected").inc()
+    size = metrics.gauge("queue_size", "Queue size.")
+    size.set_function(lambda: 7)
+    text = registry.exposition()
+    assert "# TYPE cards_total counter" in text
+    assert 'cards_total{status="ok"} 3' in text
+    assert 'cards_total{status="rejected"} 1' in text
+    assert "queue_size 7" in text
+
+
+def test_histogram(registry):
+    latency = metrics.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    for value in [0.05, 0.5, 0.5, 5]:
+        latency.observe(value)
+    lines = registry.exposition().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 6.05" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_register_twice(registry):
+    assert metrics.counter("cards_total", "Cards.") is metrics.counter(
+        "cards_total", "Cards."
+    )
+    with pytest.raises(ValueError):
+        metrics.gauge("cards_total", "Cards.")
+
+
+def test_disabled(registry):
+    cards = metrics.counter("cards_total", "Cards.")
+    latency = metrics.histogram("latency_seconds", "Latency.")
+    metrics.disable()
+    cards.inc()
+    with latency.time():
+        pass
+    assert (cards.value, latency.count) == (0, 0)
+    metrics.enable()
+    with latency.time():
+        pass
+    assert latency.count == 1
+
+
+def test_serve_metrics(registry):
+    metrics.counter("cards_total", "Cards.").inc()
+    server = metrics.serve_metrics("127.0.0.1", 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert "cards_total 1" in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,84 @@
+import os
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+mongomock = pytest.importorskip("mongomock")
+
+import mongo_saver
+from card import Card
+from card_id import CardID
+from crypt_image import CryptImage
+
+
+def make_card(name: str, creator: str, riddle: str = "riddle") -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, riddle, "solution")
+
+
+@pytest.fixture
+def saver(tmp_path, monkeypatch):
+    monkeypatch.setattr(mongo_saver, "MongoClient", mongomock.MongoClient)
+    return mongo_saver.MongoSaver("mongodb://127.0.0.1:27017", tmp_path)
+
+
+def test_save_replaces(saver):
+    saver.save(make_card("first", "alice"))
+    saver.save(make_card("first", "alice", "new riddle"))
+    assert saver.collection.count_documents({}) == 1
+    metadata = saver.get_card_metadata(CardID("first", "alice"))
+    assert metadata["riddle"] == "new riddle"
+
+
+def test_save_many(saver):
+    saver.save(make_card("first", "alice"))
+    saver.save_many(
+        [
+            make_card("first", "alice", "new riddle"),
+            make_card("second", "alice"),
+            make_card("third", "bob"),
+        ]
+    )
+    assert saver.collection.count_documents({}) == 3
+    assert sorted(saver.get_cards("alice")) == ["first", "second"]
+    assert saver.get_card_metadata(CardID("first", "alice"))["riddle"] == "new riddle"
+    assert saver.load(CardID("third", "bob")).riddle == "riddle"
+
+
+def test_paging(saver):
+    saver.save_many(
+        [
+            make_card("b", "alice"),
+            make_card("a", "alice"),
+            make_card("c", "alice"),
+            make_card("a", "bob"),
+            make_card("a", "carol"),
+        ]
+    )
+    assert saver.get_creators() == ["alice", "bob", "carol"]
+    assert saver.get_creators(cursor="alice", limit=1) == ["bob"]
+    assert saver.get_cards("alice", limit=2) == ["a", "b"]
+    assert saver.get_cards("alice", cursor="b") == ["c"]
+
+
+def test_identical_images_shared(saver):
+    saver.save_many([make_card("first", "alice"), make_card("second", "alice")])
+    first = saver.export_image(CardID("first", "alice"))
+    second = saver.export_image(CardID("second", "alice"))
+    assert os.stat(first).st_ino == os.stat(second).st_ino
+    assert saver.blobs.references(make_card("first", "alice").image.digest()) == 2
+
+
+def test_duplicates_from_before_the_index(tmp_path, monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongo_saver, "MongoClient", lambda host, port: client)
+    collection = client.cardazim_db.cardazim_collection
+    for riddle in ["old", "new"]:
+        collection.insert_one({"creator": "alice", "name": "first", "riddle": riddle})
+    collection.insert_one({"creator": "bob", "name": "first", "riddle": "only"})
+    saver = mongo_saver.MongoSaver("mongodb://127.0.0.1:27017", tmp_path)
+    assert collection.count_documents({}) == 2
+    assert collection.find_one({"creator": "alice"})["riddle"] == "new"
+    saver.save(make_card("first", "alice", "newer"))
+    assert collection.count_documents({"creator": "alice"}) == 1
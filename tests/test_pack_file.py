@@ -0,0 +1,164 @@
+import os
+from pathlib import Path
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card
+from card_id import CardID
+from crypt_image import CryptImage
+from pack_file import PACK_HEADER, RECORD_HEADER, PackFile
+from saver import Saver
+
+
+def make_card(name: str, creator: str, riddle: str = "riddle") -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, riddle, "solution")
+
+
+@pytest.fixture
+def pack(tmp_path):
+    pack = PackFile(tmp_path / "cards.pack")
+    pack.append_many([make_card("first", "alice"), make_card("second", "alice")])
+    pack.append(make_card("third", "bob"))
+    yield pack
+    pack.close()
+
+
+def test_round_trip(pack):
+    card = pack.load(CardID("first", "alice"))
+    assert (card.name, card.creator, card.riddle) == ("first", "alice", "riddle")
+    assert card.solution == "solution"
+    assert card.image.pixels.tobytes() == bytes([10, 20, 30, 255]) * 64
+    assert len(pack) == 3 and pack.version == 3
+
+
+def test_encrypted_card_decrypts(pack):
+    card = make_card("secret", "alice")
+    card.encrypt()
+    pack.append(card, "zlib")
+    loaded = pack.load(CardID("secret", "alice"))
+    assert loaded.image.decrypt("solution")
+    assert loaded.image.pixels.tobytes() == bytes([10, 20, 30, 255]) * 64
+
+
+def test_overwrite_and_remove(pack):
+    pack.append(make_card("first", "alice", "new riddle"))
+    pack.remove(CardID("second", "alice"))
+    assert pack.load(CardID("first", "alice")).riddle == "new riddle"
+    assert CardID("second", "alice") not in pack
+    with pytest.raises(KeyError):
+        pack.load(CardID("second", "alice"))
+
+
+def test_iteration_in_storage_order(pack):
+    pack.append(make_card("first", "alice", "new riddle"))
+    assert [card.name for card in pack] == ["second", "third", "first"]
+
+
+@pytest.mark.parametrize("stale_index", [False, True])
+def test_reopen(pack, tmp_path, stale_index):
+    pack.write_index()
+    if stale_index:
+        pack.append(make_card("fourth", "carol"))
+    else:
+        pack.index_path.unlink()
+    with PackFile(tmp_path / "cards.pack") as reopened:
+        assert set(reopened.entries) == set(pack.entries)
+        assert reopened.version == pack.version
+
+
+def test_shared_between_processes(pack, tmp_path):
+    with PackFile(tmp_path / "cards.pack") as other:
+        other.append(make_card("fourth", "carol"))
+    assert pack.load(CardID("fourth", "carol")).creator == "carol"
+
+
+def test_torn_tail_truncated(pack, tmp_path):
+    path = tmp_path / "cards.pack"
+    size = path.stat().st_size
+    with open(path, "ab") as pack_file:
+        pack_file.write(b"\x00" * 20)
+    with PackFile(path) as reopened:
+        assert len(reopened) == 3
+        assert path.stat().st_size == size
+        reopened.append(make_card("fourth", "carol"))
+    with PackFile(path) as reopened:
+        assert len(reopened) == 4
+
+
+def test_torn_record_followed_by_appends(pack, tmp_path):
+    path = tmp_path / "cards.pack"
+    with open(path, "ab") as pack_file:
+        # Another writer killed in the middle of a record.
+        pack_file.write(RECORD_HEADER.pack(0, 100, 100, 0) + b"{")
+    pack.append(make_card("fourth", "carol"))
+    assert CardID("fourth", "carol") in pack
+    with PackFile(path) as reopened:
+        assert len(reopened) == 4
+
+
+def test_failed_write_truncated(pack, tmp_path, monkeypatch):
+    size = (tmp_path / "cards.pack").stat().st_size
+
+    def short_writev(descriptor, buffers):
+        return os.write(descriptor, buffers[0])
+
+    monkeypatch.setattr(os, "writev", short_writev)
+    with pytest.raises(OSError):
+        pack.append_many([make_card("fourth", "carol"), make_card("fifth", "carol")])
+    assert (tmp_path / "cards.pack").stat().st_size == size
+    monkeypatch.undo()
+    pack.append(make_card("sixth", "carol"))
+    assert len(pack) == 4
+
+
+def test_corrupt_record_not_truncated(pack, tmp_path):
+    path = tmp_path / "cards.pack"
+    data = bytearray(path.read_bytes())
+    data[PACK_HEADER.size + RECORD_HEADER.size] ^= 0xFF
+    path.write_bytes(data)
+    with pytest.raises(RuntimeError):
+        PackFile(path)
+    assert path.read_bytes() == data
+
+
+def test_compact(pack, tmp_path):
+    other = PackFile(tmp_path / "cards.pack")
+    old_card = pack.load(CardID("first", "alice"))
+    pack.append(make_card("first", "alice", "new riddle"))
+    pack.remove(CardID("third", "bob"))
+    version = pack.version
+    assert pack.compact() > 0
+    assert pack.version == version
+    assert [card.name for card in pack] == ["second", "first"]
+    # Cards loaded before keep the old pack mapped.
+    assert old_card.riddle == "riddle" and old_card.image.pixels.tobytes()
+    # Other handles reopen the compacted pack.
+    other.append(make_card("fourth", "carol"))
+    assert other.load(CardID("first", "alice")).riddle == "new riddle"
+    assert pack.load(CardID("fourth", "carol")).creator == "carol"
+    other.close()
+    with PackFile(tmp_path / "cards.pack") as reopened:
+        assert len(reopened) == 3
+        assert reopened.version == version + 1
+
+
+def test_saver(tmp_path):
+    saver = Saver(f"pack://{tmp_path / 'cards.pack'}?codec=zlib")
+    saver.save(make_card("first", "alice"))
+    saver.save_many([make_card("second", "alice"), make_card("third", "bob")])
+    assert saver.get_creators() == ["alice", "bob"]
+    assert saver.get_cards("alice", cursor="first") == ["second"]
+    version, _ = saver.get_catalogue_version()
+
+    image_path = saver.export_image(CardID("first", "alice"))
+    with Image.open(image_path) as image:
+        assert image.size == (8, 8)
+    saver.save(make_card("first", "alice", "new riddle"))
+    assert not os.path.exists(image_path)
+    metadata = saver.get_card_metadata(CardID("first", "alice"))
+    assert metadata["riddle"] == "new riddle"
+    assert Path(saver.export_image(CardID("first", "alice"))).exists()
+    assert saver.get_catalogue_version()[0] > version
@@ -0,0 +1,137 @@
+import threading
+import time
+import pytest
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+import save_queue
+from card import Card
+from crypt_image import CryptImage
+from saver import Saver
+from save_queue import QueueFullError, SaveQueue
+
+
+def make_card(name: str, creator: str = "creator") -> Card:
+    image = CryptImage(Image.new("RGBA", (8, 8), (10, 20, 30, 255)))
+    return Card(name, creator, image, "riddle", "solution")
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail(f"Timed out after {timeout} seconds.")
+        time.sleep(0.01)
+
+
+class FakeSaver:
+    def __init__(self, _url):
+        self.batches = []
+        self.failures = 0
+        self.released = threading.Event()
+        self.released.set()
+        FakeSaver.instances.append(self)
+
+    def save_many(self, cards):
+        self.released.wait()
+        if self.failures:
+            self.failures -= 1
+            raise OSError("database down")
+        self.batches.append([card.name for card in cards])
+
+
+@pytest.fixture
+def fake_saver(monkeypatch):
+    FakeSaver.instances = []
+    monkeypatch.setattr(save_queue, "Saver", FakeSaver)
+    return FakeSaver
+
+
+def test_saves_everything(tmp_path):
+    with SaveQueue(f"file://{tmp_path}", workers=2, batch_size=4) as queue:
+        for i in range(10):
+            queue.put(make_card(f"card{i}"))
+    assert queue.saved == 10
+    assert len(Saver(f"file://{tmp_path}").get_cards("creator")) == 10
+
+
+def test_batches(fake_saver):
+    queue = SaveQueue("fake://", workers=1, batch_size=3)
+    saver = fake_saver.instances[0]
+    saver.released.clear()
+    for i in range(7):
+        queue.put(make_card(f"card{i}"))
+    saver.released.set()
+    queue.close()
+    assert all(len(batch) <= 3 for batch in saver.batches)
+    assert len(saver.batches) <= 4
+    assert sum(len(batch) for batch in saver.batches) == 7
+
+
+def test_retry(fake_saver):
+    queue = SaveQueue("fake://", workers=1, retries=2, retry_delay=0)
+    fake_saver.instances[0].failures = 2
+    queue.put(make_card("card"))
+    queue.close()
+    assert fake_saver.instances[0].batches == [["card"]]
+
+
+def test_failure_reported(fake_saver):
+    errors = []
+    queue = SaveQueue(
+        "fake://",
+        workers=1,
+        retries=1,
+        retry_delay=0,
+        on_error=lambda cards, error: errors.append((len(cards), error)),
+    )
+    fake_saver.instances[0].failures = 2
+    queue.put(make_card("card"))
+    queue.close()
+    assert queue.failed == 1
+    assert len(errors) == 1
+
+
+def test_reject_when_full(fake_saver):
+    queue = SaveQueue("fake://", max_size=1, workers=1, policy="reject")
+    saver = fake_saver.instances[0]
+    saver.released.clear()
+    queue.put(make_card("taken by the worker"))
+    wait_until(lambda: not queue.qsize())
+    queue.put(make_card("queued"))
+    with pytest.raises(QueueFullError):
+        queue.put(make_card("rejected"))
+    saver.released.set()
+    queue.close()
+
+
+def test_spill_when_full(fake_saver, tmp_path, monkeypatch):
+    monkeypatch.setattr(save_queue, "SPILL_POLL_INTERVAL", 0.01)
+    queue = SaveQueue(
+        "fake://", max_size=1, workers=1, policy="spill", spill_dir=tmp_path
+    )
+    saver = fake_saver.instances[0]
+    saver.released.clear()
+    for i in range(4):
+        queue.put(make_card(f"card{i}"))
+    assert list(tmp_path.glob("*.card"))
+    saver.released.set()
+    queue.join()
+    wait_until(lambda: not list(tmp_path.glob("*.card")))
+    queue.close()
+    saved = sorted(name for batch in saver.batches for name in batch)
+    assert saved == [f"card{i}" for i in range(4)]
+
+
+def test_spilled_file_kept_until_saved(fake_saver, tmp_path):
+    queue = SaveQueue("fake://", workers=1, policy="spill", spill_dir=tmp_path)
+    queue.close()
+    queue._spill_entries([(make_card("card"), None)])
+    ((card, on_saved),) = queue._unspill()
+    assert card.name == "card"
+    # Not taken again while it is being saved, but still on disk.
+    assert not queue._unspill()
+    assert len(list(tmp_path.glob("*.card"))) == 1
+    on_saved()
+    assert not list(tmp_path.glob("*.card"))
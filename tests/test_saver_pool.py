@@ -0,0 +1,33 @@
+import threading
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from saver_pool import SaverPool
+
+
+def test_savers_reused(tmp_path):
+    setups = []
+    pool = SaverPool(f"file://{tmp_path}", size=2, setup=setups.append)
+    with pool.saver() as first:
+        with pool.saver() as second:
+            assert first is not second
+    with pool.saver() as saver:
+        assert saver in (first, second)
+    assert setups == [first, second]
+
+
+def test_pool_bounded(tmp_path):
+    pool = SaverPool(f"file://{tmp_path}", size=1)
+    saver = pool.acquire()
+    acquired = threading.Event()
+
+    def borrow():
+        with pool.saver():
+            acquired.set()
+
+    thread = threading.Thread(target=borrow)
+    thread.start()
+    assert not acquired.wait(0.1)
+    pool.release(saver)
+    assert acquired.wait(5)
+    thread.join()
@@ -0,0 +1,64 @@
+from PIL import Image
+
+# pylint: disable=missing-class-docstring, missing-function-docstring, invalid-name
+
+from card import Card
+from crypt_image import CryptImage
+from saver import Saver
+from thumbnail_cache import ThumbnailCache, ThumbnailPregenerator, thumbnail_width
+
+
+def save_image(path, width=600, height=300):
+    Image.new("RGB", (width, height), (10, 20, 30)).save(path)
+    return path
+
+
+def test_thumbnail_width():
+    assert thumbnail_width(1) == 64
+    assert thumbnail_width(200) == 256
+    assert thumbnail_width(256) == 256
+    assert thumbnail_width(100000) is None
+
+
+def test_thumbnail(tmp_path):
+    image_path = save_image(tmp_path / "image.jpg")
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+    thumbnail_path = cache.get(image_path, 128)
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.size == (128, 64)
+    assert cache.get(image_path, 128) == thumbnail_path
+
+    save_image(image_path, 300, 300)
+    assert cache.get(image_path, 128) != thumbnail_path
+
+
+def test_eviction(tmp_path):
+    image_path = save_image(tmp_path / "image.jpg")
+    cache = ThumbnailCache(tmp_path / "thumbnails", max_bytes=1)
+    cache.get(image_path, 64)
+    newest = cache.get(image_path, 128)
+    assert list(cache.directory.glob("*.jpg")) == [newest]
+
+
+def test_pregenerate_on_save(tmp_path):
+    saver_url = f"file://{tmp_path / 'cards'}"
+    saver = Saver(saver_url)
+    pregenerator = ThumbnailPregenerator(
+        ThumbnailCache(tmp_path / "thumbnails"), saver_url
+    )
+    saver.add_save_listener(pregenerator.submit)
+    image = CryptImage(Image.new("RGBA", (600, 300)))
+    saver.save(Card("name", "creator", image, "riddle", "solution"))
+    pregenerator.join()
+    assert len(list(pregenerator.cache.directory.glob("*.jpg"))) == 1
+    # A card that can't be exported fails only in the background.
+    pregenerator.submit(Card("missing", "creator", image, "riddle"))
+    pregenerator.close()
+
+
+def test_listener_failure_doesnt_fail_save(tmp_path):
+    saver = Saver(f"file://{tmp_path / 'cards'}")
+    saver.add_save_listener(lambda card: 1 / 0)
+    image = CryptImage(Image.new("RGBA", (8, 8)))
+    saver.save(Card("name", "creator", image, "riddle", "solution"))
+    assert saver.get_cards("creator") == ["name"]
@@ -0,0 +1,188 @@
+"""
+Author: Eyal Roginski
+Description: Resized card images, generated on demand and cached on disk.
+
+A thumbnail is stored under the hash of its source image's identity (path, inode,
+modification time and size) and its width, so it is never served for a different
+image, and a rewritten source simply misses the cache. The cache is bounded in
+size, and evicts the least recently used thumbnails first.
+"""
+
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from PIL import Image
+from card import Card
+from card_id import CardID
+from saver import Saver
+
+# Requested widths are rounded up to one of these, so clients can't fill the cache
+# with every possible width.
+THUMBNAIL_WIDTHS = (64, 128, 256, 512, 1024)
+# The widths generated in the background once a card is saved.
+PREGENERATED_WIDTHS = (256,)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# How many saved cards may wait for their thumbnails before more are skipped.
+DEFAULT_MAX_PENDING = 1024
+THUMBNAIL_QUALITY = 85
+
+
+def default_directory() -> Path:
+    """Where thumbnails are cached by default."""
+    return Path(tempfile.gettempdir()) / "cardazim-thumbnails"
+
+
+def thumbnail_width(requested_width: int) -> int | None:
+    """
+    The width to generate for `requested_width`, or None if it is larger than every
+    thumbnail, so the full image should be used.
+    """
+    for width in THUMBNAIL_WIDTHS:
+        if width >= requested_width:
+            return width
+    return None
+
+
+class ThumbnailCache:
+    """
+    Thumbnails cached in `directory`, up to `max_bytes` of them in total. Safe to
+    use from several threads and processes.
+    """
+
+    def __init__(
+        self, directory: str | Path = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = Path(directory) if directory else default_directory()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = sum(
+            path.stat().st_size for path in self.directory.glob("*.jpg")
+        )
+
+    def get(self, image_path: str | Path, width: int) -> Path:
+        """
+        Get the path of a thumbnail of the image at `image_path`, `width` pixels
+        wide, generating it if it isn't cached. Raises `OSError` if the image is
+        missing.
+        """
+        image_path = Path(image_path)
+        thumbnail_path = self._thumbnail_path(image_path, width)
+        try:
+            # Mark the thumbnail as recently used, for eviction.
+            os.utime(thumbnail_path)
+            return thumbnail_path
+        except FileNotFoundError:
+            pass
+
+        temporary_path = thumbnail_path.with_name(
+            f".{thumbnail_path.stem}.{uuid.uuid4().hex}.tmp"
+        )
+        with Image.open(image_path) as image:
+            height = max(round(image.height * width / image.width), 1)
+            # Let the JPEG decoder downscale while decoding, which is much faster
+            # than decoding the full image and resizing it.
+            image.draft("RGB", (width, height))
+            image.thumbnail((width, height))
+            image.convert("RGB").save(temporary_path, "JPEG", quality=THUMBNAIL_QUALITY)
+        os.replace(temporary_path, thumbnail_path)
+        with self._lock:
+            self._total_bytes += thumbnail_path.stat().st_size
+        self._evict(keep=thumbnail_path)
+        return thumbnail_path
+
+    def pregenerate(self, image_path: str | Path):
+        """Generate the `PREGENERATED_WIDTHS` thumbnails of an image."""
+        for width in PREGENERATED_WIDTHS:
+            self.get(image_path, width)
+
+    def _thumbnail_path(self, image_path: Path, width: int) -> Path:
+        stat = image_path.stat()
+        identity = (
+            f"{image_path.resolve()}:{stat.st_ino}:{stat.st_mtime_ns}:"
+            f"{stat.st_size}:{width}"
+        )
+        digest = hashlib.sha256(identity.encode(errors="surrogateescape")).hexdigest()
+        return self.directory / f"{digest}.jpg"
+
+    def _evict(self, keep: Path):
+        """
+        Remove the least recently used thumbnails until the cache fits, except for
+        `keep`, which is about to be used.
+        """
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            thumbnails = []
+            for path in self.directory.glob("*.jpg"):
+                try:
+                    thumbnails.append((path.stat(), path))
+                except FileNotFoundError:
+                    continue
+            thumbnails.sort(key=lambda thumbnail: thumbnail[0].st_mtime_ns)
+            # Recount, since other processes may share the directory.
+            self._total_bytes = sum(stat.st_size for stat, _ in thumbnails)
+            for stat, path in thumbnails:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                path.unlink(missing_ok=True)
+                self._total_bytes -= stat.st_size
+
+
+class ThumbnailPregenerator:
+    """
+    Pregenerates the thumbnails of saved cards into `cache` in a background thread,
+    exporting their images with its own Saver at `saver_url`, so saving a card
+    neither waits for nor fails with it. Up to `max_pending` cards wait, and more
+    are skipped, as their thumbnails are still generated on demand.
+    """
+
+    def __init__(
+        self,
+        cache: ThumbnailCache,
+        saver_url: str,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self.cache = cache
+        self.saver = Saver(saver_url)
+        self._queue: queue.Queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(
+            target=self._work, name="ThumbnailPregenerator", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, card: Card):
+        """Pregenerate the thumbnails of a saved card, as a save listener."""
+        try:
+            self._queue.put_nowait(CardID.from_card(card))
+        except queue.Full:
+            pass
+
+    def join(self):
+        """Wait until the thumbnails of every submitted card were generated."""
+        self._queue.join()
+
+    def close(self):
+        """Generate the thumbnails of the submitted cards, and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            card_id = self._queue.get()
+            try:
+                if card_id is None:
+                    return
+                self.cache.pregenerate(self.saver.export_image(card_id))
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(
+                    f"Failed to pregenerate thumbnails of {card_id.resolve()}: {error}"
+                )
+            finally:
+                self._queue.task_done()